@@ -8,6 +8,33 @@ import sqlite3
 import os
 import sys
 
+def crear_indice_slot(cursor):
+    """Crear el índice único idx_turnos_slot si falta. Si hay horarios con más de un
+    turno activo el índice fallaría: no se crea y se informan. Devuelve True si lo creó"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_turnos_slot'")
+    if cursor.fetchone():
+        print("✅ Índice 'idx_turnos_slot' ya existe")
+        return False
+    cursor.execute("""
+        SELECT medico, fecha_turno, hora_turno, COUNT(*)
+        FROM turnos WHERE estado != 'ausente'
+        GROUP BY medico, fecha_turno, hora_turno
+        HAVING COUNT(*) > 1
+    """)
+    duplicados = cursor.fetchall()
+    if duplicados:
+        print(f"⚠️ No se creó 'idx_turnos_slot': hay {len(duplicados)} horario(s) con turnos duplicados")
+        for medico, fecha, hora, cantidad in duplicados[:20]:
+            print(f"   - {medico} {fecha} {hora}: {cantidad} turnos")
+        print("   Resolver los duplicados (p. ej. marcar como 'ausente') y volver a ejecutar")
+        return False
+    print("📋 Creando índice único 'idx_turnos_slot'...")
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_turnos_slot
+        ON turnos (medico, fecha_turno, hora_turno) WHERE estado != 'ausente'
+    """)
+    return True
+
 def actualizar_base_datos():
     """Actualizar la base de datos con nuevas tablas"""
     
@@ -52,6 +79,29 @@ def actualizar_base_datos():
         else:
             print("✅ Tabla 'bloqueos_agenda' ya existe")
         
+        # Tabla de reglas de agenda recurrentes
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='agenda_reglas'")
+        if not cursor.fetchone():
+            print("📋 Creando tabla 'agenda_reglas'...")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS agenda_reglas (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    medico TEXT NOT NULL,
+                    dia_semana TEXT NOT NULL,
+                    hora_inicio TEXT NOT NULL,
+                    hora_fin TEXT NOT NULL,
+                    intervalo_min INTEGER NOT NULL,
+                    vigente_desde TEXT,
+                    vigente_hasta TEXT,
+                    activo INTEGER DEFAULT 1,
+                    fecha_creacion TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_agenda_reglas_medico ON agenda_reglas (medico, dia_semana)")
+            cambios_realizados.append("✅ Tabla 'agenda_reglas' creada")
+        else:
+            print("✅ Tabla 'agenda_reglas' ya existe")
+        
         # Verificar y agregar columna 'activo' a usuarios si no existe
         cursor.execute("PRAGMA table_info(usuarios)")
         columnas = [col[1] for col in cursor.fetchall()]
@@ -84,6 +134,99 @@ def actualizar_base_datos():
         else:
             print("✅ Columna 'email' ya existe en 'pacientes'")
         
+        # Índice para limpieza de turnos vencidos y filtros por estado/fecha
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_turnos_estado_fecha'")
+        if not cursor.fetchone():
+            print("📋 Creando índice 'idx_turnos_estado_fecha'...")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_turnos_estado_fecha ON turnos (estado, fecha_turno, hora_turno)")
+            cambios_realizados.append("✅ Índice 'idx_turnos_estado_fecha' creado")
+        else:
+            print("✅ Índice 'idx_turnos_estado_fecha' ya existe")
+        
+        # Turnos 'pendiente' (los creaba la agenda): mismo estado que 'sin atender'
+        cursor.execute("UPDATE turnos SET estado = 'sin atender' WHERE lower(estado) = 'pendiente'")
+        if cursor.rowcount > 0:
+            cambios_realizados.append(f"✅ {cursor.rowcount} turnos 'pendiente' pasados a 'sin atender'")
+        
+        # Índice único de horario: evita doble reserva del mismo médico/fecha/hora
+        if crear_indice_slot(cursor):
+            cambios_realizados.append("✅ Índice único 'idx_turnos_slot' creado")
+        
+        # Índices de búsqueda por paciente y fecha (recepción y cobro) y del tablero del médico
+        for nombre_indice, sql_indice in [
+            ("idx_turnos_dni_fecha", "CREATE INDEX IF NOT EXISTS idx_turnos_dni_fecha ON turnos (dni_paciente, fecha_turno, hora_turno)"),
+            ("idx_pagos_dni_fecha", "CREATE INDEX IF NOT EXISTS idx_pagos_dni_fecha ON pagos (dni_paciente, fecha_pago)"),
+            ("idx_turnos_medico_fecha", "CREATE INDEX IF NOT EXISTS idx_turnos_medico_fecha ON turnos (medico, fecha_turno, hora_turno, estado)"),
+        ]:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name=?", (nombre_indice,))
+            if not cursor.fetchone():
+                print(f"📋 Creando índice '{nombre_indice}'...")
+                cursor.execute(sql_indice)
+                cambios_realizados.append(f"✅ Índice '{nombre_indice}' creado")
+            else:
+                print(f"✅ Índice '{nombre_indice}' ya existe")
+        
+        # Índice de la línea de tiempo de historias clínicas (si la tabla ya existe)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='historias_clinicas'")
+        if cursor.fetchone():
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_historias_dni'")
+            if not cursor.fetchone():
+                print("📋 Creando índice 'idx_historias_dni'...")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_historias_dni ON historias_clinicas (dni, fecha_consulta)")
+                cambios_realizados.append("✅ Índice 'idx_historias_dni' creado")
+            else:
+                print("✅ Índice 'idx_historias_dni' ya existe")
+            
+            # Consultas comprimidas: diccionarios y largo de cada consulta para la línea de tiempo
+            from notas_historias import preparar_historias
+            cambios_notas = preparar_historias(cursor)
+            if cambios_notas:
+                cambios_realizados.extend(f"✅ {cambio}" for cambio in cambios_notas)
+            else:
+                print("✅ Columnas de compresión de historias ya existen")
+        
+        # Columnas normalizadas e índices para la búsqueda de pacientes
+        from busqueda_pacientes import crear_indices_busqueda
+        cambios_busqueda = crear_indices_busqueda(cursor)
+        if cambios_busqueda:
+            cambios_realizados.extend(f"✅ {cambio}" for cambio in cambios_busqueda)
+        else:
+            print("✅ Índices de búsqueda de pacientes ya existen")
+        
+        # Campos derivados (incompleto, registro_rapido) calculados por SQLite
+        from pacientes_derivados import crear_columnas_derivadas
+        cambios_derivados = crear_columnas_derivadas(cursor)
+        if cambios_derivados:
+            cambios_realizados.extend(f"✅ {cambio}" for cambio in cambios_derivados)
+        else:
+            print("✅ Columnas derivadas de pacientes ya existen")
+        
+        # Tablas de archivo (turnos/pagos históricos) y vistas UNION para reportes
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='view' AND name IN ('turnos_todos', 'pagos_todos')")
+        vistas = {row[0] for row in cursor.fetchall()}
+        from archivar_historicos import crear_esquema_archivo
+        crear_esquema_archivo(cursor)
+        if len(vistas) < 2:
+            cambios_realizados.append("✅ Tablas de archivo y vistas 'turnos_todos'/'pagos_todos' creadas")
+        else:
+            print("✅ Tablas de archivo y vistas ya existen")
+        
+        # Cache de reportes de meses cerrados (con triggers de invalidación)
+        from reportes_cache import crear_tabla_reportes_cache
+        cambios_cache = crear_tabla_reportes_cache(cursor)
+        if cambios_cache:
+            cambios_realizados.extend(f"✅ {cambio}" for cambio in cambios_cache)
+        else:
+            print("✅ Tabla 'reportes_cache' ya existe")
+        
+        # Versiones de las caches en memoria (invalidación entre procesos)
+        from versiones_cache import crear_tabla_versiones
+        cambios_versiones = crear_tabla_versiones(cursor)
+        if cambios_versiones:
+            cambios_realizados.extend(f"✅ {cambio}" for cambio in cambios_versiones)
+        else:
+            print("✅ Tabla 'versiones_cache' ya existe")
+        
         conn.commit()
         
         print("-" * 60)
@@ -2,6 +2,8 @@ import json
 import os
 from datetime import datetime, timedelta
 import sqlite3
+
+from agenda_diff import diff_agenda
  
 DB_PATH = "data/consultorio.db"
  
@@ -29,12 +31,15 @@ def guardar_horarios_medico(medico: str, nombre_dia: str, horas: list[str]):
     c = conn.cursor()
     try:
         with conn:
-            c.execute("DELETE FROM agenda WHERE medico=? AND dia=?", (medico, nombre_dia))
-            for hora in horas:
-                c.execute(
-                    "INSERT OR IGNORE INTO agenda (medico, dia, hora) VALUES (?, ?, ?)",
-                    (medico, nombre_dia, hora),
-                )
+            # Solo borrar/insertar lo que cambió; las filas que quedan conservan su id
+            c.execute("SELECT id, dia, hora FROM agenda WHERE medico=? AND dia=?", (medico, nombre_dia))
+            actuales = {(d, h): agenda_id for agenda_id, d, h in c.fetchall()}
+            borrar, insertar, _ = diff_agenda(actuales, [(nombre_dia, hora) for hora in horas])
+            c.executemany("DELETE FROM agenda WHERE id=?", borrar)
+            c.executemany(
+                "INSERT OR IGNORE INTO agenda (medico, dia, hora) VALUES (?, ?, ?)",
+                [(medico, d, h) for d, h in insertar],
+            )
     finally:
         conn.close()
  
@@ -1,6 +1,8 @@
 from flask import Flask, request, jsonify
 import sqlite3
 
+from agenda_diff import diff_agenda
+
 app = Flask(__name__)
 
 HORARIOS_VALIDOS = [f"{h:02d}:{m:02d}" for h in range(9, 19+1) for m in (0, 30)]
@@ -29,12 +31,15 @@ def guardar_agenda_para_dia(medico: str, dia: str, horas: list[str]):
     c = conn.cursor()
     try:
         with conn:
-            c.execute("DELETE FROM agenda WHERE medico=? AND dia=?", (medico, dia))
-            for hora in horas:
-                c.execute(
-                    "INSERT OR IGNORE INTO agenda (medico, dia, hora) VALUES (?, ?, ?)",
-                    (medico, dia, hora),
-                )
+            # Solo borrar/insertar lo que cambió; las filas que quedan conservan su id
+            c.execute("SELECT id, dia, hora FROM agenda WHERE medico=? AND dia=?", (medico, dia))
+            actuales = {(d, h): agenda_id for agenda_id, d, h in c.fetchall()}
+            borrar, insertar, _ = diff_agenda(actuales, [(dia, hora) for hora in horas])
+            c.executemany("DELETE FROM agenda WHERE id=?", borrar)
+            c.executemany(
+                "INSERT OR IGNORE INTO agenda (medico, dia, hora) VALUES (?, ?, ?)",
+                [(medico, d, h) for d, h in insertar],
+            )
     finally:
         conn.close()
 
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Diferencia entre la agenda guardada y la pedida.
+
+Al reemplazar la agenda de un médico solo se borran los horarios que ya no
+están y se insertan los nuevos; las filas que se mantienen conservan su id y
+su flag `activo`. Lo usan app.py, agenda.py y admin_agenda.py (cada uno con
+su propio SQL, porque las tablas de los scripts viejos usan otras columnas).
+"""
+
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+def diff_agenda(
+    actuales: Dict[Tuple[str, str], int],
+    nueva: Iterable[Tuple[str, str]],
+) -> Tuple[List[Tuple[int]], List[Tuple[str, str]], Set[str]]:
+    """Comparar {(dia, horario): id} guardados contra los (dia, horario) pedidos.
+
+    Devuelve (ids a borrar, (dia, horario) a insertar, días afectados), listos
+    para executemany.
+    """
+    nueva = {(dia, horario.strip()) for dia, horario in nueva if horario and horario.strip()}
+    borrar = sorted(clave for clave in actuales if clave not in nueva)
+    insertar = sorted(clave for clave in nueva if clave not in actuales)
+    dias_afectados = {dia for dia, _ in borrar} | {dia for dia, _ in insertar}
+    return [(actuales[clave],) for clave in borrar], insertar, dias_afectados
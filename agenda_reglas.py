@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Reglas de agenda recurrentes.
+
+En lugar de guardar una fila por horario, una regla describe un rango del día
+con un intervalo fijo ("LUNES de 08:00 a 12:00 cada 15 minutos"), opcionalmente
+limitado a un período de vigencia. Los horarios se generan recién cuando se
+consulta una fecha, así guardar y evaluar la agenda de un médico cuesta
+O(reglas) y cambiar el intervalo es actualizar una sola fila.
+
+Las reglas son diccionarios con las columnas de la tabla `agenda_reglas`:
+dia_semana, hora_inicio, hora_fin, intervalo_min, vigente_desde, vigente_hasta.
+"""
+
+import heapq
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+DIAS_SEMANA = ["LUNES", "MARTES", "MIERCOLES", "JUEVES", "VIERNES", "SABADO", "DOMINGO"]
+INTERVALO_MIN = 5
+INTERVALO_MAX = 240
+
+
+def dia_semana_de(fecha: str) -> str:
+    """Día de la semana en español (mayúsculas, sin tilde) de una fecha ISO"""
+    return DIAS_SEMANA[date.fromisoformat(fecha).weekday()]
+
+
+def _minutos(hora: str) -> int:
+    horas, minutos = hora.split(":")
+    return int(horas) * 60 + int(minutos)
+
+
+def _hora(minutos: int) -> str:
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+
+def generar_horarios(hora_inicio: str, hora_fin: str, intervalo_min: int) -> Iterator[str]:
+    """Horarios "HH:MM" desde hora_inicio (incluida) hasta hora_fin (excluida)"""
+    fin = _minutos(hora_fin)
+    actual = _minutos(hora_inicio)
+    while actual < fin:
+        yield _hora(actual)
+        actual += intervalo_min
+
+
+def regla_vigente(regla: Dict[str, Any], fecha: str) -> bool:
+    """True si la regla aplica a la fecha ISO (mismo día de la semana y dentro de la vigencia)"""
+    if regla["dia_semana"] != dia_semana_de(fecha):
+        return False
+    if regla.get("vigente_desde") and fecha < regla["vigente_desde"]:
+        return False
+    if regla.get("vigente_hasta") and fecha > regla["vigente_hasta"]:
+        return False
+    return True
+
+
+def horarios_de_reglas(reglas: Iterable[Dict[str, Any]], fecha: str) -> Iterator[str]:
+    """Horarios ordenados y sin repetir que generan las reglas vigentes en `fecha`"""
+    generadores = [
+        generar_horarios(r["hora_inicio"], r["hora_fin"], r["intervalo_min"])
+        for r in reglas if regla_vigente(r, fecha)
+    ]
+    anterior = None
+    for hora in heapq.merge(*generadores):
+        if hora != anterior:
+            yield hora
+            anterior = hora
+
+
+def incluye_horario(reglas: Iterable[Dict[str, Any]], fecha: str, hora: str) -> bool:
+    """True si alguna regla vigente en `fecha` genera `hora` (sin expandir los horarios)"""
+    try:
+        minutos = _minutos(hora)
+    except ValueError:
+        return False
+    for r in reglas:
+        if not regla_vigente(r, fecha):
+            continue
+        inicio = _minutos(r["hora_inicio"])
+        if inicio <= minutos < _minutos(r["hora_fin"]) and (minutos - inicio) % r["intervalo_min"] == 0:
+            return True
+    return False
+
+
+def _validar_hora(valor: Any) -> Optional[str]:
+    try:
+        return datetime.strptime(str(valor).strip(), "%H:%M").strftime("%H:%M")
+    except ValueError:
+        return None
+
+
+def _validar_fecha(valor: Any) -> Tuple[Optional[str], bool]:
+    """(fecha ISO o None, válida)"""
+    if valor in (None, ""):
+        return None, True
+    try:
+        return date.fromisoformat(str(valor).strip()).isoformat(), True
+    except ValueError:
+        return None, False
+
+
+def validar_regla(data: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Normalizar una regla recibida por la API. Devuelve (regla, None) o (None, error)"""
+    if not isinstance(data, dict):
+        return None, "Cada regla debe ser un objeto"
+
+    dia = str(data.get("dia_semana", "")).strip().upper()
+    dia = dia.replace("É", "E").replace("Á", "A")
+    if dia not in DIAS_SEMANA:
+        return None, f"Día inválido: '{data.get('dia_semana')}'"
+
+    hora_inicio = _validar_hora(data.get("hora_inicio"))
+    hora_fin = _validar_hora(data.get("hora_fin"))
+    if not hora_inicio or not hora_fin:
+        return None, "hora_inicio y hora_fin deben tener formato HH:MM"
+    if hora_fin <= hora_inicio:
+        return None, "hora_fin debe ser posterior a hora_inicio"
+
+    try:
+        intervalo = int(data.get("intervalo_min"))
+    except (ValueError, TypeError):
+        return None, "intervalo_min debe ser un número de minutos"
+    if not INTERVALO_MIN <= intervalo <= INTERVALO_MAX:
+        return None, f"intervalo_min debe estar entre {INTERVALO_MIN} y {INTERVALO_MAX}"
+
+    desde, ok_desde = _validar_fecha(data.get("vigente_desde"))
+    hasta, ok_hasta = _validar_fecha(data.get("vigente_hasta"))
+    if not ok_desde or not ok_hasta:
+        return None, "Las fechas de vigencia deben tener formato YYYY-MM-DD"
+    if desde and hasta and hasta < desde:
+        return None, "vigente_hasta debe ser igual o posterior a vigente_desde"
+
+    return {
+        "dia_semana": dia,
+        "hora_inicio": hora_inicio,
+        "hora_fin": hora_fin,
+        "intervalo_min": intervalo,
+        "vigente_desde": desde,
+        "vigente_hasta": hasta,
+    }, None
+
+
+def horarios_semana(reglas: Iterable[Dict[str, Any]], desde: str) -> Dict[str, List[str]]:
+    """Horarios por día de la semana de las reglas que siguen vigentes a partir de `desde`
+    (vista resumida para la UI que todavía trabaja con una lista de horas por día)"""
+    por_dia: Dict[str, set] = {}
+    for r in reglas:
+        if r.get("vigente_hasta") and r["vigente_hasta"] < desde:
+            continue
+        por_dia.setdefault(r["dia_semana"], set()).update(
+            generar_horarios(r["hora_inicio"], r["hora_fin"], r["intervalo_min"])
+        )
+    return {dia: sorted(horas) for dia, horas in por_dia.items()}
@@ -1,17 +1,32 @@
 # Sistema de consultorio médico - Solo SQLite - VERSION CON DEBUG AVANZADO
 
 import sqlite3
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, make_response, send_file
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, make_response, send_file, has_request_context
 import json
 import os
+import hashlib
 import csv
 import io
 import shutil
+import pathlib
 import time
 import threading
+import random
+import bisect
 from functools import wraps
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from datetime import datetime, date, timezone, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
+from agenda_diff import diff_agenda
+from escritor_unico import ComandoEnCurso
+from pacientes_derivados import SQL_EDAD
+from registros import Registro, Pago, Usuario, a_json
+from repositorios import COLUMNAS_REGLA, Repositorios, crear_backend
+from flask.json.provider import DefaultJSONProvider
+from agenda_reglas import dia_semana_de, horarios_de_reglas, incluye_horario, validar_regla
+from reportes_cache import rango_mes, resultados_por_mes
+from notas_historias import valores_nota
+from versiones_cache import leer_versiones
 import pytz
 import smtplib
 from email.mime.text import MIMEText
@@ -25,7 +40,17 @@ except ImportError:
     print("⚠️ python-dotenv no está instalado. Instala con: pip install python-dotenv")
     print("   O configura las variables de entorno manualmente.")
 
+class ProveedorJSON(DefaultJSONProvider):
+    """jsonify() que además serializa registros (registros.py) anidados en dicts o listas"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Registro):
+            return o.a_dict()
+        return DefaultJSONProvider.default(o)
+
 app = Flask(__name__)
+app.json = ProveedorJSON(app)
 app.secret_key = os.environ.get("SECRET_KEY", "clave_insegura_dev")
 
 # Configurar sesión persistente
@@ -111,247 +136,253 @@ def get_db_connection():
                 continue
             raise
 
+# Lecturas de entidades a través de los repositorios (repositorios.py). Las escrituras
+# (ejecutar_comando, SAVEPOINT/BEGIN IMMEDIATE) todavía usan SQLite directamente, así que
+# la app solo arranca con DB_BACKEND=sqlite hasta que se migren.
+repos = Repositorios(crear_backend(get_db_path))
+if repos.backend.dialecto != "sqlite":
+    raise RuntimeError("DB_BACKEND=postgresql todavía no está soportado por app.py: las escrituras usan SQLite")
+
+# Modo reportes: las consultas de administración leen una copia de solo lectura
+# refrescada periódicamente con la API de backup, para no competir con las escrituras
+REPORTES_SNAPSHOT = os.environ.get("REPORTES_SNAPSHOT", "").lower() in ["1", "true", "yes"]
+REPORTES_SNAPSHOT_SEGUNDOS = int(os.environ.get("REPORTES_SNAPSHOT_SEGUNDOS", 300))
+_snapshot_lock = threading.Lock()
+
+def get_snapshot_path():
+    """Ruta del snapshot de reportes (junto a la base principal)"""
+    base, ext = os.path.splitext(get_db_path())
+    return f"{base}_reportes{ext}"
+
+def refrescar_snapshot_reportes(forzar=False):
+    """Regenerar el snapshot si no existe o tiene más de REPORTES_SNAPSHOT_SEGUNDOS"""
+    snapshot_path = get_snapshot_path()
+    with _snapshot_lock:
+        if not forzar and os.path.exists(snapshot_path):
+            if time.time() - os.path.getmtime(snapshot_path) < REPORTES_SNAPSHOT_SEGUNDOS:
+                return snapshot_path
+
+        inicio = time.perf_counter()
+        # Archivo temporal por proceso: varios workers de gunicorn pueden refrescar a la vez
+        tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        origen = get_db_connection()
+        try:
+            destino = sqlite3.connect(tmp_path)
+            try:
+                origen.backup(destino)
+                # Sin WAL: el snapshot se abre con immutable=1 y no debe depender de -wal/-shm
+                destino.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                destino.close()
+        finally:
+            origen.close()
+        os.replace(tmp_path, snapshot_path)
+        print(f"DEBUG: Snapshot de reportes actualizado en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+        return snapshot_path
+
+def get_reportes_connection():
+    """Conexión para reportes: snapshot de solo lectura si REPORTES_SNAPSHOT está activo"""
+    if not REPORTES_SNAPSHOT:
+        return get_db_connection()
+    try:
+        snapshot_path = refrescar_snapshot_reportes()
+    except Exception as e:
+        print(f"⚠️ No se pudo refrescar el snapshot de reportes, usando base principal: {e}")
+        return get_db_connection()
+
+    uri = f"{pathlib.Path(snapshot_path).absolute().as_uri()}?mode=ro&immutable=1"
+    conn = sqlite3.connect(uri, uri=True)
+    # El archivo no cambia mientras está abierto: cache grande y mmap sin riesgo
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA query_only=1")
+    return conn
+
+# Transacciones de escritura: BEGIN IMMEDIATE + reintento de toda la unidad de trabajo
+# con backoff si la base está ocupada. El busy_timeout es corto para que la espera la
+# controle el reintento (y quede medida) en lugar de bloquear 30 s en el driver.
+ESCRITURA_MAX_INTENTOS = int(os.environ.get("ESCRITURA_MAX_INTENTOS", 5))
+ESCRITURA_BUSY_TIMEOUT_MS = int(os.environ.get("ESCRITURA_BUSY_TIMEOUT_MS", 2000))
+# Límites superiores (ms) de los buckets del histograma de espera por lock
+ESPERA_LOCK_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+_metricas_escritura = {}
+_metricas_lock = threading.Lock()
+
+def es_error_bloqueo(e):
+    """True si el error de SQLite es SQLITE_BUSY / 'database is locked'"""
+    codigo = getattr(e, "sqlite_errorcode", None)
+    if codigo is not None and codigo & 0xFF == sqlite3.SQLITE_BUSY:
+        return True
+    return "database is locked" in str(e) or "database is busy" in str(e)
+
+def registrar_espera_lock(endpoint, espera_ms, reintentos, fallo=False):
+    """Acumular la espera por el lock de escritura en el histograma del endpoint"""
+    with _metricas_lock:
+        m = _metricas_escritura.get(endpoint)
+        if m is None:
+            m = _metricas_escritura[endpoint] = {
+                "buckets": [0] * (len(ESPERA_LOCK_BUCKETS_MS) + 1),
+                "transacciones": 0,
+                "reintentos": 0,
+                "fallos": 0,
+                "espera_total_ms": 0.0,
+                "espera_max_ms": 0.0,
+            }
+        m["buckets"][bisect.bisect_left(ESPERA_LOCK_BUCKETS_MS, espera_ms)] += 1
+        m["transacciones"] += 1
+        m["reintentos"] += reintentos
+        m["fallos"] += 1 if fallo else 0
+        m["espera_total_ms"] += espera_ms
+        m["espera_max_ms"] = max(m["espera_max_ms"], espera_ms)
+
+def obtener_metricas_escritura():
+    """Copia de las métricas de espera por lock (por endpoint, de este proceso)"""
+    with _metricas_lock:
+        endpoints = {}
+        for endpoint, m in _metricas_escritura.items():
+            endpoints[endpoint] = dict(
+                m,
+                buckets=list(m["buckets"]),
+                espera_total_ms=round(m["espera_total_ms"], 2),
+                espera_max_ms=round(m["espera_max_ms"], 2),
+                espera_promedio_ms=round(m["espera_total_ms"] / m["transacciones"], 2),
+            )
+    etiquetas = [f"<={b}" for b in ESPERA_LOCK_BUCKETS_MS] + [f">{ESPERA_LOCK_BUCKETS_MS[-1]}"]
+    return {"pid": os.getpid(), "buckets_ms": etiquetas, "endpoints": endpoints}
+
+def ejecutar_transaccion(trabajo, endpoint=None):
+    """Ejecutar trabajo(cur) dentro de BEGIN IMMEDIATE y hacer commit.
+
+    Si la base está ocupada (SQLITE_BUSY) se hace rollback y se reintenta toda la
+    unidad con backoff exponencial + jitter, hasta ESCRITURA_MAX_INTENTOS. Cualquier
+    otro error hace rollback y se propaga. Devuelve lo que devuelva `trabajo`.
+    """
+    if endpoint is None:
+        endpoint = request.endpoint if has_request_context() and request.endpoint else trabajo.__name__
+    espera_ms = 0.0
+    for intento in range(ESCRITURA_MAX_INTENTOS):
+        conn = get_db_connection()
+        try:
+            conn.execute(f"PRAGMA busy_timeout={ESCRITURA_BUSY_TIMEOUT_MS}")
+            inicio = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            finally:
+                espera_ms += (time.perf_counter() - inicio) * 1000
+            resultado = trabajo(conn.cursor())
+            conn.commit()
+            registrar_espera_lock(endpoint, espera_ms, intento)
+            return resultado
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if not es_error_bloqueo(e):
+                raise
+            if intento == ESCRITURA_MAX_INTENTOS - 1:
+                registrar_espera_lock(endpoint, espera_ms, intento, fallo=True)
+                print(f"ERROR - Base ocupada en {endpoint} tras {ESCRITURA_MAX_INTENTOS} intentos ({espera_ms:.0f} ms)")
+                raise
+            delay = 0.05 * (2 ** intento) + random.uniform(0, 0.05)
+            time.sleep(delay)
+            espera_ms += delay * 1000
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+RESPUESTA_BASE_OCUPADA = {"error": "La base de datos está temporalmente ocupada. Por favor, intente nuevamente en unos segundos."}
+# El escritor único ya estaba aplicando el comando cuando venció la espera: se va a guardar, no hay que repetirlo
+RESPUESTA_EN_CURSO = {"en_curso": True, "mensaje": "La operación se está guardando. No la repita; actualice en unos segundos para verla."}
+
 # Funciones auxiliares para base de datos SQLite
+def respuesta_json(texto, status=200):
+    """Respuesta con JSON ya serializado (p. ej. registros.a_json)"""
+    return app.response_class(texto, status=status, mimetype="application/json")
+
 def cargar_turnos():
     """Cargar turnos desde la base de datos"""
-    conn = get_db_connection()
-    c = conn.cursor()
     try:
-        c.execute("""
-            SELECT id, medico, hora_turno, fecha_turno, dni_paciente, estado,
-                   tipo_consulta, costo, pagado, observaciones
-            FROM turnos
-            ORDER BY fecha_turno DESC, hora_turno ASC
-        """)
-        turnos_data = c.fetchall()
-        turnos = []
-        for row in turnos_data:
-            turno = {
-                "id": row[0],
-                "medico": row[1],
-                "hora_turno": row[2],
-                "fecha_turno": row[3],
-                "dni_paciente": str(row[4] or ""),
-                "estado": row[5],
-                "tipo_consulta": row[6],
-                "costo": row[7],
-                "pagado": row[8],
-                "observaciones": row[9]
-            }
-            # Agregar campos adicionales para compatibilidad
-            turno["pago_registrado"] = bool(turno.get("pagado", 0))
-            turno["monto_pagado"] = float(turno.get("costo") or 0)
-            turnos.append(turno)
-        conn.close()
+        turnos = repos.turnos.listar()
         print(f"DEBUG: {len(turnos)} turnos cargados de BD")
         return turnos
     except Exception as e:
         print(f"Error al cargar turnos: {e}")
         import traceback
         traceback.print_exc()
-        if conn:
-            conn.close()
     return []
 
 def cargar_pacientes():
-    """Cargar pacientes desde la base de datos"""
-    conn = get_db_connection()
-    c = conn.cursor()
+    """Cargar pacientes desde la base de datos (edad e incompleto vienen calculados por SQL)"""
     try:
-        c.execute("SELECT dni, nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular, email FROM pacientes")
-        pacientes_data = c.fetchall()
-        pacientes = []
-        for row in pacientes_data:
-            paciente = {
-                "dni": row[0],
-                "nombre": row[1],
-                "apellido": row[2],
-                "fecha_nacimiento": row[3],
-                "obra_social": row[4],
-                "numero_obra_social": row[5],
-                "celular": row[6],
-                "email": row[7] if len(row) > 7 else None
-            }
-            # Calcular edad
-            if paciente.get("fecha_nacimiento"):
-                try:
-                    fecha_nac = datetime.strptime(paciente["fecha_nacimiento"], "%Y-%m-%d").date()
-                    hoy = date.today()
-                    edad = hoy.year - fecha_nac.year - ((hoy.month, hoy.day) < (fecha_nac.month, fecha_nac.day))
-                    paciente["edad"] = edad
-                except:
-                    paciente["edad"] = 0
-            else:
-                paciente["edad"] = 0
-            
-            # Marcar si el paciente está incompleto (datos pendientes)
-            paciente["incompleto"] = (
-                paciente.get("nombre") == "Pendiente" or 
-                paciente.get("apellido") == "Pendiente" or
-                not paciente.get("fecha_nacimiento") or
-                not paciente.get("obra_social") or
-                not paciente.get("celular")
-            )
-            
-            # Marcar si el paciente fue registrado por autogestión (tiene email pero falta info)
-            paciente["registro_rapido"] = (
-                paciente.get("email") and 
-                (paciente.get("nombre") == "Pendiente" or paciente.get("apellido") == "Pendiente")
-            )
-            
-            pacientes.append(paciente)
-        conn.close()
+        pacientes = repos.pacientes.listar()
         print(f"DEBUG: {len(pacientes)} pacientes cargados de BD")
         return pacientes
     except Exception as e:
         print(f"Error al cargar pacientes: {e}")
         import traceback
         traceback.print_exc()
-        if conn:
-            conn.close()
     return []
 
 def cargar_agenda():
-    """Cargar agenda desde la base de datos"""
-    conn = get_db_connection()
-    c = conn.cursor()
+    """Cargar agenda desde la base de datos: {medico: {DIA: [horas]}}"""
     try:
-        c.execute("SELECT medico, dia_semana as dia, horario as hora FROM agenda")
-        agenda = {}
-        total_registros = 0
-        for medico, dia, hora in c.fetchall():
-            agenda.setdefault(medico, {}).setdefault(dia, []).append(hora)
-            total_registros += 1
-        
-        print(f"DEBUG: {total_registros} registros cargados de agenda BD")
-        
-        for medico in list(agenda.keys()):
-            normalizado = {}
-            for dia, horas in agenda[medico].items():
-                # Mapear nombres de días para compatibilidad
-                dia_upper = dia.upper()
-                if dia_upper == 'MIERCOLES':
-                    dia_upper = 'MIERCOLES'  # Mantener como MIERCOLES
-                else:
-                    dia_upper = dia_upper
-                normalizado[dia_upper] = sorted(horas)
-            agenda[medico] = normalizado
-        
+        agenda = repos.agenda.listar()
         print(f"DEBUG: Agenda procesada para {len(agenda)} médicos")
-        conn.close()
         return agenda
     except Exception as e:
         print(f"Error al cargar agenda: {e}")
         import traceback
         traceback.print_exc()
-        if conn:
-            conn.close()
     return {}
 
 def cargar_pagos():
     """Cargar pagos desde la base de datos"""
-    conn = get_db_connection()
-    c = conn.cursor()
     try:
-        c.execute("SELECT id, dni_paciente, monto, fecha_pago as fecha, metodo_pago, obra_social, observaciones, fecha_creacion FROM pagos ORDER BY id")
-        pagos_data = c.fetchall()
-        pagos = []
-        for row in pagos_data:
-            pago = {
-                "id": row[0],
-                "dni_paciente": str(row[1] or ""),
-                "monto": float(row[2] or 0),
-                "fecha": row[3],
-                "metodo_pago": row[4],
-                "obra_social": row[5],
-                "observaciones": row[6],
-                "fecha_creacion": row[7]
-            }
-            # Agregar campos adicionales para compatibilidad
-            pago["nombre_paciente"] = ""
-            pago["hora"] = ""
-            pago["fecha_registro"] = pago.get("fecha_creacion", "")
-            pago["tipo_pago"] = pago.get("metodo_pago", "")
-            pagos.append(pago)
-        conn.close()
+        pagos = repos.pagos.listar()
         print(f"DEBUG: {len(pagos)} pagos cargados de BD")
         return pagos
     except Exception as e:
         print(f"Error al cargar pagos: {e}")
         import traceback
         traceback.print_exc()
-        if conn:
-            conn.close()
     return []
 
-def cargar_pagos_mes_con_pacientes(mes: str):
+def pagos_mes_con_pacientes(c, mes: str):
+    """Pagos del mes con el nombre del paciente, leídos con el cursor `c`"""
+    c.row_factory = Pago.fabrica()
+    c.execute(
+        """
+        SELECT pay.id, pay.dni_paciente, pay.monto, pay.fecha_pago, coalesce(pay.metodo_pago, ''),
+               coalesce(pay.obra_social, ''), coalesce(pay.observaciones, ''), coalesce(pay.fecha_creacion, ''),
+               trim(coalesce(trim(pac.nombre), '') || ' ' || coalesce(trim(pac.apellido), ''))
+        FROM pagos_todos pay
+        LEFT JOIN pacientes pac ON pac.dni = pay.dni_paciente
+        WHERE pay.fecha_pago LIKE ?
+        ORDER BY pay.fecha_pago ASC, pay.id ASC
+        """,
+        (mes + '%',)
+    )
+    return c.fetchall()
+
+def cargar_pagos_mes_con_pacientes(mes: str, conectar=get_db_connection):
     """Cargar pagos del mes y enriquecer con datos de paciente."""
-    conn = get_db_connection()
-    c = conn.cursor()
+    conn = conectar()
     try:
-        c.execute(
-            """
-            SELECT pay.id, pay.dni_paciente, pay.monto, pay.fecha_pago, pay.metodo_pago,
-                   pay.obra_social, pay.observaciones, pay.fecha_creacion,
-                   pac.nombre, pac.apellido
-            FROM pagos pay
-            LEFT JOIN pacientes pac ON pac.dni = pay.dni_paciente
-            WHERE pay.fecha_pago LIKE ?
-            ORDER BY pay.fecha_pago ASC, pay.id ASC
-            """,
-            (mes + '%',)
-        )
-        rows = c.fetchall()
-        pagos = []
-        for r in rows:
-            pagos.append({
-                "id": r[0],
-                "dni_paciente": str(r[1] or ""),
-                "monto": float(r[2] or 0),
-                "fecha": r[3],
-                "tipo_pago": r[4] or "",
-                "obra_social": r[5] or "",
-                "observaciones": r[6] or "",
-                "fecha_creacion": r[7] or "",
-                "nombre_paciente": f"{(r[8] or '').strip()} {(r[9] or '').strip()}".strip()
-            })
-        return pagos
+        return pagos_mes_con_pacientes(conn.cursor(), mes)
     finally:
         conn.close()
 
 def cargar_historias():
     """Cargar historias clínicas desde la base de datos"""
-    conn = get_db_connection()
-    c = conn.cursor()
     try:
-        c.execute("SELECT dni, consulta_medica, medico, fecha_consulta FROM historias_clinicas")
-        historias_data = c.fetchall()
-        
-        # Obtener especialidades de médicos
-        c.execute("SELECT usuario, especialidad FROM usuarios WHERE rol = 'medico'")
-        medicos_especialidades = {row[0]: row[1] for row in c.fetchall()}
-        
-        historias = []
-        for row in historias_data:
-            medico = row[2]
-            especialidad = medicos_especialidades.get(medico, None) if medico else None
-            historia = {
-                "dni": str(row[0] or ""),
-                "consulta_medica": row[1],
-                "medico": medico,
-                "fecha_consulta": row[3],
-                "especialidad": especialidad
-            }
-            historias.append(historia)
-        conn.close()
+        historias = repos.historias.listar()
         print(f"DEBUG: {len(historias)} historias clínicas cargadas de BD")
         return historias
     except Exception as e:
         print(f"Error al cargar historias: {e}")
         import traceback
         traceback.print_exc()
-        if conn:
-            conn.close()
     return []
 
 def cargar_usuarios_db():
@@ -359,22 +390,9 @@ def cargar_usuarios_db():
     conn = get_db_connection()
     c = conn.cursor()
     try:
+        c.row_factory = Usuario.fabrica()
         c.execute("SELECT id, usuario, contrasena, rol, nombre_completo, email, telefono, especialidad, activo, fecha_creacion FROM usuarios")
-        usuarios_data = c.fetchall()
-        usuarios = []
-        for row in usuarios_data:
-            usuarios.append({
-                "id": row[0],
-                "usuario": row[1],
-                "contrasena": row[2],
-                "rol": row[3],
-                "nombre_completo": row[4] if len(row) > 4 else None,
-                "email": row[5] if len(row) > 5 else None,
-                "telefono": row[6] if len(row) > 6 else None,
-                "especialidad": row[7] if len(row) > 7 else None,
-                "activo": row[8] if len(row) > 8 else 1,  # Por defecto activo si no existe
-                "fecha_creacion": row[9] if len(row) > 9 else None
-            })
+        usuarios = c.fetchall()
         conn.close()
         print(f"DEBUG: {len(usuarios)} usuarios cargados de BD")
         return usuarios
@@ -386,19 +404,6 @@ def cargar_usuarios_db():
             conn.close()
     return []
 
-# Funciones auxiliares
-def calcular_edad(fecha_nacimiento):
-    """Calcular edad a partir de fecha de nacimiento"""
-    try:
-        fecha_nac = datetime.strptime(fecha_nacimiento, "%Y-%m-%d").date()
-        hoy = date.today()
-        edad = hoy.year - fecha_nac.year - ((hoy.month, hoy.day) < (fecha_nac.month, fecha_nac.day))
-        return edad
-    except ValueError:
-        return None
-    except TypeError:
-        return None
-
 # Decoradores de autenticación
 def login_requerido(f):
     @wraps(f)
@@ -516,7 +521,7 @@ def logout():
 @login_requerido
 def api_usuarios():
     usuarios = cargar_usuarios_db()
-    return jsonify(usuarios)
+    return respuesta_json(a_json(usuarios))
 
 @app.route("/api/usuarios", methods=["POST"])
 @login_requerido
@@ -561,6 +566,7 @@ def crear_usuario():
             """, (usuario, generate_password_hash(contrasena), rol))
         
         conn.commit()
+        invalidar_catalogo_publico()
         return jsonify({"success": True, "mensaje": "Usuario creado correctamente"}), 201
     except Exception as e:
         if conn:
@@ -589,6 +595,7 @@ def gestionar_usuario(usuario):
             # Eliminar usuario
             cur.execute("DELETE FROM usuarios WHERE usuario = ?", (usuario,))
             conn.commit()
+            invalidar_catalogo_publico()
             return jsonify({"success": True, "mensaje": "Usuario eliminado correctamente"})
         except Exception as e:
             if conn:
@@ -661,6 +668,7 @@ def actualizar_usuario(usuario):
             return jsonify({"error": "No se pudo actualizar el usuario"}), 400
         
         conn.commit()
+        invalidar_catalogo_publico()
         return jsonify({"success": True, "mensaje": "Usuario actualizado correctamente"})
     except Exception as e:
         if conn:
@@ -675,7 +683,7 @@ def actualizar_usuario(usuario):
 def api_pacientes():
     if request.method == "GET":
         pacientes = cargar_pacientes()
-        return jsonify(pacientes)
+        return respuesta_json(a_json(pacientes))
     
     # Registrar paciente (POST)
     data = request.get_json(silent=True)
@@ -694,15 +702,6 @@ def api_pacientes():
     if not dni_str.isdigit() or len(dni_str) not in (7, 8):
         return jsonify({"error": "DNI inválido (solo números, 7 u 8 dígitos)"}), 400
 
-    # Calcular edad si viene fecha_nacimiento
-    if data.get("fecha_nacimiento"):
-        try:
-            fecha_nac = datetime.strptime(data["fecha_nacimiento"], "%Y-%m-%d").date()
-            hoy = date.today()
-            data["edad"] = hoy.year - fecha_nac.year - ((hoy.month, hoy.day) < (fecha_nac.month, fecha_nac.day))
-        except Exception:
-            data["edad"] = 0
-
     conn = None
     try:
         conn = get_db_connection()
@@ -737,6 +736,34 @@ def api_pacientes():
         if conn:
             conn.close()
 
+@app.route("/api/pacientes/buscar", methods=["GET"])
+@login_requerido
+def buscar_pacientes():
+    """Typeahead de pacientes: ?q= prefijo de DNI, o de apellido/nombre sin distinguir tildes.
+    Devuelve como máximo ?limite= (10 por defecto, hasta 50) coincidencias."""
+    try:
+        limite = int(request.args.get("limite", 10))
+    except ValueError:
+        return jsonify({"error": "limite inválido"}), 400
+    try:
+        return respuesta_json(a_json(repos.pacientes.buscar(request.args.get("q", ""), limite)))
+    except Exception as e:
+        print(f"Error al buscar pacientes: {e}")
+        return jsonify({"error": "Error al buscar pacientes"}), 500
+
+@app.route("/api/pacientes/<dni>", methods=["GET"])
+@login_requerido
+def obtener_paciente(dni):
+    """Un paciente por DNI"""
+    try:
+        paciente = repos.pacientes.por_dni(dni)
+        if not paciente:
+            return jsonify({"error": "Paciente no encontrado"}), 404
+        return respuesta_json(paciente.json())
+    except Exception as e:
+        print(f"Error al obtener paciente: {e}")
+        return jsonify({"error": "Error al obtener paciente"}), 500
+
 @app.route("/api/pacientes/<dni>", methods=["PUT"])
 @login_requerido
 @rol_permitido(["secretaria"])
@@ -757,14 +784,6 @@ def actualizar_paciente(dni):
     if not nuevo_dni.isdigit() or len(nuevo_dni) not in (7, 8):
         return jsonify({"error": "DNI inválido (solo números, 7 u 8 dígitos)"}), 400
 
-    if data.get("fecha_nacimiento"):
-        try:
-            fecha_nac = datetime.strptime(data["fecha_nacimiento"], "%Y-%m-%d").date()
-            hoy = date.today()
-            data["edad"] = hoy.year - fecha_nac.year - ((hoy.month, hoy.day) < (fecha_nac.month, fecha_nac.day))
-        except Exception:
-            data["edad"] = 0
-
     conn = None
     try:
         conn = get_db_connection()
@@ -815,7 +834,7 @@ def eliminar_paciente(dni):
         cur = conn.cursor()
 
         # Evitar eliminar si tiene turnos asociados
-        cur.execute("SELECT COUNT(1) FROM turnos WHERE dni_paciente = ?", (dni,))
+        cur.execute("SELECT COUNT(1) FROM turnos_todos WHERE dni_paciente = ?", (dni,))
         cantidad_turnos = cur.fetchone()[0]
         if cantidad_turnos:
             return jsonify({"error": f"No se puede eliminar. Tiene {cantidad_turnos} turno(s) asociado(s)."}), 400
@@ -833,12 +852,469 @@ def eliminar_paciente(dni):
         if conn:
             conn.close()
 
+# ====================== COMANDOS DE ESCRITURA ======================
+# Cada comando recibe (cur, datos) y devuelve (payload, status). Se ejecutan con
+# ejecutar_comando(): en una transacción propia con reintentos, o encolados en el
+# escritor único (ESCRITOR_UNICO=1), que agrupa varios comandos en un solo commit.
+
+def comando_crear_turno(cur, datos):
+    """Asignar un turno desde recepción (datos ya validados)"""
+    # 1. Verificar si el médico tiene horarios configurados para ese día y hora
+    if not horario_en_agenda(cur, datos["medico"], datos["fecha"], datos["hora"]):
+        return {"error": "El médico no tiene horarios configurados para este día y hora"}, 400
+
+    # 2. Verificar si ya existe un turno para ese médico, fecha y hora
+    cur.execute(
+        "SELECT * FROM turnos WHERE medico = ? AND fecha_turno = ? AND hora_turno = ?",
+        (datos["medico"], datos["fecha"], datos["hora"])
+    )
+    if cur.fetchone():
+        return {"error": "Ya existe un turno asignado para este médico, fecha y hora"}, 400
+
+    # 3. Verificar si el paciente existe
+    cur.execute("SELECT * FROM pacientes WHERE dni = ?", (datos["dni_paciente"],))
+    if not cur.fetchone():
+        return {"error": "El paciente con el DNI proporcionado no existe"}, 404
+
+    # 4. Asignar el turno
+    try:
+        cur.execute(
+            "INSERT INTO turnos (medico, hora_turno, fecha_turno, dni_paciente, estado, tipo_consulta, costo, observaciones) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (datos["medico"], datos["hora"], datos["fecha"], datos["dni_paciente"],
+             datos["estado"], datos["tipo_consulta"], datos["costo"], datos["observaciones"])
+        )
+    except sqlite3.IntegrityError:
+        # Otro usuario reservó el mismo horario entre la verificación y el INSERT (idx_turnos_slot)
+        return {"error": "Ya existe un turno asignado para este médico, fecha y hora"}, 400
+    return {"success": True, "mensaje": "Turno asignado correctamente", "turno_id": cur.lastrowid}, 201
+
+def buscar_turno_id(cur, dni_paciente, fecha, hora=None, estado=None):
+    """Resolver el id de un turno a partir de (dni, fecha[, hora]) (usa idx_turnos_dni_fecha)"""
+    sql = "SELECT id FROM turnos WHERE dni_paciente = ? AND fecha_turno = ?"
+    params = [dni_paciente, fecha]
+    if hora:
+        sql += " AND hora_turno = ?"
+        params.append(hora)
+    if estado:
+        sql += " AND lower(estado) = ?"
+        params.append(estado)
+    cur.execute(sql + " ORDER BY hora_turno LIMIT 1", params)
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def resolver_turno_id(cur, datos):
+    """Id del turno del comando: `turno_id` o, en las rutas viejas, el de (dni, fecha, hora)"""
+    return datos.get("turno_id") or buscar_turno_id(cur, datos["dni_paciente"], datos["fecha"], datos["hora"])
+
+def comando_recepcionar(cur, datos):
+    """Pasar un turno a 'recepcionado'"""
+    turno_id = resolver_turno_id(cur, datos)
+    if turno_id:
+        cur.execute("UPDATE turnos SET estado = 'recepcionado' WHERE id = ?", (turno_id,))
+    if not turno_id or cur.rowcount == 0:
+        return {"error": "Turno no encontrado"}, 404
+    return {"mensaje": "Paciente recepcionado correctamente", "turno_id": turno_id}, 200
+
+SQL_ESTADISTICAS_PAGOS_DIA = """
+    SELECT COALESCE(SUM(monto), 0), COUNT(*),
+           COALESCE(SUM(CASE WHEN metodo_pago = 'efectivo' THEN monto END), 0),
+           COUNT(CASE WHEN metodo_pago = 'efectivo' THEN 1 END),
+           COALESCE(SUM(CASE WHEN metodo_pago = 'transferencia' THEN monto END), 0),
+           COUNT(CASE WHEN metodo_pago = 'transferencia' THEN 1 END)
+    FROM pagos WHERE fecha_pago = ?
+"""
+
+def comando_cobrar_y_sala(cur, datos):
+    """Registrar el pago de un turno recepcionado y pasarlo a 'sala de espera'.
+
+    El turno se identifica por `turno_id` (o por dni/fecha/hora en las rutas viejas).
+    Devuelve el turno, el pago y los totales del día para que la UI no tenga que recargarlos.
+    """
+    turno_id = datos.get("turno_id")
+    if not turno_id:
+        turno_id = buscar_turno_id(cur, datos["dni_paciente"], datos["fecha"], datos.get("hora"),
+                                   None if datos.get("hora") else "recepcionado")
+        if not turno_id:
+            return {"error": "Turno no encontrado"}, 404
+
+    # 1) Pasar a sala de espera solo si está recepcionado (búsqueda por rowid)
+    cur.execute("""
+        UPDATE turnos SET estado = 'sala de espera'
+        WHERE id = ? AND lower(estado) = 'recepcionado'
+        RETURNING dni_paciente, medico, fecha_turno, hora_turno
+    """, (turno_id,))
+    turno = cur.fetchone()
+    if not turno:
+        cur.execute("SELECT 1 FROM turnos WHERE id = ?", (turno_id,))
+        if not cur.fetchone():
+            return {"error": "Turno no encontrado"}, 404
+        return {"error": "El paciente debe estar recepcionado primero"}, 400
+    dni_paciente, medico, fecha, hora = turno
+
+    # 2) Insertar el pago con la obra social del paciente (se permiten varios pagos por fecha)
+    cur.execute("""
+        INSERT INTO pagos (dni_paciente, monto, fecha_pago, metodo_pago, obra_social, observaciones, fecha_creacion)
+        SELECT dni, ?, ?, ?, COALESCE(obra_social, ''), ?, ? FROM pacientes WHERE dni = ?
+        RETURNING id, obra_social, fecha_creacion
+    """, (datos["monto"], fecha, datos["tipo_pago"], datos["observaciones"],
+          datetime.now().isoformat(), dni_paciente))
+    pago = cur.fetchone()
+    if not pago:
+        return {"error": "Paciente no encontrado"}, 404
+
+    cur.execute("SELECT nombre, apellido, celular FROM pacientes WHERE dni = ?", (dni_paciente,))
+    nombre, apellido, celular = cur.fetchone()
+    cur.execute(SQL_ESTADISTICAS_PAGOS_DIA, (fecha,))
+    total, cantidad, total_efectivo, cant_efectivo, total_transf, cant_transf = cur.fetchone()
+
+    return {
+        "mensaje": "Paciente movido a sala de espera correctamente",
+        "turno": {
+            "id": turno_id,
+            "dni": dni_paciente,
+            "nombre": nombre,
+            "apellido": apellido,
+            "celular": celular,
+            "medico": medico,
+            "fecha": fecha,
+            "hora": hora,
+            "estado": "sala de espera",
+        },
+        "pago": {
+            "id": pago[0],
+            "dni_paciente": dni_paciente,
+            "monto": float(datos["monto"]),
+            "fecha": fecha,
+            "metodo_pago": datos["tipo_pago"],
+            "tipo_pago": datos["tipo_pago"],
+            "obra_social": pago[1],
+            "observaciones": datos["observaciones"],
+            "fecha_creacion": pago[2],
+        },
+        "estadisticas_dia": {
+            "fecha": fecha,
+            "total_dia": float(total),
+            "cantidad_pagos_dia": cantidad,
+            "total_efectivo_hoy": float(total_efectivo),
+            "pagos_efectivo_hoy": cant_efectivo,
+            "total_transferencia_hoy": float(total_transf),
+            "pagos_transferencia_hoy": cant_transf,
+        },
+    }, 200
+
+def comando_cambiar_estado(cur, datos):
+    """Cambiar el estado de un turno (llamado, atendido, ausente...)"""
+    turno_id = resolver_turno_id(cur, datos)
+    if turno_id:
+        try:
+            cur.execute("UPDATE turnos SET estado = ? WHERE id = ?", (datos["estado"], turno_id))
+        except sqlite3.IntegrityError:
+            # Un 'ausente' que vuelve a 'sin atender' cuando su horario ya se reasignó (idx_turnos_slot)
+            return {"error": "El horario ya está ocupado por otro turno"}, 409
+    if not turno_id or cur.rowcount == 0:
+        return {"error": "Turno no encontrado"}, 404
+    return {"mensaje": "Estado actualizado correctamente", "turno_id": turno_id}, 200
+
+def comando_editar_turno(cur, datos):
+    """Mover un turno a otra fecha y/o hora del mismo médico"""
+    turno_id = resolver_turno_id(cur, datos)
+    cur.execute("SELECT medico, fecha_turno, hora_turno FROM turnos WHERE id = ?", (turno_id,))
+    turno = cur.fetchone()
+    if not turno:
+        return {"error": "Turno no encontrado"}, 404
+    medico, fecha, hora = turno
+    nueva_fecha = datos.get("nueva_fecha") or fecha
+    nueva_hora = datos.get("nueva_hora") or hora
+    ocupado = "La nueva fecha/hora ya está ocupada" if datos.get("nueva_fecha") else "La nueva hora ya está ocupada"
+
+    if (nueva_fecha, nueva_hora) != (fecha, hora):
+        # Verificar que el horario destino no esté tomado por otro turno del mismo médico
+        cur.execute("""
+            SELECT 1 FROM turnos
+            WHERE medico = ? AND fecha_turno = ? AND hora_turno = ? AND id != ? AND estado != 'ausente'
+        """, (medico, nueva_fecha, nueva_hora, turno_id))
+        if cur.fetchone():
+            return {"error": ocupado}, 400
+        try:
+            cur.execute("UPDATE turnos SET fecha_turno = ?, hora_turno = ? WHERE id = ?",
+                        (nueva_fecha, nueva_hora, turno_id))
+        except sqlite3.IntegrityError:
+            return {"error": ocupado}, 400
+
+    return {
+        "mensaje": "Turno actualizado correctamente",
+        "turno": {"id": turno_id, "medico": medico, "fecha": nueva_fecha, "hora": nueva_hora},
+    }, 200
+
+def comando_eliminar_turno(cur, datos):
+    """Eliminar un turno"""
+    turno_id = resolver_turno_id(cur, datos)
+    if turno_id:
+        cur.execute("DELETE FROM turnos WHERE id = ?", (turno_id,))
+    if not turno_id or cur.rowcount == 0:
+        return {"error": "Turno no encontrado"}, 404
+    return {"success": True, "mensaje": "Turno eliminado correctamente"}, 200
+
+def comando_reemplazar_agenda(cur, datos):
+    """Reemplazar la agenda de un médico aplicando solo las diferencias"""
+    medico = datos["medico"]
+    cur.execute("SELECT id, dia_semana, horario FROM agenda WHERE medico = ?", (medico,))
+    actuales = {(dia, horario): agenda_id for agenda_id, dia, horario in cur.fetchall()}
+    nueva = [(dia, hora) for dia, horas in datos["agenda"].items() for hora in horas]
+    borrar, insertar, dias_afectados = diff_agenda(actuales, nueva)
+
+    if borrar:
+        cur.executemany("DELETE FROM agenda WHERE id = ?", borrar)
+    if insertar:
+        cur.executemany(
+            "INSERT INTO agenda (medico, dia_semana, horario) VALUES (?, ?, ?)",
+            [(medico, dia, hora) for dia, hora in insertar]
+        )
+    return {
+        "success": True,
+        "mensaje": "Agenda actualizada correctamente",
+        "insertados": len(insertar),
+        "eliminados": len(borrar),
+        "dias_afectados": sorted(dias_afectados),
+    }, 200
+
+
+def comando_reemplazar_reglas_agenda(cur, datos):
+    """Reemplazar las reglas recurrentes de un médico; solo se reescriben los días que cambiaron"""
+    medico = datos["medico"]
+    cur.execute(f"SELECT {', '.join(COLUMNAS_REGLA)} FROM agenda_reglas WHERE medico = ?", (medico,))
+    anteriores, nuevas = {}, {}
+    for row in cur.fetchall():
+        anteriores.setdefault(row[0], set()).add(tuple(row))
+    for regla in datos["reglas"]:
+        nuevas.setdefault(regla["dia_semana"], set()).add(tuple(regla[c] for c in COLUMNAS_REGLA))
+    dias_afectados = sorted(d for d in set(anteriores) | set(nuevas) if anteriores.get(d) != nuevas.get(d))
+
+    if dias_afectados:
+        cur.executemany("DELETE FROM agenda_reglas WHERE medico = ? AND dia_semana = ?",
+                        [(medico, dia) for dia in dias_afectados])
+        cur.executemany(
+            f"INSERT INTO agenda_reglas (medico, {', '.join(COLUMNAS_REGLA)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(medico, *regla) for dia in dias_afectados for regla in sorted(nuevas.get(dia, ()), key=str)]
+        )
+    return {
+        "success": True,
+        "mensaje": "Reglas de agenda actualizadas correctamente",
+        "reglas": sum(len(r) for r in nuevas.values()),
+        "dias_afectados": dias_afectados,
+    }, 200
+
+def comando_registrar_pago(cur, datos):
+    """Registrar un pago suelto"""
+    cur.execute("SELECT id FROM pacientes WHERE dni = ?", (datos["dni_paciente"],))
+    if not cur.fetchone():
+        return {"error": "Paciente no encontrado"}, 404
+
+    cur.execute("""
+        INSERT INTO pagos (dni_paciente, monto, fecha_pago, metodo_pago, obra_social, observaciones, fecha_creacion)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (datos["dni_paciente"], datos["monto"], datos["fecha"], datos["tipo_pago"],
+          datos["obra_social"], datos["observaciones"], datetime.now().isoformat()))
+    return {"success": True, "mensaje": "Pago registrado correctamente", "pago_id": cur.lastrowid}, 200
+
+def comando_reservar_turno_publico(cur, datos):
+    """Alta/actualización del paciente y reserva del horario (reserva pública)"""
+    # La agenda se valida dentro de la transacción de escritura: un cambio de
+    # agenda hecho después de listar la disponibilidad no deja reservar el horario
+    if not horario_en_agenda(cur, datos["medico"], datos["fecha"], datos["hora"]):
+        return {"error": "El horario no está disponible para este médico"}, 400
+
+    # Crear paciente o actualizarlo en una sola sentencia: siempre se guarda el
+    # email; nombre/apellido/celular/fecha_nacimiento solo completan datos 'Pendiente'
+    cur.execute(SQL_UPSERT_PACIENTE_PUBLICO, {
+        "dni": datos["dni"],
+        "nombre": datos["nombre"],
+        "apellido": datos["apellido"],
+        "email": datos["email"],
+        "celular": datos["celular"],
+        "fecha_nacimiento": datos["fecha_nacimiento"],
+    })
+    nombre_final, apellido_final = cur.fetchone()
+
+    # Reservar el horario en una sola sentencia. El NOT EXISTS y el índice único
+    # idx_turnos_slot (turnos no ausentes) garantizan que no haya doble reserva
+    cur.execute("""
+        INSERT INTO turnos (medico, hora_turno, fecha_turno, dni_paciente, estado, tipo_consulta, costo, observaciones)
+        SELECT ?, ?, ?, ?, 'sin atender', 'Consulta', 0, 'Reservado por autogestión'
+        WHERE NOT EXISTS (
+            SELECT 1 FROM turnos
+            WHERE medico = ? AND fecha_turno = ? AND hora_turno = ? AND estado != 'ausente'
+        )
+        ON CONFLICT DO NOTHING
+    """, (datos["medico"], datos["hora"], datos["fecha"], datos["dni"],
+          datos["medico"], datos["fecha"], datos["hora"]))
+    if cur.rowcount != 1:
+        return {"error": "El turno ya está ocupado"}, 409
+
+    if nombre_final == "Pendiente" and apellido_final == "Pendiente":
+        nombre_paciente = "Paciente"
+    else:
+        nombre_paciente = f"{nombre_final} {apellido_final}"
+    return {"turno_id": cur.lastrowid, "nombre_paciente": nombre_paciente}, 201
+
+# Máquina de estados de turnos: estado actual -> {estado destino: roles que pueden aplicarla}.
+# 'sala de espera' desde 'recepcionado' solo se alcanza cobrando (/api/pagos/cobrar-y-sala).
+TRANSICIONES_TURNO = {
+    "sin atender": {"recepcionado": {"secretaria"}, "ausente": {"secretaria", "medico"}},
+    "recepcionado": {"sin atender": {"secretaria"}, "ausente": {"secretaria", "medico"}},
+    "sala de espera": {"llamado": {"medico"}, "ausente": {"secretaria", "medico"}},
+    "llamado": {"atendido": {"medico"}, "ausente": {"medico"}, "sala de espera": {"medico"}},
+    "ausente": {"sin atender": {"secretaria", "medico"}},
+    "atendido": {},
+}
+MAX_TRANSICIONES_BATCH = 200
+# Estados viejos que equivalen a uno de la máquina (la agenda creaba turnos 'pendiente')
+ESTADOS_EQUIVALENTES = {"pendiente": "sin atender"}
+
+def normalizar_estado_turno(estado):
+    """Estado en minúsculas y con los equivalentes viejos reemplazados ('' -> 'sin atender')"""
+    estado = (estado or "").strip().lower() or "sin atender"
+    return ESTADOS_EQUIVALENTES.get(estado, estado)
+
+def validar_transicion(estado_actual, nuevo_estado, rol):
+    """Devolver None si la transición es válida para el rol, o el mensaje de error"""
+    destinos = TRANSICIONES_TURNO.get((estado_actual or "").lower())
+    if destinos is None:
+        return f"Estado actual desconocido: '{estado_actual}'"
+    if nuevo_estado not in destinos:
+        return f"Transición inválida: '{estado_actual}' -> '{nuevo_estado}'"
+    if rol != "administrador" and rol not in destinos[nuevo_estado]:
+        return f"El rol '{rol}' no puede pasar un turno a '{nuevo_estado}'"
+    return None
+
+def comando_transiciones_turnos(cur, datos):
+    """Aplicar varias transiciones de estado en una transacción; resultado por ítem"""
+    transiciones = datos["transiciones"]
+    ids = [t["id"] for t in transiciones]
+    marcadores = ",".join("?" * len(ids))
+    cur.execute(f"SELECT id, estado, medico, fecha_turno, hora_turno FROM turnos WHERE id IN ({marcadores})", ids)
+    actuales = {row[0]: row for row in cur.fetchall()}
+
+    resultados = []
+    updates = []
+    vistos = set()
+    for t in transiciones:
+        turno_id, nuevo_estado = t["id"], t["estado"]
+        turno = actuales.get(turno_id)
+        if turno is None:
+            error = "Turno no encontrado"
+        elif turno_id in vistos:
+            error = "Turno repetido en el lote"
+        else:
+            error = validar_transicion(turno[1], nuevo_estado, datos["rol"])
+        if not error and turno[1].lower() == "ausente":
+            # Volver de 'ausente' reocupa el horario: verificar que nadie lo haya tomado
+            cur.execute("""
+                SELECT 1 FROM turnos
+                WHERE medico = ? AND fecha_turno = ? AND hora_turno = ? AND estado != 'ausente' AND id != ?
+            """, (turno[2], turno[3], turno[4], turno_id))
+            if cur.fetchone():
+                error = "El horario ya fue asignado a otro turno"
+        vistos.add(turno_id)
+
+        if error:
+            resultados.append({"id": turno_id, "ok": False, "error": error})
+            continue
+        updates.append((nuevo_estado, turno_id, turno[1]))
+        resultados.append({"id": turno_id, "ok": True, "estado_anterior": turno[1], "estado": nuevo_estado})
+
+    if updates:
+        # El WHERE sobre el estado anterior protege de cambios fuera de este lote
+        cur.executemany("UPDATE turnos SET estado = ? WHERE id = ? AND estado = ?", updates)
+
+    return {
+        "resultados": resultados,
+        "aplicados": len(updates),
+        "rechazados": len(resultados) - len(updates),
+    }, 200
+
+COMANDOS_ESCRITURA = {
+    "crear_turno": comando_crear_turno,
+    "recepcionar": comando_recepcionar,
+    "cobrar_y_sala": comando_cobrar_y_sala,
+    "cambiar_estado": comando_cambiar_estado,
+    "editar_turno": comando_editar_turno,
+    "eliminar_turno": comando_eliminar_turno,
+    "registrar_pago": comando_registrar_pago,
+    "reemplazar_agenda": comando_reemplazar_agenda,
+    "reemplazar_reglas_agenda": comando_reemplazar_reglas_agenda,
+    "reservar_turno_publico": comando_reservar_turno_publico,
+    "transiciones_turnos": comando_transiciones_turnos,
+}
+
+def aplicar_comando(cur, tipo, datos):
+    """Aplicar un comando aislado en un SAVEPOINT: si falla o responde error (status >= 400)
+    se deshacen solo sus cambios, sin afectar al resto de la transacción/lote"""
+    cur.execute("SAVEPOINT comando")
+    try:
+        payload, status = COMANDOS_ESCRITURA[tipo](cur, datos)
+    except Exception:
+        cur.execute("ROLLBACK TO comando")
+        cur.execute("RELEASE comando")
+        raise
+    if status >= 400:
+        cur.execute("ROLLBACK TO comando")
+    cur.execute("RELEASE comando")
+    return payload, status
+
+# Modo escritor único: todas las escrituras de COMANDOS_ESCRITURA pasan por un hilo
+# por proceso que hace commit por lotes. Cada worker de gunicorn y el proceso de
+# app_publico tienen su escritor; entre procesos ordena el lock de SQLite.
+ESCRITOR_UNICO = os.environ.get("ESCRITOR_UNICO", "").lower() in ["1", "true", "yes"]
+ESCRITOR_LOTE_MAX = int(os.environ.get("ESCRITOR_LOTE_MAX", 32))
+ESCRITOR_ESPERA_LOTE_MS = float(os.environ.get("ESCRITOR_ESPERA_LOTE_MS", 2))
+ESCRITOR_TIMEOUT = float(os.environ.get("ESCRITOR_TIMEOUT", 30))
+_escritor = None
+_escritor_lock = threading.Lock()
+
+def get_escritor():
+    """Escritor único del proceso (se crea al primer uso, después del fork de gunicorn)"""
+    global _escritor
+    with _escritor_lock:
+        if _escritor is None:
+            from escritor_unico import EscritorUnico
+            _escritor = EscritorUnico(get_db_connection, aplicar_comando, ESCRITOR_LOTE_MAX, ESCRITOR_ESPERA_LOTE_MS)
+            _escritor.iniciar()
+        return _escritor
+
+def ejecutar_comando(tipo, datos, endpoint=None):
+    """Ejecutar un comando de escritura y devolver (payload, status).
+    Si la base sigue ocupada tras los reintentos (o el comando se canceló en la cola del escritor)
+    devuelve 503; si el escritor ya lo estaba aplicando, 202 con RESPUESTA_EN_CURSO."""
+    try:
+        if ESCRITOR_UNICO:
+            return get_escritor().ejecutar(tipo, datos, timeout=ESCRITOR_TIMEOUT)
+        return ejecutar_transaccion(lambda cur: aplicar_comando(cur, tipo, datos), endpoint=endpoint)
+    except sqlite3.OperationalError as e:
+        if es_error_bloqueo(e):
+            return RESPUESTA_BASE_OCUPADA, 503
+        raise
+    except FuturesTimeoutError:
+        print(f"ERROR - El escritor único no respondió a '{tipo}' en {ESCRITOR_TIMEOUT} s (cancelado)")
+        return RESPUESTA_BASE_OCUPADA, 503
+    except ComandoEnCurso:
+        print(f"ERROR - El escritor único sigue aplicando '{tipo}' después de {ESCRITOR_TIMEOUT} s")
+        return RESPUESTA_EN_CURSO, 202
+
+def responder_comando(tipo, datos, mensaje_error):
+    """Ejecutar un comando de escritura y convertir el resultado en respuesta JSON"""
+    try:
+        payload, status = ejecutar_comando(tipo, datos)
+        return jsonify(payload), status
+    except Exception as e:
+        return jsonify({"error": f"{mensaje_error}: {str(e)}"}), 500
+
 @app.route("/api/turnos", methods=["GET", "POST"])
 @login_requerido
 def api_turnos():
     if request.method == "GET":
         turnos = cargar_turnos()
-        return jsonify(turnos) 
+        return respuesta_json(a_json(turnos))
     elif request.method == "POST":
         return asignar_turno_route()
 
@@ -851,84 +1327,194 @@ def asignar_turno_route():
             return jsonify({"error": f"El campo '{campo}' es obligatorio"}), 400
 
     try:
-        fecha_dt = datetime.strptime(data["fecha"], "%Y-%m-%d").date()
+        datetime.strptime(data["fecha"], "%Y-%m-%d")
     except ValueError:
         return jsonify({"error": "Formato de fecha inválido (usar YYYY-MM-DD)"}), 400
 
-    dia_semana = fecha_dt.strftime("%A").upper()
+    estado = normalizar_estado_turno(data.get("estado"))
+    if estado not in TRANSICIONES_TURNO:
+        return jsonify({"error": f"Estado inválido: '{data.get('estado')}'"}), 400
 
-    # Mapeo de días de la semana de inglés a español
-    dia_es = {
-        "MONDAY": "LUNES", "TUESDAY": "MARTES", "WEDNESDAY": "MIERCOLES",
-        "THURSDAY": "JUEVES", "FRIDAY": "VIERNES", "SATURDAY": "SABADO", "SUNDAY": "DOMINGO"
-    }
-    dia_semana_es = dia_es.get(dia_semana, "").upper()
-
-    conn = None
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-
-        # 1. Verificar si el médico tiene horarios configurados para ese día y hora
-        c.execute(
-            "SELECT * FROM agenda WHERE medico = ? AND dia_semana = ? AND horario = ?",
-            (data["medico"], dia_semana_es, data["hora"])
-        )
-        if not c.fetchone():
-            return jsonify({"error": "El médico no tiene horarios configurados para este día y hora"}), 400
-
-        # 2. Verificar si ya existe un turno para ese médico, fecha y hora
-        c.execute(
-            "SELECT * FROM turnos WHERE medico = ? AND fecha_turno = ? AND hora_turno = ?",
-            (data["medico"], data["fecha"], data["hora"])
-        )
-        if c.fetchone():
-            return jsonify({"error": "Ya existe un turno asignado para este médico, fecha y hora"}), 400
-
-        # 3. Verificar si el paciente existe
-        c.execute("SELECT * FROM pacientes WHERE dni = ?", (data["dni_paciente"],))
-        if not c.fetchone():
-            return jsonify({"error": "El paciente con el DNI proporcionado no existe"}), 404
-
-        # 4. Asignar el turno
-        c.execute(
-            "INSERT INTO turnos (medico, hora_turno, fecha_turno, dni_paciente, estado, tipo_consulta, costo, observaciones) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (data["medico"], data["hora"], data["fecha"], data["dni_paciente"], 
-             data.get("estado", "sin atender"), data.get("tipo_consulta", ""), 
-             data.get("costo", 0), data.get("observaciones", ""))
-        )
-        
-        # Obtener el ID del turno recién creado
-        turno_id = c.lastrowid
-        conn.commit()
-
-        return jsonify({"success": True, "mensaje": "Turno asignado correctamente", "turno_id": turno_id}), 201
-
+        payload, status = ejecutar_comando("crear_turno", {
+            "medico": data["medico"],
+            "hora": data["hora"],
+            "fecha": data["fecha"],
+            "dni_paciente": data["dni_paciente"],
+            "estado": estado,
+            "tipo_consulta": data.get("tipo_consulta", ""),
+            "costo": data.get("costo", 0),
+            "observaciones": data.get("observaciones", ""),
+        })
+        return jsonify(payload), status
     except sqlite3.OperationalError as e:
-        if "database is locked" in str(e):
-            print(f"ERROR - Base de datos bloqueada al asignar turno: {e}")
-            return jsonify({"error": "La base de datos está temporalmente ocupada. Por favor, intente nuevamente en unos segundos."}), 503
-        else:
-            print(f"ERROR - Error de base de datos al asignar turno: {e}")
-            return jsonify({"error": "Error interno al asignar el turno"}), 500
+        print(f"ERROR - Error de base de datos al asignar turno: {e}")
+        return jsonify({"error": "Error interno al asignar el turno"}), 500
     except Exception as e:
         print(f"ERROR - Error inesperado al asignar turno: {e}")
         return jsonify({"error": "Error interno al asignar el turno"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route("/api/agenda", methods=["GET"])
 @login_requerido
 @rol_permitido(["secretaria", "medico", "administrador"])
 def obtener_agenda():
+    """Agenda de horarios fijos por médico y día. Con ?fecha=YYYY-MM-DD agrega, para el día
+    de la semana de esa fecha, los horarios que generan las reglas vigentes."""
+    fecha = request.args.get("fecha", "").strip()
+    if fecha:
+        try:
+            datetime.strptime(fecha, "%Y-%m-%d")
+        except ValueError:
+            return jsonify({"error": "Formato de fecha inválido (usar YYYY-MM-DD)"}), 400
     try:
         agenda_data = cargar_agenda()
+        if fecha:
+            agregar_horarios_de_reglas(agenda_data, fecha)
         return jsonify(agenda_data)
     except Exception as e:
         print(f"Error al cargar agenda: {e}")
         return jsonify({"error": "Error al cargar la agenda"}), 500
 
+def agregar_horarios_de_reglas(agenda, fecha):
+    """Sumar a {medico: {dia: [horas]}} los horarios de las reglas vigentes en `fecha`"""
+    dia = dia_semana_de(fecha)
+    for medico, reglas in repos.agenda.reglas_del_dia(dia).items():
+        horas = agenda.setdefault(medico, {}).get(dia, [])
+        agenda[medico][dia] = sorted(set(horas).union(horarios_de_reglas(reglas, fecha)))
+    return agenda
+
+def resumen_calendario(c, fecha_inicio, fecha_fin, medico=""):
+    """Por día del rango: horarios de agenda (fija + reglas, sin los días bloqueados),
+    ocupados y libres, bloqueos {medico: motivo} y turnos por estado"""
+    if medico:
+        medicos = [medico]
+    else:
+        c.execute("SELECT medico FROM agenda WHERE activo = 1 UNION SELECT medico FROM agenda_reglas WHERE activo = 1")
+        medicos = sorted(row[0] for row in c.fetchall())
+    filtro_medico = " AND medico = ?" if medico else ""
+    parametros = (fecha_inicio, fecha_fin) + ((medico,) if medico else ())
+
+    # Turnos por día y estado en una consulta agrupada
+    c.execute(f"""
+        SELECT fecha_turno, coalesce(estado, 'sin atender') AS estado_turno, COUNT(*)
+        FROM turnos
+        WHERE fecha_turno BETWEEN ? AND ?{filtro_medico}
+        GROUP BY fecha_turno, estado_turno
+    """, parametros)
+    estados_por_dia = {}
+    for fecha, estado, cantidad in c.fetchall():
+        estados_por_dia.setdefault(fecha, {})[estado] = cantidad
+
+    # Horarios tomados (los ausentes liberan el horario, como en idx_turnos_slot)
+    c.execute(f"""
+        SELECT medico, fecha_turno, hora_turno
+        FROM turnos
+        WHERE fecha_turno BETWEEN ? AND ? AND estado != 'ausente'{filtro_medico}
+    """, parametros)
+    ocupados_idx = set(c.fetchall())
+
+    bloqueos = {med: fechas_bloqueadas(med, fecha_inicio, fecha_fin) for med in medicos}
+    dias = {}
+    dia = date.fromisoformat(fecha_inicio)
+    ultimo = date.fromisoformat(fecha_fin)
+    while dia <= ultimo:
+        fecha = dia.isoformat()
+        estados = estados_por_dia.get(fecha, {})
+        resumen = {"horarios": 0, "ocupados": 0, "libres": 0, "bloqueos": {},
+                   "turnos": sum(estados.values()), "estados": estados}
+        for med in medicos:
+            motivo = bloqueos[med].get(fecha)
+            if motivo:
+                resumen["bloqueos"][med] = motivo
+                continue
+            horas = horarios_agenda(c, med, fecha)
+            ocupados = sum(1 for hora in horas if (med, fecha, hora) in ocupados_idx)
+            resumen["horarios"] += len(horas)
+            resumen["ocupados"] += ocupados
+        resumen["libres"] = resumen["horarios"] - resumen["ocupados"]
+        dias[fecha] = resumen
+        dia += timedelta(days=1)
+    return dias
+
+@app.route("/api/calendario", methods=["GET"])
+@login_requerido
+@rol_permitido(["secretaria", "medico", "administrador"])
+def obtener_calendario():
+    """Resumen por día de `?mes=YYYY-MM` (mes actual por defecto) para la vista de calendario,
+    de todos los médicos con agenda o solo de `?medico=`"""
+    mes = request.args.get("mes") or datetime.now().strftime("%Y-%m")
+    medico = request.args.get("medico", "").strip()
+    try:
+        inicio_mes, fin_mes = rango_mes(mes)
+    except ValueError:
+        return jsonify({"error": "Formato de mes inválido (usar YYYY-MM)"}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        dias = resumen_calendario(conn.cursor(), inicio_mes, fin_mes, medico)
+    except Exception as e:
+        print(f"Error al obtener calendario: {e}")
+        return jsonify({"error": "Error al obtener el calendario"}), 500
+    finally:
+        if conn:
+            conn.close()
+
+    totales = {clave: sum(d[clave] for d in dias.values()) for clave in ("horarios", "ocupados", "libres", "turnos")}
+    payload = {"mes": mes, "medico": medico, "dias": dias, "totales": totales}
+    return respuesta_catalogo(payload, 200, calcular_etag(payload), cache_control="private, no-cache")
+
+@app.route("/api/agenda/<medico>/reglas", methods=["GET"])
+@login_requerido
+@rol_permitido(["secretaria", "medico", "administrador"])
+def obtener_reglas_agenda(medico):
+    """Reglas recurrentes de la agenda de un médico"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        rows = conn.execute(f"""
+            SELECT id, {', '.join(COLUMNAS_REGLA)} FROM agenda_reglas
+            WHERE medico = ? AND activo = 1
+            ORDER BY CASE dia_semana
+                WHEN 'LUNES' THEN 1 WHEN 'MARTES' THEN 2 WHEN 'MIERCOLES' THEN 3 WHEN 'JUEVES' THEN 4
+                WHEN 'VIERNES' THEN 5 WHEN 'SABADO' THEN 6 WHEN 'DOMINGO' THEN 7
+            END, hora_inicio
+        """, (medico,)).fetchall()
+        return jsonify([{"id": row[0], **dict(zip(COLUMNAS_REGLA, row[1:]))} for row in rows])
+    except Exception as e:
+        print(f"Error al cargar reglas de agenda: {e}")
+        return jsonify({"error": "Error al cargar las reglas de agenda"}), 500
+    finally:
+        if conn:
+            conn.close()
+
+@app.route("/api/agenda/<medico>/reglas", methods=["PUT"])
+@login_requerido
+@rol_permitido(["secretaria", "administrador"])
+def actualizar_reglas_agenda(medico):
+    """Reemplaza las reglas recurrentes de un médico.
+    Body: [{"dia_semana": "LUNES", "hora_inicio": "08:00", "hora_fin": "12:00", "intervalo_min": 15,
+            "vigente_desde": "2025-03-01", "vigente_hasta": null}, ...]
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return jsonify({"error": "Se requiere una lista de reglas"}), 400
+
+    reglas = []
+    for i, item in enumerate(data):
+        regla, error = validar_regla(item)
+        if error:
+            return jsonify({"error": f"Regla {i}: {error}"}), 400
+        reglas.append(regla)
+
+    try:
+        payload, status = ejecutar_comando("reemplazar_reglas_agenda", {"medico": medico, "reglas": reglas})
+    except Exception as e:
+        return jsonify({"error": f"Error al actualizar reglas de agenda: {str(e)}"}), 500
+    if status == 200:
+        invalidar_horarios_agenda(medico, payload["dias_afectados"])
+    return jsonify(payload), status
+
 @app.route("/api/agenda/<medico>", methods=["PUT"])
 @login_requerido
 @rol_permitido(["secretaria", "administrador"])
@@ -961,31 +1547,48 @@ def actualizar_agenda_medico(medico):
         horas_validas = [h for h in horas if isinstance(h, str) and h.strip()]
         agenda_normalizada[dia_norm] = horas_validas
 
-    conn = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Limpiar agenda previa del médico
-        cur.execute("DELETE FROM agenda WHERE medico = ?", (medico,))
-
-        # Insertar nueva agenda
-        for dia_semana, horas in agenda_normalizada.items():
-            for hora in horas:
-                cur.execute(
-                    "INSERT INTO agenda (medico, dia_semana, horario) VALUES (?, ?, ?)",
-                    (medico, dia_semana, hora)
-                )
+    payload, status = guardar_agenda_medico(medico, agenda_normalizada)
+    return jsonify(payload), status
 
-        conn.commit()
-        return jsonify({"success": True, "mensaje": "Agenda actualizada correctamente"})
+def guardar_agenda_medico(medico, agenda):
+    """Aplicar el reemplazo de agenda e invalidar los horarios cacheados de los días que cambiaron"""
+    try:
+        payload, status = ejecutar_comando("reemplazar_agenda", {"medico": medico, "agenda": agenda})
     except Exception as e:
-        if conn:
-            conn.rollback()
-        return jsonify({"error": f"Error al actualizar agenda: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
+        return {"error": f"Error al actualizar agenda: {str(e)}"}, 500
+    if status == 200:
+        invalidar_horarios_agenda(medico, payload["dias_afectados"])
+    return payload, status
+
+def datos_bloqueos(c, medico=""):
+    """Bloqueos de agenda activos (de un médico si se indica), más recientes primero"""
+    if medico:
+        c.execute("""
+            SELECT id, medico, fecha_inicio, fecha_fin, motivo, activo, fecha_creacion
+            FROM bloqueos_agenda
+            WHERE medico = ? AND activo = 1
+            ORDER BY fecha_inicio DESC
+        """, (medico,))
+    else:
+        c.execute("""
+            SELECT id, medico, fecha_inicio, fecha_fin, motivo, activo, fecha_creacion
+            FROM bloqueos_agenda
+            WHERE activo = 1
+            ORDER BY fecha_inicio DESC
+        """)
+    
+    bloqueos = []
+    for row in c.fetchall():
+        bloqueos.append({
+            "id": row[0],
+            "medico": row[1],
+            "fecha_inicio": row[2],
+            "fecha_fin": row[3],
+            "motivo": row[4] or "",
+            "activo": row[5],
+            "fecha_creacion": row[6]
+        })
+    return bloqueos
 
 @app.route("/api/bloqueos-agenda", methods=["GET", "POST"])
 @login_requerido
@@ -998,35 +1601,7 @@ def gestionar_bloqueos():
         conn = None
         try:
             conn = get_db_connection()
-            c = conn.cursor()
-            
-            if medico:
-                c.execute("""
-                    SELECT id, medico, fecha_inicio, fecha_fin, motivo, activo, fecha_creacion
-                    FROM bloqueos_agenda
-                    WHERE medico = ? AND activo = 1
-                    ORDER BY fecha_inicio DESC
-                """, (medico,))
-            else:
-                c.execute("""
-                    SELECT id, medico, fecha_inicio, fecha_fin, motivo, activo, fecha_creacion
-                    FROM bloqueos_agenda
-                    WHERE activo = 1
-                    ORDER BY fecha_inicio DESC
-                """)
-            
-            bloqueos = []
-            for row in c.fetchall():
-                bloqueos.append({
-                    "id": row[0],
-                    "medico": row[1],
-                    "fecha_inicio": row[2],
-                    "fecha_fin": row[3],
-                    "motivo": row[4] or "",
-                    "activo": row[5],
-                    "fecha_creacion": row[6]
-                })
-            
+            bloqueos = datos_bloqueos(conn.cursor(), medico)
             conn.close()
             return jsonify(bloqueos)
         except Exception as e:
@@ -1076,6 +1651,7 @@ def gestionar_bloqueos():
             conn.commit()
             bloqueo_id = c.lastrowid
             conn.close()
+            invalidar_bloqueos(medico)
             
             return jsonify({
                 "success": True,
@@ -1099,13 +1675,15 @@ def eliminar_bloqueo(bloqueo_id):
         c = conn.cursor()
         
         # Desactivar bloqueo en lugar de eliminarlo
-        c.execute("UPDATE bloqueos_agenda SET activo = 0 WHERE id = ?", (bloqueo_id,))
+        c.execute("UPDATE bloqueos_agenda SET activo = 0 WHERE id = ? RETURNING medico", (bloqueo_id,))
+        bloqueo = c.fetchone()
         
-        if c.rowcount == 0:
+        if not bloqueo:
             return jsonify({"error": "Bloqueo no encontrado"}), 404
         
         conn.commit()
         conn.close()
+        invalidar_bloqueos(bloqueo[0])
         
         return jsonify({"success": True, "mensaje": "Bloqueo eliminado correctamente"})
     except Exception as e:
@@ -1119,7 +1697,7 @@ def eliminar_bloqueo(bloqueo_id):
 def api_pagos():
     if request.method == "GET":
         pagos = cargar_pagos()
-        return jsonify(pagos)
+        return respuesta_json(a_json(pagos))
     
     elif request.method == "POST":
         # Crear nuevo pago
@@ -1151,44 +1729,18 @@ def api_pagos():
         if tipo_pago not in ["efectivo", "transferencia", "obra_social"]:
             return jsonify({"error": "Tipo de pago inválido"}), 400
         
-        conn = get_db_connection()
         try:
-            cur = conn.cursor()
-            
-            # Verificar que existe el paciente
-            cur.execute("SELECT id FROM pacientes WHERE dni = ?", (dni_paciente,))
-            paciente = cur.fetchone()
-            if not paciente:
-                return jsonify({"error": "Paciente no encontrado"}), 404
-    
-            # Insertar el pago
-            cur.execute("""
-                INSERT INTO pagos (dni_paciente, monto, fecha_pago, metodo_pago, obra_social, observaciones, fecha_creacion)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                dni_paciente,
-                monto,
-                fecha_pago,
-                tipo_pago,
-                obra_social,
-                observaciones,
-                datetime.now().isoformat()
-            ))
-            
-            conn.commit()
-            pagos_id = cur.lastrowid
-            
-            return jsonify({
-                "success": True,
-                "mensaje": "Pago registrado correctamente",
-                "pago_id": pagos_id
+            payload, status = ejecutar_comando("registrar_pago", {
+                "dni_paciente": dni_paciente,
+                "monto": monto,
+                "fecha": fecha_pago,
+                "tipo_pago": tipo_pago,
+                "obra_social": obra_social,
+                "observaciones": observaciones,
             })
-            
+            return jsonify(payload), status
         except Exception as e:
             return jsonify({"error": f"Error al registrar pago: {str(e)}"}), 500
-        finally:
-            if conn:
-                conn.close()
 
 @app.route("/api/pagos/<int:pago_id>", methods=["DELETE"])
 @login_requerido
@@ -1228,58 +1780,116 @@ def eliminar_pago(pago_id):
 @login_requerido
 @rol_requerido("medico")
 def obtener_turnos_medico():
+    """Turnos del médico logueado entre ?desde= y ?hasta= (por defecto hoy), con los
+    contadores por estado de toda la ventana. Filtros opcionales: ?estado= (lista
+    separada por comas) y ?limite= (200 por defecto, hasta 500). Si quedan más turnos,
+    `siguiente` trae el cursor para pedir la página siguiente con ?cursor=."""
     usuario_medico = session.get("usuario")
-    
-    conn = None
+    desde = request.args.get("desde") or date.today().isoformat()
+    hasta = request.args.get("hasta") or desde
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        
-        c.execute("""
-            SELECT t.*, p.nombre, p.apellido, p.celular, p.obra_social
-            FROM turnos t
-            LEFT JOIN pacientes p ON t.dni_paciente = p.dni
-            WHERE t.medico = ?
-            ORDER BY t.fecha_turno, t.hora_turno
-        """, (usuario_medico,))
-        
-        turnos_data = c.fetchall()
-        
-        turnos_medico = []
-        for row in turnos_data:
-            turno = {
-                'id': row[0],
-                'dni_paciente': row[1],
-                'medico': row[2],
-                'fecha': row[3],  # Cambiado de fecha_turno a fecha
-                'hora': row[4],   # Cambiado de hora_turno a hora
-                'estado': row[5] if row[5] else 'sin atender',
-                'tipo_consulta': row[6] if row[6] else '',
-                'costo': row[7] if row[7] else 0,
-                'pagado': row[8] if row[8] else 0,
-                'observaciones': row[9] if row[9] else '',
-                'fecha_creacion': row[10] if row[10] else '',
-                'paciente': {
-                    'nombre': row[11] if row[11] else '',
-                    'apellido': row[12] if row[12] else '',
-                    'celular': row[13] if row[13] else '',
-                    'obra_social': row[14] if len(row) > 14 and row[14] else ''
-                }
-            }
-            turnos_medico.append(turno)
+        datetime.strptime(desde, "%Y-%m-%d")
+        datetime.strptime(hasta, "%Y-%m-%d")
+    except ValueError:
+        return jsonify({"error": "Fecha inválida, usar AAAA-MM-DD"}), 400
+    try:
+        limite = min(max(int(request.args.get("limite", 200)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "limite inválido"}), 400
+    estados = [e.strip() for e in request.args.get("estado", "").split(",") if e.strip()]
+    despues = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        # Cursor "fecha,hora,id" del último turno de la página anterior
+        try:
+            fecha_cursor, hora_cursor, id_cursor = cursor.split(",")
+            despues = (fecha_cursor, hora_cursor, int(id_cursor))
+        except ValueError:
+            return jsonify({"error": "cursor inválido"}), 400
 
-        if conn:
-            conn.close()
-        return jsonify(turnos_medico)
-        
+    try:
+        # Un turno de más para saber si hay otra página
+        filas = repos.turnos.del_medico(usuario_medico, desde, hasta, estados, despues, limite + 1)
+        contadores = repos.turnos.contar_por_estado(usuario_medico, desde, hasta)
     except Exception as e:
         print(f"ERROR - Error al obtener turnos del médico: {e}")
         import traceback
         traceback.print_exc()
-        if conn:
-            conn.close()
         return jsonify({"error": "Error interno al obtener turnos"}), 500
 
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        ultimo = filas[-1]
+        siguiente = f"{ultimo['fecha']},{ultimo['hora']},{ultimo['id']}"
+
+    turnos_medico = []
+    for fila in filas:
+        turnos_medico.append({
+            'id': fila['id'],
+            'dni_paciente': fila['dni_paciente'],
+            'medico': fila['medico'],
+            'fecha': fila['fecha'],
+            'hora': fila['hora'],
+            'estado': fila['estado'],
+            'tipo_consulta': fila['tipo_consulta'] or '',
+            'costo': fila['costo'] or 0,
+            'pagado': fila['pagado'] or 0,
+            'observaciones': fila['observaciones'] or '',
+            'fecha_creacion': fila['fecha_creacion'] or '',
+            'paciente': {
+                'nombre': fila['nombre'] or '',
+                'apellido': fila['apellido'] or '',
+                'celular': fila['celular'] or '',
+                'obra_social': fila['obra_social'] or '',
+                'edad': fila['edad'],
+            }
+        })
+
+    return jsonify({
+        "desde": desde,
+        "hasta": hasta,
+        "turnos": turnos_medico,
+        "contadores": contadores,
+        "total": sum(contadores.values()),
+        "siguiente": siguiente,
+    })
+
+def datos_turnos_dia(c, fecha):
+    """Turnos de una fecha con los datos de contacto del paciente, ordenados por hora"""
+    c.execute('''
+        SELECT t.id, t.medico, t.hora_turno as hora, t.fecha_turno as fecha, t.dni_paciente, t.estado,
+               p.nombre, p.apellido, p.celular, p.obra_social
+        FROM turnos t
+        LEFT JOIN pacientes p ON t.dni_paciente = p.dni
+        WHERE t.fecha_turno = ?
+        ORDER BY t.hora_turno
+    ''', (fecha,))
+    
+    turnos_dia = []
+    for row in c.fetchall():
+        paciente_nombre = row[6] if row[6] else ''
+        paciente_apellido = row[7] if row[7] else ''
+        
+        print(f"DEBUG Turno {row[0]}: DNI={row[4]}, Nombre='{paciente_nombre}', Apellido='{paciente_apellido}'")
+        
+        turno = {
+            'id': row[0],
+            'medico': row[1],
+            'hora': row[2],
+            'fecha': row[3],
+            'dni_paciente': row[4],
+            'estado': row[5],
+            'paciente': {
+                'nombre': paciente_nombre,
+                'apellido': paciente_apellido,
+                'celular': row[8] if row[8] else '',
+                'obra_social': row[9] if row[9] else ''
+            }
+        }
+        turnos_dia.append(turno)
+    return turnos_dia
+
 @app.route("/api/turnos/dia")
 @login_requerido
 def obtener_turnos_dia():
@@ -1287,40 +1897,7 @@ def obtener_turnos_dia():
     
     try:
         conn = get_db_connection()
-        c = conn.cursor()
-        
-        c.execute('''
-            SELECT t.id, t.medico, t.hora_turno as hora, t.fecha_turno as fecha, t.dni_paciente, t.estado,
-                   p.nombre, p.apellido, p.celular, p.obra_social
-            FROM turnos t
-            LEFT JOIN pacientes p ON t.dni_paciente = p.dni
-            WHERE t.fecha_turno = ?
-            ORDER BY t.hora_turno
-        ''', (fecha,))
-        
-        turnos_dia = []
-        for row in c.fetchall():
-            paciente_nombre = row[6] if row[6] else ''
-            paciente_apellido = row[7] if row[7] else ''
-            
-            print(f"DEBUG Turno {row[0]}: DNI={row[4]}, Nombre='{paciente_nombre}', Apellido='{paciente_apellido}'")
-            
-            turno = {
-                'id': row[0],
-                'medico': row[1],
-                'hora': row[2],
-                'fecha': row[3],
-                'dni_paciente': row[4],
-                'estado': row[5],
-                'paciente': {
-                    'nombre': paciente_nombre,
-                    'apellido': paciente_apellido,
-                    'celular': row[8] if row[8] else '',
-                    'obra_social': row[9] if row[9] else ''
-                }
-            }
-            turnos_dia.append(turno)
-
+        turnos_dia = datos_turnos_dia(conn.cursor(), fecha)
         conn.close()
         print(f"DEBUG: Devolviendo {len(turnos_dia)} turnos para fecha {fecha}")
         return jsonify(turnos_dia)
@@ -1330,206 +1907,270 @@ def obtener_turnos_dia():
             conn.close()
         return jsonify({"error": "Error al obtener turnos"}), 500
 
+def datos_sesion():
+    return {
+        "usuario": session.get("usuario"),
+        "rol": session.get("rol")
+    }
+
 @app.route("/api/session-info")
 @login_requerido
 def session_info():
-    return jsonify({
-        "usuario": session.get("usuario"),
-        "rol": session.get("rol")
-    })
+    return jsonify(datos_sesion())
 
 # ========================== REPORTES ADMIN ===========================
 
-@app.route("/api/reportes/turnos")
-@login_requerido
-@rol_requerido("administrador")
-def reportes_turnos():
-    """Reporte de turnos en rango (totales, atendidos, ausentes, por médico y por día)."""
-    fecha_inicio = request.args.get("fecha_inicio")
-    fecha_fin = request.args.get("fecha_fin")
-    # Defaults: último mes
+def rango_reporte(fecha_inicio, fecha_fin, dias_defecto=None):
+    """Completar el rango de un reporte: fin = hoy; inicio = primer día del mes de fin
+    o fin - dias_defecto. ValueError si alguna fecha no es AAAA-MM-DD."""
     if not fecha_fin:
         fecha_fin = date.today().isoformat()
+    d = datetime.strptime(fecha_fin, "%Y-%m-%d").date()
     if not fecha_inicio:
-        d = datetime.strptime(fecha_fin, "%Y-%m-%d").date()
-        inicio = d.replace(day=1)
+        inicio = d - timedelta(days=dias_defecto) if dias_defecto is not None else d.replace(day=1)
         fecha_inicio = inicio.isoformat()
+    datetime.strptime(fecha_inicio, "%Y-%m-%d")
+    return fecha_inicio, fecha_fin
 
-    conn = get_db_connection()
-    c = conn.cursor()
+def con_reportes(funcion, *args):
+    """Ejecutar funcion(cursor, *args) sobre una conexión de reportes"""
+    conn = get_reportes_connection()
     try:
-        c.execute(
-            """
-            SELECT medico, fecha_turno, estado
-            FROM turnos
-            WHERE fecha_turno BETWEEN ? AND ?
-            """,
-            (fecha_inicio, fecha_fin)
-        )
-        rows = c.fetchall()
-
-        total = len(rows)
-        atendidos = sum(1 for r in rows if (r[2] or '').lower() == 'atendido')
-        ausentes = sum(1 for r in rows if (r[2] or '').lower() == 'ausente')
-        pendientes = total - atendidos - ausentes
-        porcentaje_atencion = round((atendidos / total) * 100, 1) if total else 0.0
-        porcentaje_ausencias = round((ausentes / total) * 100, 1) if total else 0.0
-
-        stats_por_medico = {}
-        stats_por_dia = {}
-        for medico, fecha, estado in rows:
-            # por médico
-            m = stats_por_medico.setdefault(medico or 'Sin asignar', {"total": 0, "atendidos": 0, "ausentes": 0})
-            m["total"] += 1
-            if (estado or '').lower() == 'atendido':
-                m["atendidos"] += 1
-            elif (estado or '').lower() == 'ausente':
-                m["ausentes"] += 1
-            # por día
-            d = stats_por_dia.setdefault(fecha, {"total": 0, "atendidos": 0, "ausentes": 0})
-            d["total"] += 1
-            if (estado or '').lower() == 'atendido':
-                d["atendidos"] += 1
-            elif (estado or '').lower() == 'ausente':
-                d["ausentes"] += 1
-
-        return jsonify({
-            "total_turnos": total,
-            "turnos_atendidos": atendidos,
-            "turnos_ausentes": ausentes,
-            "turnos_pendientes": pendientes,
-            "porcentaje_atencion": porcentaje_atencion,
-            "porcentaje_ausencias": porcentaje_ausencias,
-            "stats_por_medico": stats_por_medico,
-            "stats_por_dia": stats_por_dia,
-        })
+        return funcion(conn.cursor(), *args)
     finally:
         conn.close()
 
+def tramo_de_reporte(funcion):
+    """calcular(cursor, inicio, fin) para resultados_por_mes: un tramo que va a la cache
+    se calcula con el cursor de la base principal que recibe; el resto, sobre la conexión
+    de reportes (el snapshot puede ser anterior a la invalidación de la cache)"""
+    def calcular(c, inicio, fin):
+        if c is not None:
+            return funcion(c, inicio, fin)
+        return con_reportes(funcion, inicio, fin)
+    return calcular
+
+def turnos_por_medico_y_dia(c, fecha_inicio, fecha_fin):
+    """Turnos del rango contados por médico y por día (total, atendidos, ausentes)"""
+    c.execute(
+        """
+        SELECT medico, fecha_turno, estado
+        FROM turnos_todos
+        WHERE fecha_turno BETWEEN ? AND ?
+        """,
+        (fecha_inicio, fecha_fin)
+    )
+    stats_por_medico = {}
+    stats_por_dia = {}
+    for medico, fecha, estado in c.fetchall():
+        # por médico
+        m = stats_por_medico.setdefault(medico or 'Sin asignar', {"total": 0, "atendidos": 0, "ausentes": 0})
+        m["total"] += 1
+        if (estado or '').lower() == 'atendido':
+            m["atendidos"] += 1
+        elif (estado or '').lower() == 'ausente':
+            m["ausentes"] += 1
+        # por día
+        d = stats_por_dia.setdefault(fecha, {"total": 0, "atendidos": 0, "ausentes": 0})
+        d["total"] += 1
+        if (estado or '').lower() == 'atendido':
+            d["atendidos"] += 1
+        elif (estado or '').lower() == 'ausente':
+            d["ausentes"] += 1
+    return {"stats_por_medico": stats_por_medico, "stats_por_dia": stats_por_dia}
+
+def reporte_turnos(fecha_inicio, fecha_fin):
+    """Totales, porcentajes y conteos por médico y por día; los meses cerrados salen de reportes_cache"""
+    tramos = resultados_por_mes(
+        get_db_connection, "turnos", fecha_inicio, fecha_fin, tramo_de_reporte(turnos_por_medico_y_dia)
+    )
+    stats_por_medico = {}
+    stats_por_dia = {}
+    for tramo in tramos:
+        for medico, st in tramo["stats_por_medico"].items():
+            m = stats_por_medico.setdefault(medico, {"total": 0, "atendidos": 0, "ausentes": 0})
+            for clave in m:
+                m[clave] += st[clave]
+        stats_por_dia.update(tramo["stats_por_dia"])
+
+    total = sum(d["total"] for d in stats_por_dia.values())
+    atendidos = sum(d["atendidos"] for d in stats_por_dia.values())
+    ausentes = sum(d["ausentes"] for d in stats_por_dia.values())
+    return {
+        "total_turnos": total,
+        "turnos_atendidos": atendidos,
+        "turnos_ausentes": ausentes,
+        "turnos_pendientes": total - atendidos - ausentes,
+        "porcentaje_atencion": round((atendidos / total) * 100, 1) if total else 0.0,
+        "porcentaje_ausencias": round((ausentes / total) * 100, 1) if total else 0.0,
+        "stats_por_medico": stats_por_medico,
+        "stats_por_dia": stats_por_dia,
+    }
+
+@app.route("/api/reportes/turnos")
+@login_requerido
+@rol_requerido("administrador")
+def reportes_turnos():
+    """Reporte de turnos en rango (totales, atendidos, ausentes, por médico y por día)."""
+    # Defaults: último mes
+    try:
+        fecha_inicio, fecha_fin = rango_reporte(request.args.get("fecha_inicio"), request.args.get("fecha_fin"))
+    except ValueError:
+        return jsonify({"error": "Formato de fecha inválido (usar YYYY-MM-DD)"}), 400
+    return jsonify(reporte_turnos(fecha_inicio, fecha_fin))
+
+def ocupacion_por_medico_y_dia(c, fecha_inicio, fecha_fin):
+    """Slots disponibles (agenda fija + reglas) y ocupados por médico y por día del rango"""
+    # Slots configurados por médico y día
+    c.execute("SELECT medico FROM agenda UNION SELECT medico FROM agenda_reglas WHERE activo = 1")
+    medicos = [row[0] for row in c.fetchall()]
+
+    # Contabilizar slots disponibles por médico/día del período
+    ocupacion_por_medico = {m: {"slots_disponibles": 0, "slots_ocupados": 0} for m in medicos}
+    ocupacion_por_dia = {}
+
+    # Construir mapa de agenda: medico -> dia_semana -> horas
+    c.execute("SELECT medico, dia_semana, horario FROM agenda")
+    agenda_rows = c.fetchall()
+    agenda_map = {}
+    for med, dia, hora in agenda_rows:
+        agenda_map.setdefault(med, {}).setdefault(dia.upper(), []).append(hora)
+
+    # Reglas recurrentes: se expanden por fecha dentro del recorrido
+    c.execute(f"SELECT medico, {', '.join(COLUMNAS_REGLA)} FROM agenda_reglas WHERE activo = 1")
+    reglas_map = {}
+    for row in c.fetchall():
+        reglas_map.setdefault(row[0], {}).setdefault(row[1], []).append(dict(zip(COLUMNAS_REGLA, row[1:])))
+
+    # Helper día semana
+    def dia_es_de_fecha(fecha_iso: str) -> str:
+        dt = datetime.strptime(fecha_iso, "%Y-%m-%d").date()
+        mapping = {0: 'LUNES', 1: 'MARTES', 2: 'MIERCOLES', 3: 'JUEVES', 4: 'VIERNES', 5: 'SABADO', 6: 'DOMINGO'}
+        return mapping[dt.weekday()]
+
+    # Recorrer días del rango
+    dt_ini = datetime.strptime(fecha_inicio, "%Y-%m-%d").date()
+    dt_fin = datetime.strptime(fecha_fin, "%Y-%m-%d").date()
+
+    c.execute(
+        """
+        SELECT medico, fecha_turno, hora_turno
+        FROM turnos_todos
+        WHERE fecha_turno BETWEEN ? AND ?
+        """,
+        (fecha_inicio, fecha_fin)
+    )
+    turnos_rows = c.fetchall()
+    ocupados_idx = {(med, f, h) for med, f, h in turnos_rows}
+
+    current = dt_ini
+    while current <= dt_fin:
+        fecha_str = current.isoformat()
+        dia_semana = dia_es_de_fecha(fecha_str)
+        day_stats = ocupacion_por_dia.setdefault(fecha_str, {"slots_disponibles": 0, "slots_ocupados": 0, "porcentaje_ocupacion": 0})
+        for med in medicos:
+            horas = (agenda_map.get(med, {}).get(dia_semana, []))
+            reglas = reglas_map.get(med, {}).get(dia_semana)
+            if reglas:
+                horas = set(horas).union(horarios_de_reglas(reglas, fecha_str))
+            day_stats["slots_disponibles"] += len(horas)
+            ocupacion_por_medico[med]["slots_disponibles"] += len(horas)
+            for h in horas:
+                if (med, fecha_str, h) in ocupados_idx:
+                    day_stats["slots_ocupados"] += 1
+                    ocupacion_por_medico[med]["slots_ocupados"] += 1
+        # porcentaje por día
+        disp = day_stats["slots_disponibles"]
+        day_stats["porcentaje_ocupacion"] = round((day_stats["slots_ocupados"] / disp) * 100) if disp else 0
+        current += timedelta(days=1)
+
+    return {"ocupacion_por_medico": ocupacion_por_medico, "ocupacion_por_dia": ocupacion_por_dia}
+
+def reporte_ocupacion(fecha_inicio, fecha_fin):
+    """Ocupación promedio, por médico y por día; los meses cerrados salen de reportes_cache"""
+    tramos = resultados_por_mes(
+        get_db_connection, "ocupacion", fecha_inicio, fecha_fin, tramo_de_reporte(ocupacion_por_medico_y_dia)
+    )
+    ocupacion_por_medico = {}
+    ocupacion_por_dia = {}
+    for tramo in tramos:
+        for med, st in tramo["ocupacion_por_medico"].items():
+            m = ocupacion_por_medico.setdefault(med, {"slots_disponibles": 0, "slots_ocupados": 0, "porcentaje_ocupacion": 0})
+            m["slots_disponibles"] += st["slots_disponibles"]
+            m["slots_ocupados"] += st["slots_ocupados"]
+        ocupacion_por_dia.update(tramo["ocupacion_por_dia"])
+
+    # porcentaje por médico
+    for med, st in ocupacion_por_medico.items():
+        disp = st["slots_disponibles"]
+        st["porcentaje_ocupacion"] = round((st["slots_ocupados"] / disp) * 100) if disp else 0
+
+    total_disp = sum(st["slots_disponibles"] for st in ocupacion_por_dia.values())
+    total_oc = sum(st["slots_ocupados"] for st in ocupacion_por_dia.values())
+    ocupacion_promedio = round((total_oc / total_disp) * 100) if total_disp else 0
+
+    return {
+        "ocupacion_promedio": ocupacion_promedio,
+        "total_slots_disponibles": total_disp,
+        "total_slots_ocupados": total_oc,
+        "ocupacion_por_medico": ocupacion_por_medico,
+        "ocupacion_por_dia": ocupacion_por_dia,
+    }
+
 @app.route("/api/reportes/ocupacion")
 @login_requerido
 @rol_requerido("administrador")
 def reportes_ocupacion():
     """Reporte básico de ocupación de agenda: slots disponibles vs ocupados en rango."""
-    fecha_inicio = request.args.get("fecha_inicio")
-    fecha_fin = request.args.get("fecha_fin")
-    if not fecha_fin:
-        fecha_fin = date.today().isoformat()
-    if not fecha_inicio:
-        d = datetime.strptime(fecha_fin, "%Y-%m-%d").date()
-        inicio = d - timedelta(days=6)
-        fecha_inicio = inicio.isoformat()
-
-    conn = get_db_connection()
-    c = conn.cursor()
+    # Defaults: últimos 7 días
     try:
-        # Slots configurados por médico y día
-        c.execute("SELECT DISTINCT medico FROM agenda")
-        medicos = [row[0] for row in c.fetchall()]
-
-        # Contabilizar slots disponibles por médico/día del período
-        ocupacion_por_medico = {m: {"slots_disponibles": 0, "slots_ocupados": 0, "porcentaje_ocupacion": 0} for m in medicos}
-        ocupacion_por_dia = {}
-
-        # Construir mapa de agenda: medico -> dia_semana -> horas
-        c.execute("SELECT medico, dia_semana, horario FROM agenda")
-        agenda_rows = c.fetchall()
-        agenda_map = {}
-        for med, dia, hora in agenda_rows:
-            agenda_map.setdefault(med, {}).setdefault(dia.upper(), []).append(hora)
-
-        # Helper día semana
-        def dia_es_de_fecha(fecha_iso: str) -> str:
-            dt = datetime.strptime(fecha_iso, "%Y-%m-%d").date()
-            mapping = {0: 'LUNES', 1: 'MARTES', 2: 'MIERCOLES', 3: 'JUEVES', 4: 'VIERNES', 5: 'SABADO', 6: 'DOMINGO'}
-            return mapping[dt.weekday()]
+        fecha_inicio, fecha_fin = rango_reporte(request.args.get("fecha_inicio"), request.args.get("fecha_fin"), dias_defecto=6)
+    except ValueError:
+        return jsonify({"error": "Formato de fecha inválido (usar YYYY-MM-DD)"}), 400
+    return jsonify(reporte_ocupacion(fecha_inicio, fecha_fin))
 
-        # Recorrer días del rango
-        dt_ini = datetime.strptime(fecha_inicio, "%Y-%m-%d").date()
-        dt_fin = datetime.strptime(fecha_fin, "%Y-%m-%d").date()
+def reporte_pacientes():
+    """Resumen de pacientes: total, edad promedio y distribuciones."""
+    rangos_def = [(0, 12), (13, 19), (20, 39), (40, 59), (60, 120)]
+    casos_rango = " ".join(f"WHEN edad BETWEEN {a} AND {b} THEN '{a}-{b}'" for a, b in rangos_def)
 
+    conn = get_reportes_connection()
+    c = conn.cursor()
+    try:
+        # Edad e incompletos agregados en SQL (una pasada), sin traer los pacientes a Python
         c.execute(
+            f"""
+            SELECT CASE {casos_rango} END AS rango, COUNT(*), SUM(edad), SUM(incompleto)
+            FROM (SELECT {SQL_EDAD} AS edad, incompleto FROM pacientes)
+            GROUP BY rango
             """
-            SELECT medico, fecha_turno, hora_turno
-            FROM turnos
-            WHERE fecha_turno BETWEEN ? AND ?
-            """,
-            (fecha_inicio, fecha_fin)
         )
-        turnos_rows = c.fetchall()
-        ocupados_idx = {(med, f, h) for med, f, h in turnos_rows}
-
-        current = dt_ini
-        while current <= dt_fin:
-            fecha_str = current.isoformat()
-            dia_semana = dia_es_de_fecha(fecha_str)
-            day_stats = ocupacion_por_dia.setdefault(fecha_str, {"slots_disponibles": 0, "slots_ocupados": 0, "porcentaje_ocupacion": 0})
-            for med in medicos:
-                horas = (agenda_map.get(med, {}).get(dia_semana, []))
-                day_stats["slots_disponibles"] += len(horas)
-                ocupacion_por_medico[med]["slots_disponibles"] += len(horas)
-                for h in horas:
-                    if (med, fecha_str, h) in ocupados_idx:
-                        day_stats["slots_ocupados"] += 1
-                        ocupacion_por_medico[med]["slots_ocupados"] += 1
-            # porcentaje por día
-            disp = day_stats["slots_disponibles"]
-            day_stats["porcentaje_ocupacion"] = round((day_stats["slots_ocupados"] / disp) * 100) if disp else 0
-            current += timedelta(days=1)
-
-        # porcentaje por médico
-        for med, st in ocupacion_por_medico.items():
-            disp = st["slots_disponibles"]
-            st["porcentaje_ocupacion"] = round((st["slots_ocupados"] / disp) * 100) if disp else 0
-
-        total_disp = sum(st["slots_disponibles"] for st in ocupacion_por_dia.values())
-        total_oc = sum(st["slots_ocupados"] for st in ocupacion_por_dia.values())
-        ocupacion_promedio = round((total_oc / total_disp) * 100) if total_disp else 0
-
-        return jsonify({
-            "ocupacion_promedio": ocupacion_promedio,
-            "total_slots_disponibles": total_disp,
-            "total_slots_ocupados": total_oc,
-            "ocupacion_por_medico": ocupacion_por_medico,
-            "ocupacion_por_dia": ocupacion_por_dia,
-        })
-    finally:
-        conn.close()
+        rangos = {f"{a}-{b}": 0 for a, b in rangos_def}
+        total = suma_edades = incompletos = 0
+        for rango, cantidad, suma, sin_datos in c.fetchall():
+            if rango:
+                rangos[rango] = cantidad
+            total += cantidad
+            suma_edades += suma or 0
+            incompletos += sin_datos or 0
+        promedio = round(suma_edades / total) if total else 0
+
+        # obras sociales
+        c.execute(
+            """
+            SELECT coalesce(nullif(trim(obra_social), ''), 'Sin obra social') AS obra, COUNT(*)
+            FROM pacientes
+            GROUP BY obra
+            """
+        )
+        obras = dict(c.fetchall())
 
-@app.route("/api/reportes/pacientes")
-@login_requerido
-@rol_requerido("administrador")
-def reportes_pacientes():
-    """Resumen de pacientes: total, edad promedio y distribuciones."""
-    pacientes = cargar_pacientes()
-    total = len(pacientes)
-    edades = [p.get("edad", 0) or 0 for p in pacientes if isinstance(p.get("edad"), int)]
-    promedio = round(sum(edades) / len(edades)) if edades else 0
-
-    # obras sociales
-    obras = {}
-    for p in pacientes:
-        os_name = (p.get("obra_social") or "Sin obra social").strip() or "Sin obra social"
-        obras[os_name] = obras.get(os_name, 0) + 1
-
-    # rangos de edad
-    rangos_def = [(0, 12), (13, 19), (20, 39), (40, 59), (60, 120)]
-    rangos = {f"{a}-{b}": 0 for a, b in rangos_def}
-    for e in edades:
-        for a, b in rangos_def:
-            if a <= e <= b:
-                rangos[f"{a}-{b}"] += 1
-                break
-
-    # pacientes más activos por cantidad de turnos
-    conn = get_db_connection()
-    c = conn.cursor()
-    try:
+        # pacientes más activos por cantidad de turnos
         c.execute(
             """
             SELECT p.nombre || ' ' || p.apellido as nombre, COUNT(t.id) as cnt
             FROM pacientes p
-            LEFT JOIN turnos t ON t.dni_paciente = p.dni
+            LEFT JOIN turnos_todos t ON t.dni_paciente = p.dni
             GROUP BY p.dni
             ORDER BY cnt DESC
             LIMIT 10
@@ -1539,13 +2180,50 @@ def reportes_pacientes():
     finally:
         conn.close()
 
-    return jsonify({
+    return {
         "total_pacientes": total,
         "estadisticas_edad": {"promedio": promedio, "rangos": rangos},
-        "pacientes_sin_turnos": sum(1 for p in pacientes if p.get("incompleto")),
+        "pacientes_sin_turnos": incompletos,
         "obras_sociales": obras,
         "pacientes_activos": top,
-    })
+    }
+
+@app.route("/api/reportes/pacientes")
+@login_requerido
+@rol_requerido("administrador")
+def reportes_pacientes():
+    """Resumen de pacientes: total, edad promedio y distribuciones."""
+    return jsonify(reporte_pacientes())
+
+@app.route("/api/admin/resumen")
+@login_requerido
+@rol_requerido("administrador")
+def resumen_administrador():
+    """Panel del administrador en una respuesta: ingresos de `?mes=` (mes actual por defecto),
+    turnos de ese mes (hasta hoy si es el actual), ocupación de los últimos 7 días,
+    resumen de pacientes, médicos con agenda y sesión."""
+    mes = request.args.get("mes") or datetime.now().strftime("%Y-%m")
+    try:
+        inicio_mes, fin_mes = rango_mes(mes)
+    except ValueError:
+        return jsonify({"error": "Formato de mes inválido (usar YYYY-MM)"}), 400
+    hoy = date.today().isoformat()
+    if inicio_mes <= hoy < fin_mes:
+        fin_mes = hoy
+
+    try:
+        payload = {
+            "mes": mes,
+            "ingresos_mes": reporte_pagos_mes(mes),
+            "turnos_mes": reporte_turnos(inicio_mes, fin_mes),
+            "ocupacion_semana": reporte_ocupacion(*rango_reporte(None, hoy, dias_defecto=6)),
+            "pacientes": reporte_pacientes(),
+            "medicos": list(cargar_agenda()),
+            "sesion": datos_sesion(),
+        }
+    except Exception as e:
+        return jsonify({"error": f"Error al obtener resumen: {str(e)}"}), 500
+    return respuesta_catalogo(payload, 200, calcular_etag(payload), cache_control="private, no-cache")
 
 # ====================== DESCARGA DE BASE DE DATOS (ADMIN) ======================
 
@@ -1580,12 +2258,12 @@ def reportes_atenciones():
         d = datetime.strptime(fecha_fin, "%Y-%m-%d").date()
         fecha_inicio = d.replace(day=1).isoformat()
 
-    conn = get_db_connection()
+    conn = get_reportes_connection()
     c = conn.cursor()
     try:
         query = [
             "SELECT p.dni, p.nombre, p.apellido, p.obra_social, p.numero_obra_social, COUNT(1) as atenciones",
-            "FROM turnos t",
+            "FROM turnos_todos t",
             "INNER JOIN pacientes p ON p.dni = t.dni_paciente",
             "WHERE t.estado = 'atendido' AND t.fecha_turno BETWEEN ? AND ?",
         ]
@@ -1654,6 +2332,36 @@ def session_debug():
         "cookies": dict(request.cookies)
     })
 
+def datos_estadisticas_pagos(c, fecha):
+    """Totales de pagos del día (en general y por método) y del mes de `fecha`"""
+    # Día completo en una sola pasada por pagos de la fecha
+    c.execute("""
+        SELECT COALESCE(SUM(monto), 0), COUNT(*),
+               COALESCE(SUM(CASE WHEN metodo_pago = 'efectivo' THEN monto END), 0),
+               COUNT(CASE WHEN metodo_pago = 'efectivo' THEN 1 END),
+               COALESCE(SUM(CASE WHEN metodo_pago = 'transferencia' THEN monto END), 0),
+               COUNT(CASE WHEN metodo_pago = 'transferencia' THEN 1 END)
+        FROM pagos
+        WHERE fecha_pago = ?
+    """, (fecha,))
+    row_dia = c.fetchone()
+    
+    # Total del mes
+    mes_actual = fecha[:7]  # YYYY-MM
+    c.execute("SELECT COALESCE(SUM(monto), 0) FROM pagos WHERE fecha_pago LIKE ?", (mes_actual + '%',))
+    total_mes = float(c.fetchone()[0])
+    
+    return {
+        "total_dia": float(row_dia[0]),
+        "total_mes": total_mes,
+        "cantidad_pagos_dia": row_dia[1],
+        "total_efectivo_hoy": float(row_dia[2]),
+        "pagos_efectivo_hoy": row_dia[3],
+        "total_transferencia_hoy": float(row_dia[4]),
+        "pagos_transferencia_hoy": row_dia[5],
+        "fecha": fecha
+    }
+
 @app.route("/api/pagos/estadisticas")
 @login_requerido
 def estadisticas_pagos():
@@ -1662,49 +2370,40 @@ def estadisticas_pagos():
     
     try:
         conn = get_db_connection()
-        c = conn.cursor()
-        
-        # Total del día
-        c.execute("SELECT COALESCE(SUM(monto), 0), COUNT(*) FROM pagos WHERE fecha_pago = ?", (fecha,))
-        row_dia = c.fetchone()
-        total_dia = float(row_dia[0])
-        cantidad_pagos_dia = row_dia[1]
-        
-        # Total del mes
-        mes_actual = fecha[:7]  # YYYY-MM
-        c.execute("SELECT COALESCE(SUM(monto), 0) FROM pagos WHERE fecha_pago LIKE ?", (mes_actual + '%',))
-        total_mes = float(c.fetchone()[0])
-        
-        # Efectivo del día
-        c.execute("SELECT COALESCE(SUM(monto), 0), COUNT(*) FROM pagos WHERE fecha_pago = ? AND metodo_pago = 'efectivo'", (fecha,))
-        row_efectivo = c.fetchone()
-        total_efectivo_hoy = float(row_efectivo[0])
-        pagos_efectivo_hoy = row_efectivo[1]
-        
-        # Transferencias del día
-        c.execute("SELECT COALESCE(SUM(monto), 0), COUNT(*) FROM pagos WHERE fecha_pago = ? AND metodo_pago = 'transferencia'", (fecha,))
-        row_transfer = c.fetchone()
-        total_transferencia_hoy = float(row_transfer[0])
-        pagos_transferencia_hoy = row_transfer[1]
-        
+        estadisticas = datos_estadisticas_pagos(conn.cursor(), fecha)
         conn.close()
-        
-        return jsonify({
-            "total_dia": total_dia,
-            "total_mes": total_mes,
-            "cantidad_pagos_dia": cantidad_pagos_dia,
-            "total_efectivo_hoy": total_efectivo_hoy,
-            "pagos_efectivo_hoy": pagos_efectivo_hoy,
-            "total_transferencia_hoy": total_transferencia_hoy,
-            "pagos_transferencia_hoy": pagos_transferencia_hoy,
-            "fecha": fecha
-        })
+        return jsonify(estadisticas)
         
     except Exception as e:
         if 'conn' in locals():
             conn.close()
         return jsonify({"error": "Error al obtener estadísticas"}), 500
 
+def datos_recepcionados(c, fecha):
+    """Pacientes recepcionados en `fecha`, pendientes de cobro"""
+    # Una fila por turno: el cobro se hace por turno_id
+    c.execute("""
+        SELECT p.dni, p.nombre, p.apellido, p.celular, t.id, t.hora_turno, t.medico, p.obra_social
+        FROM turnos t
+        INNER JOIN pacientes p ON p.dni = t.dni_paciente  
+        WHERE t.fecha_turno = ? AND t.estado = 'recepcionado'
+        ORDER BY t.hora_turno, p.apellido, p.nombre
+    """, (fecha,))
+    
+    pacientes = []
+    for row in c.fetchall():
+        pacientes.append({
+            "dni": row[0],
+            "nombre": row[1],
+            "apellido": row[2], 
+            "celular": row[3],
+            "turno_id": row[4],
+            "hora": row[5],
+            "medico": row[6],
+            "obra_social": row[7]
+        })
+    return pacientes
+
 @app.route("/api/pacientes/recepcionados")
 @login_requerido
 def pacientes_recepcionados():
@@ -1713,25 +2412,7 @@ def pacientes_recepcionados():
     
     try:
         conn = get_db_connection()
-        c = conn.cursor()
-        
-        c.execute("""
-            SELECT DISTINCT p.dni, p.nombre, p.apellido, p.celular
-            FROM pacientes p
-            INNER JOIN turnos t ON p.dni = t.dni_paciente  
-            WHERE t.fecha_turno = ? AND t.estado = 'recepcionado'
-            ORDER BY p.apellido, p.nombre
-        """, (fecha,))
-        
-        pacientes = []
-        for row in c.fetchall():
-            pacientes.append({
-                "dni": row[0],
-                "nombre": row[1],
-                "apellido": row[2], 
-                "celular": row[3]
-            })
-        
+        pacientes = datos_recepcionados(conn.cursor(), fecha)
         conn.close()
         return jsonify(pacientes)
         
@@ -1740,6 +2421,44 @@ def pacientes_recepcionados():
             conn.close()
         return jsonify({"error": "Error al obtener pacientes"}), 500
 
+def datos_sala_espera(c, fecha):
+    """Pacientes en sala de espera en `fecha`, con el pago del día si lo hay"""
+    c.execute("""
+        SELECT DISTINCT t.hora_turno, t.medico, p.dni, p.nombre, p.apellido, p.celular,
+               pay.monto, pay.metodo_pago, pay.fecha_pago, pay.obra_social, pay.fecha_creacion
+        FROM turnos t
+        LEFT JOIN pacientes p ON t.dni_paciente = p.dni
+        LEFT JOIN pagos pay ON pay.dni_paciente = p.dni AND pay.fecha_pago = ?
+        WHERE t.fecha_turno = ? AND t.estado = 'sala de espera'  
+        ORDER BY t.hora_turno, p.apellido, p.nombre
+    """, (fecha, fecha))
+    
+    pacientes = []
+    for row in c.fetchall():
+        # Extraer hora de la fecha_creacion del pago
+        hora_cobro = ""
+        if row[10]:  # fecha_creacion
+            try:
+                dt = datetime.fromisoformat(row[10].replace('Z', '+00:00'))
+                hora_cobro = dt.strftime("%H:%M")
+            except:
+                hora_cobro = ""
+        
+        pacientes.append({
+            "hora": row[0],
+            "medico": row[1],
+            "dni": row[2],
+            "nombre": row[3], 
+            "apellido": row[4],
+            "celular": row[5],
+            "monto_pagado": row[6] if row[6] else 0,
+            "tipo_pago": row[7] if row[7] else "",
+            "fecha_pago": row[8] if row[8] else "",
+            "obra_social": row[9] if row[9] else "",
+            "hora_cobro": hora_cobro
+        })
+    return pacientes
+
 @app.route("/api/pacientes/sala-espera")
 @login_requerido
 def pacientes_sala_espera():
@@ -1748,44 +2467,7 @@ def pacientes_sala_espera():
     
     try:
         conn = get_db_connection()
-        c = conn.cursor()
-        
-        c.execute("""
-            SELECT DISTINCT t.hora_turno, t.medico, p.dni, p.nombre, p.apellido, p.celular,
-                   pay.monto, pay.metodo_pago, pay.fecha_pago, pay.obra_social, pay.fecha_creacion
-            FROM turnos t
-            LEFT JOIN pacientes p ON t.dni_paciente = p.dni
-            LEFT JOIN pagos pay ON pay.dni_paciente = p.dni AND pay.fecha_pago = ?
-            WHERE t.fecha_turno = ? AND t.estado = 'sala de espera'  
-            ORDER BY t.hora_turno, p.apellido, p.nombre
-        """, (fecha, fecha))
-        
-        pacientes = []
-        for row in c.fetchall():
-            # Extraer hora de la fecha_creacion del pago
-            hora_cobro = ""
-            if row[10]:  # fecha_creacion
-                try:
-                    from datetime import datetime
-                    dt = datetime.fromisoformat(row[10].replace('Z', '+00:00'))
-                    hora_cobro = dt.strftime("%H:%M")
-                except:
-                    hora_cobro = ""
-            
-            pacientes.append({
-                "hora": row[0],
-                "medico": row[1],
-                "dni": row[2],
-                "nombre": row[3], 
-                "apellido": row[4],
-                "celular": row[5],
-                "monto_pagado": row[6] if row[6] else 0,
-                "tipo_pago": row[7] if row[7] else "",
-                "fecha_pago": row[8] if row[8] else "",
-                "obra_social": row[9] if row[9] else "",
-                "hora_cobro": hora_cobro
-            })
-        
+        pacientes = datos_sala_espera(conn.cursor(), fecha)
         conn.close()
         return jsonify(pacientes)
         
@@ -1794,6 +2476,49 @@ def pacientes_sala_espera():
             conn.close()
         return jsonify({"error": "Error al obtener pacientes"}), 500
 
+def datos_medicos_activos(c):
+    """Médicos activos para los selectores (sin datos de acceso)"""
+    c.execute("""
+        SELECT usuario, nombre_completo, especialidad
+        FROM usuarios
+        WHERE rol = 'medico' AND activo = 1
+        ORDER BY id
+    """)
+    return [{"usuario": row[0], "nombre_completo": row[1], "especialidad": row[2]} for row in c.fetchall()]
+
+@app.route("/api/secretaria/resumen")
+@login_requerido
+@rol_permitido(["secretaria", "administrador"])
+def resumen_secretaria():
+    """Todo lo que muestra el panel de secretaria para una fecha, en una sola respuesta.
+    Las consultas corren en una transacción de lectura: ven la misma versión de la base."""
+    fecha = request.args.get("fecha", date.today().isoformat())
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("BEGIN")
+        payload = {
+            "fecha": fecha,
+            "turnos_dia": datos_turnos_dia(c, fecha),
+            "recepcionados": datos_recepcionados(c, fecha),
+            "sala_espera": datos_sala_espera(c, fecha),
+            "estadisticas_pagos": datos_estadisticas_pagos(c, fecha),
+            "bloqueos": datos_bloqueos(c),
+            "medicos": datos_medicos_activos(c),
+            "sesion": datos_sesion(),
+        }
+        conn.rollback()
+        conn.close()
+    except Exception as e:
+        if conn:
+            conn.close()
+        return jsonify({"error": f"Error al obtener resumen: {str(e)}"}), 500
+    
+    # Datos por usuario y cambiantes: el navegador guarda la copia pero revalida siempre
+    return respuesta_catalogo(payload, 200, calcular_etag(payload), cache_control="private, no-cache")
+
 # Rutas de vistas
 @app.route("/secretaria")
 @login_requerido
@@ -1862,48 +2587,34 @@ def recepcionar_paciente():
     if not all([dni_paciente, fecha, hora]):
         return jsonify({"error": "DNI, fecha y hora son requeridos"}), 400
     
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        
-        # Verificar que existe el turno
-        cur.execute("""
-            SELECT estado FROM turnos 
-            WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?
-        """, (dni_paciente, fecha, hora))
-        
-        turno = cur.fetchone()
-        if not turno:
-            return jsonify({"error": "Turno no encontrado"}), 404
-        
-        # Actualizar estado a 'recepcionado'
-        cur.execute("""
-            UPDATE turnos 
-            SET estado='recepcionado'
-            WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?
-        """, (dni_paciente, fecha, hora))
-        
-        conn.commit()
-        return jsonify({"mensaje": "Paciente recepcionado correctamente"})
-    
-    except Exception as e:
-        return jsonify({"error": f"Error al recepcionar paciente: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
+    return responder_comando("recepcionar", {"dni_paciente": dni_paciente, "fecha": fecha, "hora": hora},
+                             "Error al recepcionar paciente")
+
+@app.route("/api/turnos/<int:turno_id>/recepcionar", methods=["PUT"])
+@login_requerido
+@rol_permitido(["secretaria"])
+def recepcionar_paciente_por_id(turno_id):
+    """Pasar el turno `turno_id` a 'recepcionado'"""
+    return responder_comando("recepcionar", {"turno_id": turno_id}, "Error al recepcionar paciente")
 
 # ========================== ADMINISTRADOR ============================
 
-@app.route("/api/pagos/estadisticas-admin", methods=["GET"])
+@app.route("/api/admin/metricas-escritura", methods=["GET"])
 @login_requerido
 @rol_requerido("administrador")
-def obtener_estadisticas_pagos_admin():
-    """Estadísticas mensuales de pagos para panel de administrador."""
-    mes = request.args.get("mes")
-    if not mes:
-        mes = datetime.now().strftime("%Y-%m")
-
-    pagos_mes = cargar_pagos_mes_con_pacientes(mes)
+def metricas_escritura():
+    """Histogramas de espera por el lock de escritura, por endpoint (worker actual)"""
+    metricas = obtener_metricas_escritura()
+    metricas["escritor_unico"] = _escritor.estadisticas() if _escritor else None
+    return jsonify(metricas)
+
+def estadisticas_pagos_mes(mes, c=None):
+    """Totales del mes por tipo de pago y detalle por día con los pacientes.
+    Con el cursor `c` lee de esa conexión; si no, de la de reportes."""
+    if c is not None:
+        pagos_mes = pagos_mes_con_pacientes(c, mes)
+    else:
+        pagos_mes = cargar_pagos_mes_con_pacientes(mes, conectar=get_reportes_connection)
 
     total_mes = sum(p.get("monto", 0) for p in pagos_mes)
     pagos_particulares = sum(1 for p in pagos_mes if (p.get("monto", 0) or 0) > 0)
@@ -1934,7 +2645,7 @@ def obtener_estadisticas_pagos_admin():
             "tipo_pago": pago.get("tipo_pago", "")
         })
 
-    return jsonify({
+    return {
         "total_mes": total_mes,
         "pagos_particulares": pagos_particulares,
         "pagos_obra_social": pagos_obra_social,
@@ -1946,7 +2657,27 @@ def obtener_estadisticas_pagos_admin():
         "total_efectivo": total_efectivo,
         "total_transferencia": total_transferencia,
         "total_obra_social": total_obra_social,
-    })
+    }
+
+def reporte_pagos_mes(mes):
+    """estadisticas_pagos_mes(mes); un mes cerrado sale de reportes_cache"""
+    try:
+        inicio, fin = rango_mes(mes)
+    except ValueError:
+        # Filtro libre (LIKE 'mes%'): no es un período que se pueda cachear
+        return estadisticas_pagos_mes(mes)
+    return resultados_por_mes(get_db_connection, "pagos_mes", inicio, fin,
+                              lambda c, *_: estadisticas_pagos_mes(mes, c), parametros={"mes": mes})[0]
+
+@app.route("/api/pagos/estadisticas-admin", methods=["GET"])
+@login_requerido
+@rol_requerido("administrador")
+def obtener_estadisticas_pagos_admin():
+    """Estadísticas mensuales de pagos para panel de administrador."""
+    mes = request.args.get("mes")
+    if not mes:
+        mes = datetime.now().strftime("%Y-%m")
+    return jsonify(reporte_pagos_mes(mes))
 
 @app.route("/api/pagos/exportar-admin", methods=["GET"])
 @login_requerido
@@ -1957,11 +2688,11 @@ def exportar_pagos_csv_admin():
     mes = request.args.get("mes")
     if fecha_param:
         filtro_mes = fecha_param[:7]
-        pagos = [p for p in cargar_pagos_mes_con_pacientes(filtro_mes) if p.get("fecha") == fecha_param]
+        pagos = [p for p in cargar_pagos_mes_con_pacientes(filtro_mes, conectar=get_reportes_connection) if p.get("fecha") == fecha_param]
     else:
         if not mes:
             mes = datetime.now().strftime("%Y-%m")
-        pagos = cargar_pagos_mes_con_pacientes(mes)
+        pagos = cargar_pagos_mes_con_pacientes(mes, conectar=get_reportes_connection)
 
     output = io.StringIO()
     writer = csv.writer(output)
@@ -1984,6 +2715,54 @@ def exportar_pagos_csv_admin():
     nombre = f"pagos_{fecha_param}.csv" if fecha_param else f"pagos_{mes}.csv"
     return send_file(mem, mimetype="text/csv", as_attachment=True, download_name=nombre)
 
+def validar_cobro(data):
+    """Validar monto y tipo de pago de un cobro. Devuelve (monto, tipo_pago, error)"""
+    try:
+        monto = float(data.get("monto", 0))
+    except (ValueError, TypeError):
+        return None, None, "Monto inválido"
+    if monto < 0:
+        return None, None, "El monto no puede ser negativo"
+
+    tipo_pago = data.get("tipo_pago", "efectivo")
+    if monto == 0:
+        tipo_pago = "obra_social"
+    elif tipo_pago not in ["efectivo", "transferencia"]:
+        return None, None, "Tipo de pago inválido. Debe ser 'efectivo' o 'transferencia'"
+    return monto, tipo_pago, None
+
+@app.route("/api/pagos/cobrar-y-sala", methods=["PUT"])
+@login_requerido
+@rol_permitido(["secretaria", "administrador"])
+def cobrar_y_pasar_a_sala():
+    """Cobrar un turno recepcionado y pasarlo a sala de espera en una sola transacción.
+    Acepta `turno_id` (preferido) o `dni_paciente` + `fecha` [+ `hora`]."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Cuerpo inválido; enviar JSON"}), 400
+
+    datos = {}
+    if data.get("turno_id"):
+        try:
+            datos["turno_id"] = int(data["turno_id"])
+        except (ValueError, TypeError):
+            return jsonify({"error": "turno_id inválido"}), 400
+    elif data.get("dni_paciente") and data.get("fecha"):
+        datos.update(dni_paciente=data["dni_paciente"], fecha=data["fecha"], hora=data.get("hora"))
+    else:
+        return jsonify({"error": "Se requiere turno_id (o DNI y fecha)"}), 400
+
+    monto, tipo_pago, error = validar_cobro(data)
+    if error:
+        return jsonify({"error": error}), 400
+    datos.update(monto=monto, tipo_pago=tipo_pago, observaciones=data.get("observaciones", ""))
+
+    try:
+        payload, status = ejecutar_comando("cobrar_y_sala", datos)
+        return jsonify(payload), status
+    except Exception as e:
+        return jsonify({"error": f"Error al cobrar: {str(e)}"}), 500
+
 @app.route("/api/turnos/sala-espera", methods=["PUT"])
 @login_requerido
 @rol_permitido(["secretaria", "administrador"])
@@ -1996,79 +2775,44 @@ def mover_a_sala_espera():
     dni_paciente = data.get("dni_paciente")
     fecha = data.get("fecha")
     hora = data.get("hora")
-    monto = data.get("monto", 0)
-    observaciones = data.get("observaciones", "")
-    tipo_pago = data.get("tipo_pago", "efectivo")
      
     if not all([dni_paciente, fecha, hora]):
         return jsonify({"error": "DNI, fecha y hora son requeridos"}), 400
      
-    try:
-        monto = float(monto)
-        if monto < 0:
-            return jsonify({"error": "El monto no puede ser negativo"}), 400
-    except (ValueError, TypeError):
-        return jsonify({"error": "Monto inválido"}), 400
-
-    if monto == 0:
-        tipo_pago = "obra_social"
-    elif tipo_pago not in ["efectivo", "transferencia"]:
-        return jsonify({"error": "Tipo de pago inválido. Debe ser 'efectivo' o 'transferencia'"}), 400
-
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-
-        # 1) Verificar turno recepcionado
-        cur.execute("""
-            SELECT estado FROM turnos
-            WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?
-        """, (dni_paciente, fecha, hora))
-        
-        row = cur.fetchone()
-        if not row:
-            return jsonify({"error": "Turno no encontrado"}), 404
-        
-        if (row[0] or "").lower() != "recepcionado":
-            return jsonify({"error": "El paciente debe estar recepcionado primero"}), 400
-        
-        # 2) Verificar paciente
-        cur.execute("SELECT nombre, apellido, obra_social FROM pacientes WHERE dni=?", (dni_paciente,))
-        p = cur.fetchone()
-        if not p:
-            return jsonify({"error": "Paciente no encontrado"}), 404
-     
-        # 3) Permitir múltiples pagos en la misma fecha: eliminar validación de duplicados
-
-        # 4) Insertar pago
-        cur.execute("""
-            INSERT INTO pagos (dni_paciente, monto, fecha_pago, metodo_pago, obra_social, observaciones, fecha_creacion)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            dni_paciente,
-            monto,
-            fecha,
-            tipo_pago,
-            p[2] or "",
-            observaciones,
-            datetime.now().isoformat(),
-        ))
+    monto, tipo_pago, error = validar_cobro(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    return responder_comando("cobrar_y_sala", {
+        "dni_paciente": dni_paciente,
+        "fecha": fecha,
+        "hora": hora,
+        "monto": monto,
+        "tipo_pago": tipo_pago,
+        "observaciones": data.get("observaciones", ""),
+    }, "Error al mover a sala de espera")
+
+@app.route("/api/turnos/<int:turno_id>/sala-espera", methods=["PUT"])
+@login_requerido
+@rol_permitido(["secretaria", "administrador"])
+def mover_a_sala_espera_por_id(turno_id):
+    """Cobrar el turno `turno_id` y pasarlo a sala de espera"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Cuerpo inválido; enviar JSON"}), 400
 
-        # 5) Actualizar turno a sala de espera
-        cur.execute("""
-            UPDATE turnos
-            SET estado='sala de espera'
-            WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?
-        """, (dni_paciente, fecha, hora))
+    monto, tipo_pago, error = validar_cobro(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-        conn.commit()
-        return jsonify({"mensaje": "Paciente movido a sala de espera correctamente"})
-        
-    except Exception as e:
-        return jsonify({"error": f"Error al mover a sala de espera: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
+    return responder_comando("cobrar_y_sala", {
+        "turno_id": turno_id,
+        "monto": monto,
+        "tipo_pago": tipo_pago,
+        "observaciones": data.get("observaciones", ""),
+    }, "Error al mover a sala de espera")
+
+ESTADOS_CAMBIO_MEDICO = ["sin atender", "llamado", "atendido", "ausente"]
 
 @app.route("/api/turnos/estado", methods=["PUT"])
 @login_requerido
@@ -2087,39 +2831,113 @@ def actualizar_estado_turno():
     if not all([dni_paciente, fecha, hora, nuevo_estado]):
         return jsonify({"error": "DNI, fecha, hora y estado son requeridos"}), 400
 
-    if nuevo_estado not in ["sin atender", "llamado", "atendido", "ausente"]:
+    if nuevo_estado not in ESTADOS_CAMBIO_MEDICO:
         return jsonify({"error": "Estado inválido. Debe ser: sin atender, llamado, atendido, ausente"}), 400
 
-    conn = get_db_connection()
+    return responder_comando("cambiar_estado", {
+        "dni_paciente": dni_paciente,
+        "fecha": fecha,
+        "hora": hora,
+        "estado": nuevo_estado,
+    }, "Error al actualizar estado")
+
+@app.route("/api/turnos/<int:turno_id>/estado", methods=["PUT"])
+@login_requerido
+@rol_permitido(["medico"])
+def actualizar_estado_turno_por_id(turno_id):
+    """Actualizar el estado del turno `turno_id` (llamado, atendido, ausente)"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Cuerpo inválido; enviar JSON"}), 400
+
+    nuevo_estado = data.get("estado")
+    if nuevo_estado not in ESTADOS_CAMBIO_MEDICO:
+        return jsonify({"error": "Estado inválido. Debe ser: sin atender, llamado, atendido, ausente"}), 400
+
+    return responder_comando("cambiar_estado", {"turno_id": turno_id, "estado": nuevo_estado},
+                             "Error al actualizar estado")
+
+@app.route("/api/turnos/batch", methods=["PATCH"])
+@login_requerido
+@rol_permitido(["secretaria", "medico", "administrador"])
+def transiciones_turnos_batch():
+    """Cambiar el estado de varios turnos en una sola transacción.
+    Body: {"transiciones": [{"id": 1, "estado": "recepcionado"}, ...]} (o directamente la lista)"""
+    data = request.get_json(silent=True)
+    transiciones = data.get("transiciones") if isinstance(data, dict) else data
+    if not isinstance(transiciones, list) or not transiciones:
+        return jsonify({"error": "Se requiere una lista de transiciones"}), 400
+    if len(transiciones) > MAX_TRANSICIONES_BATCH:
+        return jsonify({"error": f"Máximo {MAX_TRANSICIONES_BATCH} transiciones por request"}), 400
+
+    normalizadas = []
+    for i, t in enumerate(transiciones):
+        if not isinstance(t, dict):
+            return jsonify({"error": f"Transición {i}: debe ser un objeto"}), 400
+        try:
+            turno_id = int(t.get("id"))
+        except (ValueError, TypeError):
+            return jsonify({"error": f"Transición {i}: id inválido"}), 400
+        estado = str(t.get("estado", "")).strip().lower()
+        if estado not in TRANSICIONES_TURNO:
+            return jsonify({"error": f"Transición {i}: estado inválido '{estado}'"}), 400
+        normalizadas.append({"id": turno_id, "estado": estado})
+
     try:
-        cur = conn.cursor()
-        
-        # Verificar que existe el turno
-        cur.execute("""
-            SELECT estado FROM turnos 
-            WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?
-        """, (dni_paciente, fecha, hora))
-        
-        turno = cur.fetchone()
-        if not turno:
-            return jsonify({"error": "Turno no encontrado"}), 404
-        
-        # Actualizar estado
-        cur.execute("""
-            UPDATE turnos 
-            SET estado=?
-            WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?
-        """, (nuevo_estado, dni_paciente, fecha, hora))
-        
-        conn.commit()
-        return jsonify({"mensaje": "Estado actualizado correctamente"})
-        
+        payload, status = ejecutar_comando("transiciones_turnos", {
+            "transiciones": normalizadas,
+            "rol": session.get("rol"),
+        })
+        return jsonify(payload), status
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "Conflicto de horarios al aplicar el lote; no se aplicó ningún cambio"}), 409
+    except Exception as e:
+        return jsonify({"error": f"Error al actualizar turnos: {str(e)}"}), 500
+
+@app.route("/api/turnos/limpiar-vencidos", methods=["POST"])
+@login_requerido
+@rol_permitido(["secretaria", "administrador"])
+def limpiar_turnos_vencidos_route():
+    """Eliminar turnos 'sin atender' vencidos hace más de 24hs (en lotes).
+    Body/params opcionales: dry_run, archivar, horas
+    """
+    from limpiar_turnos import limpiar_turnos_vencidos
+
+    data = request.get_json(silent=True) or {}
+    dry_run = str(data.get("dry_run", request.args.get("dry_run", ""))).lower() in ["1", "true", "si"]
+    archivar = str(data.get("archivar", request.args.get("archivar", ""))).lower() in ["1", "true", "si"]
+    try:
+        horas = int(data.get("horas", request.args.get("horas", 24)))
+    except (ValueError, TypeError):
+        return jsonify({"error": "Parámetro 'horas' inválido"}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        resultado = limpiar_turnos_vencidos(conn, horas=horas, dry_run=dry_run, archivar=archivar)
+        print(f"DEBUG: Limpieza de turnos vencidos: {resultado.get('eliminados')} eliminados en {resultado.get('duracion_ms')} ms")
+        return jsonify(resultado)
     except Exception as e:
-        return jsonify({"error": f"Error al actualizar estado: {str(e)}"}), 500
+        return jsonify({"error": f"Error al limpiar turnos vencidos: {str(e)}"}), 500
     finally:
         if conn:
             conn.close()
 
+@app.route("/api/turnos/<int:turno_id>", methods=["PUT"])
+@login_requerido
+@rol_permitido(["secretaria", "medico"])
+def editar_turno_por_id(turno_id):
+    """Cambiar fecha y/o hora del turno `turno_id` (body: nueva_fecha, nueva_hora)"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Cuerpo inválido; enviar JSON"}), 400
+
+    return responder_comando("editar_turno", {
+        "turno_id": turno_id,
+        "nueva_fecha": data.get("nueva_fecha"),
+        "nueva_hora": data.get("nueva_hora"),
+    }, "Error al actualizar turno")
+
 @app.route("/api/turnos/<dni>/<fecha>/<hora>", methods=["PUT"])
 @login_requerido
 @rol_permitido(["secretaria", "medico"])
@@ -2128,146 +2946,29 @@ def editar_turno(dni, fecha, hora):
     data = request.get_json(silent=True)
     if not isinstance(data, dict):
         return jsonify({"error": "Cuerpo inválido; enviar JSON"}), 400
-    
-    conn = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Verificar que existe el turno
-        cur.execute("""
-            SELECT estado FROM turnos 
-            WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?
-        """, (dni, fecha, hora))
-        
-        turno = cur.fetchone()
-        if not turno:
-            return jsonify({"error": "Turno no encontrado"}), 404
-        
-        # Procesar actualizaciones
-        nueva_hora = data.get("nueva_hora")
-        nueva_fecha = data.get("nueva_fecha")
-        
-        if nueva_hora:
-            # Verificar que la nueva hora no esté ocupada por otro turno del mismo médico
-            cur.execute("""
-                SELECT dni_paciente FROM turnos 
-                WHERE medico = (SELECT medico FROM turnos WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?)
-                AND fecha_turno = ? AND hora_turno = ? 
-                AND NOT (dni_paciente = ? AND fecha_turno = ? AND hora_turno = ?)
-            """, (dni, fecha, hora, nueva_fecha or fecha, nueva_hora, dni, fecha, hora))
-            
-            if cur.fetchone():
-                return jsonify({"error": "La nueva hora ya está ocupada"}), 400
-            
-            # Actualizar hora
-            cur.execute("""
-                UPDATE turnos 
-                SET hora_turno = ?
-                WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?
-            """, (nueva_hora, dni, fecha, hora))
-        
-        if nueva_fecha:
-            # Verificar que la nueva fecha/hora no esté ocupada
-            fecha_a_verificar = nueva_fecha
-            hora_a_verificar = nueva_hora or hora
-            
-            cur.execute("""
-                SELECT dni_paciente FROM turnos 
-                WHERE medico = (SELECT medico FROM turnos WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?)
-                AND fecha_turno = ? AND hora_turno = ? 
-                AND NOT (dni_paciente = ? AND fecha_turno = ? AND hora_turno = ?)
-                """, (dni, fecha, hora, fecha_a_verificar, hora_a_verificar, dni, fecha, hora))
-            
-            if cur.fetchone():
-                return jsonify({"error": "La nueva fecha/hora ya está ocupada"}), 400
-            
-            # Actualizar fecha
-            cur.execute("""
-                UPDATE turnos 
-                SET fecha_turno = ?
-                WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?
-            """, (nueva_fecha, dni, fecha, hora))
-        
-        conn.commit()
-        return jsonify({"mensaje": "Turno actualizado correctamente"})
-        
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        return jsonify({"error": f"Error al actualizar turno: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
+
+    return responder_comando("editar_turno", {
+        "dni_paciente": dni,
+        "fecha": fecha,
+        "hora": hora,
+        "nueva_fecha": data.get("nueva_fecha"),
+        "nueva_hora": data.get("nueva_hora"),
+    }, "Error al actualizar turno")
 
 @app.route("/api/turnos/<int:turno_id>", methods=["DELETE"])
 @login_requerido
 @rol_permitido(["secretaria", "medico", "administrador"])
 def eliminar_turno_por_id(turno_id):
-    """Eliminar un turno por ID (compatibilidad con agenda.html)"""
-    conn = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Verificar existencia
-        cur.execute("SELECT id FROM turnos WHERE id = ?", (turno_id,))
-        turno = cur.fetchone()
-        if not turno:
-            return jsonify({"error": "Turno no encontrado"}), 404
-
-        # Eliminar
-        cur.execute("DELETE FROM turnos WHERE id = ?", (turno_id,))
-        conn.commit()
-        return jsonify({"success": True, "mensaje": "Turno eliminado correctamente"})
-
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        return jsonify({"error": f"Error al eliminar turno: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
+    """Eliminar un turno por ID"""
+    return responder_comando("eliminar_turno", {"turno_id": turno_id}, "Error al eliminar turno")
 
 @app.route("/api/turnos/<dni>/<fecha>/<hora>", methods=["DELETE"])
 @login_requerido
 @rol_permitido(["secretaria"])
 def eliminar_turno(dni, fecha, hora):
     """Eliminar un turno específico por DNI, fecha y hora"""
-    conn = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Verificar que existe el turno
-        cur.execute("""
-            SELECT id FROM turnos 
-            WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?
-        """, (dni, fecha, hora))
-        
-        turno = cur.fetchone()
-        if not turno:
-            return jsonify({"error": "Turno no encontrado"}), 404
-        
-        # Eliminar el turno
-        cur.execute("""
-            DELETE FROM turnos 
-            WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?
-        """, (dni, fecha, hora))
-        
-        conn.commit()
-        return jsonify({
-            "success": True,
-            "mensaje": "Turno eliminado correctamente"
-        })
-        
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        return jsonify({"error": f"Error al eliminar turno: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
+    return responder_comando("eliminar_turno", {"dni_paciente": dni, "fecha": fecha, "hora": hora},
+                             "Error al eliminar turno")
 
 @app.route("/historias", methods=["POST"])
 @login_requerido
@@ -2319,16 +3020,21 @@ def guardar_historia():
         
         print(f"DEBUG - Insertando historia: dni={data['dni']}, medico={data['medico']}, fecha_consulta={fecha_consulta}")
         
+        # La consulta se guarda comprimida (notas_historias.py), con su largo para la línea de tiempo
+        consulta, largo = valores_nota(c, data['consulta_medica'])
+        
         # Insertar nueva historia clínica
         c.execute("""
-            INSERT INTO historias_clinicas (dni, consulta_medica, medico, fecha_consulta, fecha_creacion)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO historias_clinicas
+                (dni, consulta_medica, medico, fecha_consulta, fecha_creacion, largo_consulta)
+            VALUES (?, ?, ?, ?, ?, ?)
         """, (
             data['dni'],
-            data['consulta_medica'],
+            consulta,
             data['medico'],
             fecha_consulta,
-            fecha_creacion
+            fecha_creacion,
+            largo
         ))
         
         conn.commit()
@@ -2364,48 +3070,73 @@ def historia_clinica(dni):
 def obtener_historia_por_dni(dni):
     """Obtener historias clínicas de un paciente específico por DNI"""
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        
-        # Obtener todas las historias del paciente
-        c.execute("""
-            SELECT dni, consulta_medica, medico, fecha_consulta, fecha_creacion
-            FROM historias_clinicas 
-            WHERE dni = ?
-            ORDER BY fecha_consulta DESC
-        """, (dni,))
-        
-        historias = c.fetchall()
-        
-        # Obtener especialidades de médicos
-        c.execute("SELECT usuario, especialidad FROM usuarios WHERE rol = 'medico'")
-        medicos_especialidades = {row[0]: row[1] for row in c.fetchall()}
-        
-        conn.close()
-        
+        historias = repos.historias.por_dni(dni)
         if not historias:
             return jsonify({"error": "No se encontraron historias clínicas para este DNI"}), 404
-        
-        # Convertir a formato JSON
-        historias_json = []
-        for historia in historias:
-            medico = historia[2]
-            especialidad = medicos_especialidades.get(medico, None) if medico else None
-            historias_json.append({
-                "dni": historia[0],
-                "consulta_medica": historia[1],
-                "medico": medico,
-                "fecha_consulta": historia[3],
-                "fecha_creacion": historia[4],
-                "especialidad": especialidad
-            })
-        
-        return jsonify(historias_json)
-        
+        return respuesta_json(a_json(historias))
     except Exception as e:
         print(f"Error al obtener historias por DNI: {e}")
         return jsonify({"error": "Error al obtener historias clínicas"}), 500
 
+@app.route("/api/historias/paciente/<dni>")
+@login_requerido
+@rol_permitido(["medico"])
+def linea_de_tiempo_historias(dni):
+    """Línea de tiempo del paciente: consultas de la más reciente a la más vieja, de a ?limite=
+    (20 por defecto, hasta 100), con los primeros ?largo= caracteres (200 por defecto, hasta 2000).
+    Filtro opcional ?especialidad=. Si quedan más, `siguiente` es el ?cursor= de la página
+    siguiente. El texto completo de cada consulta se pide con /api/historias/<id>."""
+    try:
+        limite = min(max(int(request.args.get("limite", 20)), 1), 100)
+        largo = min(max(int(request.args.get("largo", 200)), 1), 2000)
+    except ValueError:
+        return jsonify({"error": "limite o largo inválido"}), 400
+    especialidad = request.args.get("especialidad", "").strip() or None
+    despues = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        # Cursor "fecha_consulta,id" de la última consulta de la página anterior
+        try:
+            fecha_cursor, id_cursor = cursor.split(",")
+            despues = (fecha_cursor, int(id_cursor))
+        except ValueError:
+            return jsonify({"error": "cursor inválido"}), 400
+
+    try:
+        # Una consulta de más para saber si hay otra página
+        historias = repos.historias.linea_de_tiempo(dni, despues, limite + 1, largo, especialidad)
+        por_especialidad = repos.historias.por_especialidad(dni)
+    except Exception as e:
+        print(f"Error al obtener la línea de tiempo de historias: {e}")
+        return jsonify({"error": "Error al obtener historias clínicas"}), 500
+
+    siguiente = None
+    if len(historias) > limite:
+        historias = historias[:limite]
+        siguiente = f"{historias[-1].fecha_consulta},{historias[-1].id}"
+    return jsonify({
+        "dni": dni,
+        "historias": historias,
+        "siguiente": siguiente,
+        "total": sum(e["consultas"] for e in por_especialidad.values()),
+        "ultima_consulta": max((e["ultima"] for e in por_especialidad.values() if e["ultima"]), default=None),
+        "por_especialidad": {especialidad: e["consultas"] for especialidad, e in por_especialidad.items()},
+    })
+
+@app.route("/api/historias/<int:historia_id>")
+@login_requerido
+@rol_permitido(["medico"])
+def obtener_historia(historia_id):
+    """Una consulta completa (texto entero), para abrir una entrada de la línea de tiempo"""
+    try:
+        historia = repos.historias.por_id(historia_id)
+    except Exception as e:
+        print(f"Error al obtener historia {historia_id}: {e}")
+        return jsonify({"error": "Error al obtener la historia clínica"}), 500
+    if not historia:
+        return jsonify({"error": "Historia clínica no encontrada"}), 404
+    return respuesta_json(historia.json())
+
 @app.route("/historias-gestion")
 @login_requerido
 @rol_permitido(["secretaria", "medico", "administrador"])
@@ -2419,7 +3150,7 @@ def obtener_historias():
     """Obtener todas las historias clínicas"""
     try:
         historias = cargar_historias()
-        return jsonify(historias)
+        return respuesta_json(a_json(historias))
     except Exception as e:
         print(f"Error al obtener historias: {e}")
         return jsonify({"error": "Error al cargar historias clínicas"}), 500
@@ -2464,13 +3195,6 @@ def buscar_historias():
         fin = inicio + por_pagina
         historias_pagina = historias[inicio:fin]
         
-        # Obtener especialidades de médicos desde la base de datos
-        conn_medicos = get_db_connection()
-        c_medicos = conn_medicos.cursor()
-        c_medicos.execute("SELECT usuario, especialidad FROM usuarios WHERE rol = 'medico'")
-        medicos_especialidades = {row[0]: row[1] for row in c_medicos.fetchall()}
-        conn_medicos.close()
-        
         # Agrupar por paciente y por especialidad
         pacientes_dict = {}
         especialidades_dict = {}
@@ -2478,7 +3202,7 @@ def buscar_historias():
         for historia in historias_pagina:
             dni = historia.get('dni')
             medico = historia.get('medico', '')
-            especialidad = medicos_especialidades.get(medico, 'Sin especialidad') or 'Sin especialidad'
+            especialidad = historia.get('especialidad') or 'Sin especialidad'
             
             # Agrupar por paciente
             if dni not in pacientes_dict:
@@ -3300,9 +4024,190 @@ def setup_admin():
     </html>
     """
 
-@app.route("/api/public/especialidades", methods=["GET"])
-def obtener_especialidades_publico():
-    """Obtener lista de especialidades disponibles (público)"""
+# ====================== API PÚBLICA (lógica compartida WSGI/ASGI) ======================
+# Las funciones servicio_* no dependen de `request` de Flask: reciben parámetros
+# simples y devuelven (payload, status). Las usan las rutas Flask de abajo y
+# app_publico.py (entrada ASGI para la API pública).
+
+# Versiones de las caches en memoria (versiones_cache.py): los triggers las incrementan
+# en la misma transacción que modifica las tablas de origen, así que una escritura
+# hecha en otro worker o en app_publico se nota al releerlas. Se releen como mucho
+# cada VERSIONES_INTERVALO_SEGUNDOS para no abrir una conexión en cada acierto.
+VERSIONES_INTERVALO_SEGUNDOS = float(os.environ.get("VERSIONES_INTERVALO_SEGUNDOS", 1))
+_versiones = {}
+_versiones_leidas = 0.0
+_versiones_lock = threading.Lock()
+
+def versiones_cache():
+    """{cache: versión} de la base, releídas como mucho cada VERSIONES_INTERVALO_SEGUNDOS"""
+    global _versiones, _versiones_leidas
+    ahora = time.time()
+    with _versiones_lock:
+        if ahora - _versiones_leidas < VERSIONES_INTERVALO_SEGUNDOS:
+            return _versiones
+    conn = get_db_connection()
+    try:
+        versiones = leer_versiones(conn.cursor())
+    finally:
+        conn.close()
+    with _versiones_lock:
+        _versiones, _versiones_leidas = versiones, ahora
+    return versiones
+
+# Cache del catálogo público (especialidades y médicos). Cambia solo cuando se
+# crean/editan/eliminan usuarios: el proceso que escribe llama a
+# invalidar_catalogo_publico() y los demás lo ven por la versión 'catalogo'.
+CATALOGO_TTL_SEGUNDOS = int(os.environ.get("CATALOGO_TTL_SEGUNDOS", 300))
+# max-age para navegadores/proxy; después revalidan con If-None-Match
+CATALOGO_MAX_AGE = int(os.environ.get("CATALOGO_MAX_AGE", 60))
+CATALOGO_MAX_ENTRADAS = 256
+_catalogo_cache = {}
+_catalogo_lock = threading.Lock()
+_catalogo_generacion = 0
+_catalogo_version = None
+
+def calcular_etag(payload):
+    """ETag fuerte a partir del JSON canónico de la respuesta"""
+    datos = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return '"' + hashlib.sha1(datos).hexdigest()[:20] + '"'
+
+def catalogo_cacheado(clave, calcular):
+    """Devolver (payload, status, etag) desde el cache o ejecutando calcular() -> (payload, status).
+    Solo se cachean respuestas 200."""
+    global _catalogo_generacion, _catalogo_version
+    ahora = time.time()
+    version = versiones_cache().get("catalogo")
+    with _catalogo_lock:
+        if version != _catalogo_version:
+            # Otro proceso modificó usuarios: descartar lo cacheado
+            _catalogo_cache.clear()
+            _catalogo_generacion += 1
+            _catalogo_version = version
+        entrada = _catalogo_cache.get(clave)
+        if entrada and entrada[0] > ahora:
+            return entrada[1], 200, entrada[2]
+        generacion = _catalogo_generacion
+
+    payload, status = calcular()
+    if status != 200:
+        return payload, status, None
+
+    etag = calcular_etag(payload)
+    with _catalogo_lock:
+        # Si hubo una invalidación mientras se consultaba, no guardar datos viejos
+        if generacion == _catalogo_generacion:
+            if len(_catalogo_cache) >= CATALOGO_MAX_ENTRADAS:
+                _catalogo_cache.clear()
+            _catalogo_cache[clave] = (ahora + CATALOGO_TTL_SEGUNDOS, payload, etag)
+    return payload, status, etag
+
+def invalidar_catalogo_publico():
+    """Vaciar el cache del catálogo público (llamar tras modificar usuarios)"""
+    global _catalogo_generacion
+    with _catalogo_lock:
+        _catalogo_cache.clear()
+        _catalogo_generacion += 1
+    print("DEBUG: Cache del catálogo público invalidado")
+
+# Agenda por (médico, día de la semana) para la disponibilidad pública: horarios
+# fijos de `agenda` y reglas recurrentes de `agenda_reglas` (se expanden por fecha).
+# Al guardar una agenda se invalidan solo los días que cambiaron; en otros workers
+# la entrada expira por TTL (las escrituras validan contra la base, dentro de su transacción).
+AGENDA_CACHE_TTL_SEGUNDOS = int(os.environ.get("AGENDA_CACHE_TTL_SEGUNDOS", 60))
+_horarios_cache = {}
+_horarios_lock = threading.Lock()
+_horarios_generacion = 0
+
+def leer_agenda_dia(cur, medico, dia_semana):
+    """(horarios fijos activos, reglas activas) de un médico para un día de la semana"""
+    cur.execute("""
+        SELECT horario FROM agenda
+        WHERE medico = ? AND dia_semana = ? AND activo = 1
+        ORDER BY horario
+    """, (medico, dia_semana))
+    fijos = [row[0] for row in cur.fetchall()]
+    cur.execute("""
+        SELECT dia_semana, hora_inicio, hora_fin, intervalo_min, vigente_desde, vigente_hasta
+        FROM agenda_reglas
+        WHERE medico = ? AND dia_semana = ? AND activo = 1
+    """, (medico, dia_semana))
+    reglas = [dict(zip(COLUMNAS_REGLA, row)) for row in cur.fetchall()]
+    return fijos, reglas
+
+def horarios_agenda(cur, medico, fecha):
+    """Horarios (ordenados) de la agenda de un médico en una fecha ISO, con cache por día de la semana"""
+    clave = (medico, dia_semana_de(fecha))
+    ahora = time.time()
+    with _horarios_lock:
+        entrada = _horarios_cache.get(clave)
+        generacion = _horarios_generacion
+    if entrada and entrada[0] > ahora:
+        fijos, reglas = entrada[1], entrada[2]
+    else:
+        fijos, reglas = leer_agenda_dia(cur, medico, clave[1])
+        with _horarios_lock:
+            # Si se guardó una agenda mientras se consultaba, no guardar horarios viejos
+            if generacion == _horarios_generacion:
+                if len(_horarios_cache) >= CATALOGO_MAX_ENTRADAS:
+                    _horarios_cache.clear()
+                _horarios_cache[clave] = (ahora + AGENDA_CACHE_TTL_SEGUNDOS, fijos, reglas)
+    if not reglas:
+        return fijos
+    return sorted(set(fijos).union(horarios_de_reglas(reglas, fecha)))
+
+def horario_en_agenda(cur, medico, fecha, hora):
+    """True si `hora` está en la agenda del médico para `fecha` (consulta directa, sin cache).
+    Es la validación de las escrituras: llamarla con el cursor de la transacción del comando"""
+    fijos, reglas = leer_agenda_dia(cur, medico, dia_semana_de(fecha))
+    return hora in fijos or incluye_horario(reglas, fecha, hora)
+
+def invalidar_horarios_agenda(medico, dias):
+    """Descartar los horarios cacheados de `medico` para los días indicados"""
+    global _horarios_generacion
+    with _horarios_lock:
+        for dia in dias:
+            _horarios_cache.pop((medico, dia), None)
+        _horarios_generacion += 1
+    if dias:
+        print(f"DEBUG: Horarios cacheados invalidados para {medico}: {', '.join(sorted(dias))}")
+
+def respuesta_catalogo(payload, status, etag, cache_control=None):
+    """Respuesta Flask con ETag/Cache-Control; 304 si el cliente ya tiene la versión"""
+    if status != 200 or not etag:
+        return jsonify(payload), status
+    if etag in request.headers.get("If-None-Match", ""):
+        resp = make_response("", 304)
+    else:
+        resp = make_response(jsonify(payload), 200)
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = cache_control or f"public, max-age={CATALOGO_MAX_AGE}"
+    return resp
+
+# Alta/actualización del paciente en la reserva pública (parámetros con nombre).
+# En el UPDATE, pacientes.* son los valores previos de la fila.
+SQL_UPSERT_PACIENTE_PUBLICO = """
+    INSERT INTO pacientes (dni, nombre, apellido, email, fecha_nacimiento, obra_social, numero_obra_social, celular)
+    VALUES (:dni, COALESCE(NULLIF(:nombre, ''), 'Pendiente'), COALESCE(NULLIF(:apellido, ''), 'Pendiente'),
+            :email, :fecha_nacimiento, '', '', :celular)
+    ON CONFLICT(dni) DO UPDATE SET
+        email = excluded.email,
+        nombre = CASE WHEN (:nombre != '' OR :apellido != '')
+                       AND (pacientes.nombre = 'Pendiente' OR pacientes.apellido = 'Pendiente')
+                      THEN COALESCE(NULLIF(:nombre, ''), pacientes.nombre) ELSE pacientes.nombre END,
+        apellido = CASE WHEN (:nombre != '' OR :apellido != '')
+                         AND (pacientes.nombre = 'Pendiente' OR pacientes.apellido = 'Pendiente')
+                        THEN COALESCE(NULLIF(:apellido, ''), pacientes.apellido) ELSE pacientes.apellido END,
+        celular = CASE WHEN (:nombre != '' OR :apellido != '')
+                        AND (pacientes.nombre = 'Pendiente' OR pacientes.apellido = 'Pendiente')
+                       THEN COALESCE(NULLIF(:celular, ''), pacientes.celular, '') ELSE pacientes.celular END,
+        fecha_nacimiento = CASE WHEN (:nombre != '' OR :apellido != '')
+                                 AND (pacientes.nombre = 'Pendiente' OR pacientes.apellido = 'Pendiente')
+                                THEN COALESCE(NULLIF(:fecha_nacimiento, ''), pacientes.fecha_nacimiento, '') ELSE pacientes.fecha_nacimiento END
+    RETURNING nombre, apellido
+"""
+
+def servicio_especialidades():
+    """Lista de especialidades con médicos activos"""
     try:
         conn = get_db_connection()
         c = conn.cursor()
@@ -3317,17 +4222,16 @@ def obtener_especialidades_publico():
         """)
         especialidades = [row[0] for row in c.fetchall()]
         conn.close()
-        return jsonify(especialidades)
+        return especialidades, 200
     except Exception as e:
         print(f"Error al obtener especialidades: {e}")
-        return jsonify({"error": "Error al obtener especialidades"}), 500
+        return {"error": "Error al obtener especialidades"}, 500
 
-@app.route("/api/public/medicos", methods=["GET"])
-def obtener_medicos_por_especialidad():
-    """Obtener médicos por especialidad (público)"""
-    especialidad = request.args.get('especialidad', '').strip()
+def servicio_medicos(especialidad):
+    """Médicos activos de una especialidad"""
+    especialidad = (especialidad or '').strip()
     if not especialidad:
-        return jsonify({"error": "Especialidad requerida"}), 400
+        return {"error": "Especialidad requerida"}, 400
     
     try:
         conn = get_db_connection()
@@ -3348,46 +4252,125 @@ def obtener_medicos_por_especialidad():
                 "especialidad": row[2]
             })
         conn.close()
-        return jsonify(medicos)
+        return medicos, 200
     except Exception as e:
         print(f"Error al obtener médicos: {e}")
-        return jsonify({"error": "Error al obtener médicos"}), 500
+        return {"error": "Error al obtener médicos"}, 500
 
-def verificar_bloqueo_fecha(medico, fecha):
-    """Verificar si una fecha está bloqueada para un médico"""
+@app.route("/api/public/especialidades", methods=["GET"])
+def obtener_especialidades_publico():
+    """Obtener lista de especialidades disponibles (público)"""
+    return respuesta_catalogo(*catalogo_cacheado(("especialidades",), servicio_especialidades))
+
+@app.route("/api/public/medicos", methods=["GET"])
+def obtener_medicos_por_especialidad():
+    """Obtener médicos por especialidad (público)"""
+    especialidad = request.args.get('especialidad', '').strip()
+    return respuesta_catalogo(*catalogo_cacheado(("medicos", especialidad), lambda: servicio_medicos(especialidad)))
+
+# Bloqueos activos por médico como intervalos [inicio, fin] ordenados y fusionados,
+# para ubicar una fecha con bisect y recorrer una ventana de fechas en una pasada.
+# Se refrescan al crear/eliminar un bloqueo; en otros procesos, por la versión 'bloqueos'.
+BLOQUEOS_TTL_SEGUNDOS = int(os.environ.get("BLOQUEOS_TTL_SEGUNDOS", 60))
+_bloqueos_cache = {}
+_bloqueos_lock = threading.Lock()
+_bloqueos_generacion = 0
+_bloqueos_version = None
+
+def fusionar_bloqueos(filas):
+    """[(inicio, fin, motivo)] ordenadas por inicio -> intervalos sin solapamientos.
+    Los bloqueos que se superponen se unen (conserva el motivo del primero)."""
+    intervalos = []
+    for inicio, fin, motivo in filas:
+        motivo = motivo or "Vacaciones"
+        if intervalos:
+            ult_inicio, ult_fin, ult_motivo = intervalos[-1]
+            if inicio <= ult_fin:
+                intervalos[-1] = (ult_inicio, max(ult_fin, fin), ult_motivo)
+                continue
+        intervalos.append((inicio, fin, motivo))
+    return intervalos
+
+def bloqueos_medico(medico):
+    """(inicios, intervalos) de los bloqueos activos del médico, con cache"""
+    global _bloqueos_generacion, _bloqueos_version
+    ahora = time.time()
+    version = versiones_cache().get("bloqueos")
+    with _bloqueos_lock:
+        if version != _bloqueos_version:
+            # Otro proceso modificó bloqueos_agenda: descartar lo cacheado
+            _bloqueos_cache.clear()
+            _bloqueos_generacion += 1
+            _bloqueos_version = version
+        entrada = _bloqueos_cache.get(medico)
+        generacion = _bloqueos_generacion
+    if entrada and entrada[0] > ahora:
+        return entrada[1], entrada[2]
+
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        
-        c.execute("""
+        filas = conn.execute("""
             SELECT fecha_inicio, fecha_fin, motivo
             FROM bloqueos_agenda
-            WHERE medico = ?
-            AND activo = 1
-            AND fecha_inicio <= ?
-            AND fecha_fin >= ?
-        """, (medico, fecha, fecha))
-        
-        bloqueo = c.fetchone()
+            WHERE medico = ? AND activo = 1
+            ORDER BY fecha_inicio, fecha_fin
+        """, (medico,)).fetchall()
+    finally:
         conn.close()
-        
-        if bloqueo:
+    intervalos = fusionar_bloqueos(filas)
+    inicios = [inicio for inicio, _, _ in intervalos]
+    with _bloqueos_lock:
+        # Si se invalidó mientras se consultaba, no guardar intervalos viejos
+        if generacion == _bloqueos_generacion:
+            if len(_bloqueos_cache) >= CATALOGO_MAX_ENTRADAS:
+                _bloqueos_cache.clear()
+            _bloqueos_cache[medico] = (ahora + BLOQUEOS_TTL_SEGUNDOS, inicios, intervalos)
+    return inicios, intervalos
+
+def invalidar_bloqueos(medico):
+    """Descartar los intervalos cacheados de un médico (llamar tras escribir bloqueos_agenda)"""
+    global _bloqueos_generacion
+    with _bloqueos_lock:
+        _bloqueos_cache.pop(medico, None)
+        _bloqueos_generacion += 1
+
+def verificar_bloqueo_fecha(medico, fecha):
+    """Verificar si una fecha está bloqueada para un médico"""
+    try:
+        inicios, intervalos = bloqueos_medico(medico)
+        pos = bisect.bisect_right(inicios, fecha) - 1
+        if pos >= 0 and intervalos[pos][1] >= fecha:
             return {
                 "bloqueado": True,
-                "motivo": bloqueo[2] or "Vacaciones"
+                "motivo": intervalos[pos][2]
             }
         return {"bloqueado": False}
     except Exception as e:
         print(f"Error al verificar bloqueo: {e}")
         return {"bloqueado": False}
 
-@app.route("/api/public/medico-info", methods=["GET"])
-def obtener_info_medico():
-    """Obtener información del médico: días que atiende y próximos turnos disponibles (público)"""
-    medico = request.args.get('medico', '').strip()
+def fechas_bloqueadas(medico, desde, hasta):
+    """{fecha ISO: motivo} de los días bloqueados entre `desde` y `hasta` (incluidos)"""
+    inicios, intervalos = bloqueos_medico(medico)
+    bloqueadas = {}
+    # Empezar por el intervalo que podría contener `desde`
+    pos = max(bisect.bisect_right(inicios, desde) - 1, 0)
+    for inicio, fin, motivo in intervalos[pos:]:
+        if inicio > hasta:
+            break
+        dia = date.fromisoformat(max(inicio, desde))
+        ultimo = date.fromisoformat(min(fin, hasta))
+        while dia <= ultimo:
+            bloqueadas[dia.isoformat()] = motivo
+            dia += timedelta(days=1)
+    return bloqueadas
+
+def servicio_info_medico(medico):
+    """Días que atiende el médico y sus dos próximos turnos libres"""
+    medico = (medico or '').strip()
     
     if not medico:
-        return jsonify({"error": "Médico requerido"}), 400
+        return {"error": "Médico requerido"}, 400
     
     try:
         conn = get_db_connection()
@@ -3411,9 +4394,12 @@ def obtener_info_medico():
         
         # Obtener días que atiende el médico
         c.execute("""
-            SELECT DISTINCT dia_semana 
-            FROM agenda 
-            WHERE medico = ? AND activo = 1
+            SELECT dia_semana FROM (
+                SELECT dia_semana FROM agenda WHERE medico = ? AND activo = 1
+                UNION
+                SELECT dia_semana FROM agenda_reglas
+                WHERE medico = ? AND activo = 1 AND (vigente_hasta IS NULL OR vigente_hasta >= date('now'))
+            )
             ORDER BY 
                 CASE dia_semana
                     WHEN 'LUNES' THEN 1
@@ -3424,7 +4410,7 @@ def obtener_info_medico():
                     WHEN 'SABADO' THEN 6
                     WHEN 'DOMINGO' THEN 7
                 END
-        """, (medico,))
+        """, (medico, medico))
         dias_atiende = [row[0] for row in c.fetchall()]
         
         # Mapeo de días en español
@@ -3452,6 +4438,9 @@ def obtener_info_medico():
             "THURSDAY": "JUEVES", "FRIDAY": "VIERNES", "SATURDAY": "SABADO", "SUNDAY": "DOMINGO"
         }
         
+        # Días bloqueados de toda la ventana de búsqueda en una sola pasada
+        bloqueadas = fechas_bloqueadas(medico, hoy.isoformat(), (hoy + timedelta(days=max_dias)).isoformat())
+        
         fecha_actual = hoy
         while len(proximos_turnos) < 2 and dias_buscados < max_dias:
             dia_semana_ingles = fecha_actual.strftime("%A").upper()
@@ -3459,18 +4448,10 @@ def obtener_info_medico():
             
             if dia_semana_es in dias_atiende:
                 # Obtener horarios disponibles para este día
-                c.execute("""
-                    SELECT horario 
-                    FROM agenda 
-                    WHERE medico = ? 
-                    AND dia_semana = ?
-                    AND activo = 1
-                    ORDER BY horario
-                """, (medico, dia_semana_es))
-                horarios_disponibles = [row[0] for row in c.fetchall()]
+                fecha_str = fecha_actual.strftime("%Y-%m-%d")
+                horarios_disponibles = horarios_agenda(c, medico, fecha_str)
                 
                 # Obtener horarios ocupados para esta fecha
-                fecha_str = fecha_actual.strftime("%Y-%m-%d")
                 c.execute("""
                     SELECT hora_turno 
                     FROM turnos 
@@ -3481,8 +4462,7 @@ def obtener_info_medico():
                 horarios_ocupados = [row[0] for row in c.fetchall()]
                 
                 # Verificar si la fecha está bloqueada
-                bloqueo_info = verificar_bloqueo_fecha(medico, fecha_str)
-                if bloqueo_info["bloqueado"]:
+                if fecha_str in bloqueadas:
                     fecha_actual += timedelta(days=1)
                     dias_buscados += 1
                     continue
@@ -3515,31 +4495,36 @@ def obtener_info_medico():
         
         conn.close()
         
-        return jsonify({
+        return {
             "dias_atiende": dias_atiende_espanol,
             "proximos_turnos": proximos_turnos,
             "bloqueos": bloqueos
-        })
+        }, 200
     except Exception as e:
         print(f"Error al obtener info del médico: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({"error": "Error al obtener información del médico"}), 500
+        return {"error": "Error al obtener información del médico"}, 500
 
-@app.route("/api/public/turnos-disponibles", methods=["GET"])
-def obtener_turnos_disponibles():
-    """Obtener turnos disponibles para un médico y fecha (público)"""
-    medico = request.args.get('medico', '').strip()
-    fecha = request.args.get('fecha', '').strip()
+@app.route("/api/public/medico-info", methods=["GET"])
+def obtener_info_medico():
+    """Obtener información del médico: días que atiende y próximos turnos disponibles (público)"""
+    payload, status = servicio_info_medico(request.args.get('medico', ''))
+    return jsonify(payload), status
+
+def servicio_turnos_disponibles(medico, fecha):
+    """Horarios libres de un médico en una fecha"""
+    medico = (medico or '').strip()
+    fecha = (fecha or '').strip()
     
     if not medico or not fecha:
-        return jsonify({"error": "Médico y fecha requeridos"}), 400
+        return {"error": "Médico y fecha requeridos"}, 400
     
     try:
         # Validar formato de fecha
         datetime.strptime(fecha, "%Y-%m-%d")
     except ValueError:
-        return jsonify({"error": "Formato de fecha inválido (usar YYYY-MM-DD)"}), 400
+        return {"error": "Formato de fecha inválido (usar YYYY-MM-DD)"}, 400
     
     try:
         conn = get_db_connection()
@@ -3558,22 +4543,14 @@ def obtener_turnos_disponibles():
         bloqueo_info = verificar_bloqueo_fecha(medico, fecha)
         if bloqueo_info["bloqueado"]:
             conn.close()
-            return jsonify({
+            return {
                 "error": f"El médico no está disponible en esta fecha: {bloqueo_info['motivo']}",
                 "bloqueado": True,
                 "motivo": bloqueo_info["motivo"]
-            }), 400
+            }, 400
         
         # Obtener horarios disponibles del médico para ese día
-        c.execute("""
-            SELECT horario 
-            FROM agenda 
-            WHERE medico = ? 
-            AND dia_semana = ?
-            AND activo = 1
-            ORDER BY horario
-        """, (medico, dia_semana_es))
-        horarios_disponibles = [row[0] for row in c.fetchall()]
+        horarios_disponibles = horarios_agenda(c, medico, fecha)
         
         # Obtener horarios ocupados
         c.execute("""
@@ -3589,17 +4566,21 @@ def obtener_turnos_disponibles():
         turnos_disponibles = [h for h in horarios_disponibles if h not in horarios_ocupados]
         
         conn.close()
-        return jsonify(turnos_disponibles)
+        return turnos_disponibles, 200
     except Exception as e:
         print(f"Error al obtener turnos disponibles: {e}")
-        return jsonify({"error": "Error al obtener turnos disponibles"}), 500
+        return {"error": "Error al obtener turnos disponibles"}, 500
 
-@app.route("/api/public/reservar-turno", methods=["POST"])
-def reservar_turno_publico():
-    """Reservar turno desde el sistema público"""
-    data = request.get_json(silent=True)
+@app.route("/api/public/turnos-disponibles", methods=["GET"])
+def obtener_turnos_disponibles():
+    """Obtener turnos disponibles para un médico y fecha (público)"""
+    payload, status = servicio_turnos_disponibles(request.args.get('medico', ''), request.args.get('fecha', ''))
+    return jsonify(payload), status
+
+def servicio_reservar_turno(data):
+    """Reservar un turno con los datos del formulario público"""
     if not isinstance(data, dict):
-        return jsonify({"error": "Cuerpo inválido; enviar JSON"}), 400
+        return {"error": "Cuerpo inválido; enviar JSON"}, 400
     
     # Validar campos requeridos
     dni = str(data.get("dni", "")).strip()
@@ -3609,23 +4590,23 @@ def reservar_turno_publico():
     hora = str(data.get("hora", "")).strip()
     
     if not all([dni, email, medico, fecha, hora]):
-        return jsonify({"error": "Todos los campos son obligatorios"}), 400
+        return {"error": "Todos los campos son obligatorios"}, 400
     
     # Validar DNI
     if not dni.isdigit() or len(dni) not in (7, 8):
-        return jsonify({"error": "DNI inválido (solo números, 7 u 8 dígitos)"}), 400
+        return {"error": "DNI inválido (solo números, 7 u 8 dígitos)"}, 400
     
     # Validar email
     if '@' not in email or '.' not in email.split('@')[-1]:
-        return jsonify({"error": "Email inválido"}), 400
+        return {"error": "Email inválido"}, 400
     
     # Validar fecha
     try:
         fecha_dt = datetime.strptime(fecha, "%Y-%m-%d").date()
         if fecha_dt < date.today():
-            return jsonify({"error": "No se pueden reservar turnos en fechas pasadas"}), 400
+            return {"error": "No se pueden reservar turnos en fechas pasadas"}, 400
     except ValueError:
-        return jsonify({"error": "Formato de fecha inválido (usar YYYY-MM-DD)"}), 400
+        return {"error": "Formato de fecha inválido (usar YYYY-MM-DD)"}, 400
     
     conn = None
     try:
@@ -3636,87 +4617,37 @@ def reservar_turno_publico():
         c.execute("SELECT especialidad, nombre_completo FROM usuarios WHERE usuario = ? AND rol = 'medico' AND activo = 1", (medico,))
         medico_info = c.fetchone()
         if not medico_info:
-            return jsonify({"error": "Médico no encontrado o no disponible"}), 404
+            return {"error": "Médico no encontrado o no disponible"}, 404
         
         especialidad = medico_info[0] or "Sin especialidad"
         nombre_medico = medico_info[1] or medico
         
-        # Verificar que el turno está disponible
-        c.execute("""
-            SELECT id FROM turnos 
-            WHERE medico = ? AND fecha_turno = ? AND hora_turno = ?
-        """, (medico, fecha, hora))
-        if c.fetchone():
-            return jsonify({"error": "El turno ya está ocupado"}), 400
-        
-        # Verificar que el horario está en la agenda del médico
-        fecha_dt = datetime.strptime(fecha, "%Y-%m-%d").date()
-        dia_semana = fecha_dt.strftime("%A").upper()
-        dia_es = {
-            "MONDAY": "LUNES", "TUESDAY": "MARTES", "WEDNESDAY": "MIERCOLES",
-            "THURSDAY": "JUEVES", "FRIDAY": "VIERNES", "SATURDAY": "SABADO", "SUNDAY": "DOMINGO"
-        }
-        dia_semana_es = dia_es.get(dia_semana, "")
-        
-        c.execute("""
-            SELECT horario FROM agenda 
-            WHERE medico = ? AND dia_semana = ? AND horario = ? AND activo = 1
-        """, (medico, dia_semana_es, hora))
-        if not c.fetchone():
-            return jsonify({"error": "El horario no está disponible para este médico"}), 400
-        
         # Obtener datos opcionales del formulario
         nombre = str(data.get("nombre", "")).strip()
         apellido = str(data.get("apellido", "")).strip()
         celular = str(data.get("celular", "")).strip()
         fecha_nacimiento = str(data.get("fecha_nacimiento", "")).strip()
         
-        # Crear o actualizar paciente
-        c.execute("SELECT nombre, apellido FROM pacientes WHERE dni = ?", (dni,))
-        paciente_existente = c.fetchone()
-        
-        if paciente_existente:
-            # Actualizar email si no existe
-            c.execute("UPDATE pacientes SET email = ? WHERE dni = ?", (email, dni))
-            # Si se proporcionaron datos opcionales y el paciente tiene datos pendientes, actualizarlos
-            if (nombre or apellido) and (paciente_existente[0] == "Pendiente" or paciente_existente[1] == "Pendiente"):
-                nombre_final = nombre if nombre else paciente_existente[0]
-                apellido_final = apellido if apellido else paciente_existente[1]
-                # Actualizar celular y fecha_nacimiento solo si se proporcionaron
-                if celular or fecha_nacimiento:
-                    c.execute("SELECT celular, fecha_nacimiento FROM pacientes WHERE dni = ?", (dni,))
-                    datos_actuales = c.fetchone()
-                    celular_final = celular if celular else (datos_actuales[0] if datos_actuales and datos_actuales[0] else "")
-                    fecha_nac_final = fecha_nacimiento if fecha_nacimiento else (datos_actuales[1] if datos_actuales and datos_actuales[1] else "")
-                    c.execute("""
-                        UPDATE pacientes 
-                        SET nombre = ?, apellido = ?, celular = ?, fecha_nacimiento = ?
-                        WHERE dni = ?
-                    """, (nombre_final, apellido_final, celular_final, fecha_nac_final, dni))
-                else:
-                    c.execute("UPDATE pacientes SET nombre = ?, apellido = ? WHERE dni = ?", 
-                            (nombre_final, apellido_final, dni))
-                nombre_paciente = f"{nombre_final} {apellido_final}"
-            else:
-                nombre_paciente = f"{paciente_existente[0]} {paciente_existente[1]}"
-        else:
-            # Crear paciente (usar datos opcionales si están disponibles)
-            nombre_final = nombre if nombre else "Pendiente"
-            apellido_final = apellido if apellido else "Pendiente"
-            c.execute("""
-                INSERT INTO pacientes (dni, nombre, apellido, email, fecha_nacimiento, obra_social, numero_obra_social, celular)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (dni, nombre_final, apellido_final, email, fecha_nacimiento if fecha_nacimiento else "", "", "", celular if celular else ""))
-            nombre_paciente = f"{nombre_final} {apellido_final}" if nombre_final != "Pendiente" or apellido_final != "Pendiente" else "Paciente"
-        
-        # Crear turno
-        c.execute("""
-            INSERT INTO turnos (medico, hora_turno, fecha_turno, dni_paciente, estado, tipo_consulta, costo, observaciones)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (medico, hora, fecha, dni, "sin atender", "Consulta", 0, "Reservado por autogestión"))
+        conn.close()
+        conn = None
         
-        turno_id = c.lastrowid
-        conn.commit()
+        # Escritura atómica: BEGIN IMMEDIATE toma el lock de escritura antes de
+        # reservar, así dos pacientes no pueden pasar ambos la verificación
+        resultado, status = ejecutar_comando("reservar_turno_publico", {
+            "dni": dni,
+            "nombre": nombre,
+            "apellido": apellido,
+            "email": email,
+            "celular": celular,
+            "fecha_nacimiento": fecha_nacimiento,
+            "medico": medico,
+            "fecha": fecha,
+            "hora": hora,
+        }, endpoint="reservar_turno_publico")
+        if status != 201:
+            return resultado, status
+        turno_id = resultado["turno_id"]
+        nombre_paciente = resultado["nombre_paciente"]
         
         # Enviar email de confirmación de forma asíncrona (no bloquea la respuesta)
         def enviar_email_async():
@@ -3752,12 +4683,12 @@ def reservar_turno_publico():
         
         mensaje = "Turno reservado correctamente. Se enviará un email de confirmación."
         
-        return jsonify({
+        return {
             "success": True,
             "mensaje": mensaje,
             "turno_id": turno_id,
             "email_enviado": True  # Se está procesando en segundo plano
-        }), 201
+        }, 201
         
     except Exception as e:
         if conn:
@@ -3765,11 +4696,17 @@ def reservar_turno_publico():
         print(f"Error al reservar turno: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({"error": f"Error al reservar turno: {str(e)}"}), 500
+        return {"error": f"Error al reservar turno: {str(e)}"}, 500
     finally:
         if conn:
             conn.close()
 
+@app.route("/api/public/reservar-turno", methods=["POST"])
+def reservar_turno_publico():
+    """Reservar turno desde el sistema público"""
+    payload, status = servicio_reservar_turno(request.get_json(silent=True))
+    return jsonify(payload), status
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
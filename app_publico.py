@@ -0,0 +1,162 @@
+"""
+Entrada ASGI para la API pública de reserva de turnos.
+
+Sirve solo /api/public/* con un worker asíncrono (uvicorn), separado de los
+workers sync de gunicorn que atienden a secretaría y médicos, para que un pico
+de pacientes reservando no deje sin hilos al personal. El acceso a SQLite se
+hace en un pool de hilos propio y la concurrencia está acotada por un semáforo.
+
+Uso:
+    uvicorn app_publico:app --host 0.0.0.0 --port 8001
+
+La validación y las consultas son las mismas que usan las rutas Flask
+(funciones servicio_* de app.py).
+"""
+
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from app import (
+    CATALOGO_MAX_AGE,
+    catalogo_cacheado,
+    servicio_especialidades,
+    servicio_info_medico,
+    servicio_medicos,
+    servicio_reservar_turno,
+    servicio_turnos_disponibles,
+)
+
+# Hilos dedicados a la base de datos y máximo de requests en curso
+PUBLICO_HILOS_BD = int(os.environ.get("PUBLICO_HILOS_BD", 4))
+PUBLICO_MAX_CONCURRENCIA = int(os.environ.get("PUBLICO_MAX_CONCURRENCIA", 32))
+# Segundos que un request espera un cupo antes de responder 503
+PUBLICO_ESPERA_MAX = float(os.environ.get("PUBLICO_ESPERA_MAX", 5))
+# Tamaño máximo del cuerpo JSON de una reserva
+MAX_CUERPO = 16 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=PUBLICO_HILOS_BD, thread_name_prefix="publico-bd")
+_semaforo = None
+
+
+def _get_semaforo():
+    # Se crea dentro del event loop que corre el servidor
+    global _semaforo
+    if _semaforo is None:
+        _semaforo = asyncio.Semaphore(PUBLICO_MAX_CONCURRENCIA)
+    return _semaforo
+
+
+def _arg(query, nombre):
+    return query.get(nombre, [""])[0]
+
+
+def _header(scope, nombre):
+    for clave, valor in scope.get("headers", []):
+        if clave == nombre:
+            return valor.decode("latin-1")
+    return ""
+
+
+def _medicos_cacheado(especialidad):
+    especialidad = especialidad.strip()
+    return catalogo_cacheado(("medicos", especialidad), lambda: servicio_medicos(especialidad))
+
+
+# (método, ruta) -> función que recibe (query, body) y devuelve (payload, status)
+# o (payload, status, etag) para las respuestas cacheables del catálogo
+RUTAS = {
+    ("GET", "/api/public/especialidades"): lambda q, b: catalogo_cacheado(("especialidades",), servicio_especialidades),
+    ("GET", "/api/public/medicos"): lambda q, b: _medicos_cacheado(_arg(q, "especialidad")),
+    ("GET", "/api/public/medico-info"): lambda q, b: servicio_info_medico(_arg(q, "medico")),
+    ("GET", "/api/public/turnos-disponibles"): lambda q, b: servicio_turnos_disponibles(_arg(q, "medico"), _arg(q, "fecha")),
+    ("POST", "/api/public/reservar-turno"): lambda q, b: servicio_reservar_turno(b),
+}
+
+
+async def _leer_cuerpo(receive):
+    cuerpo = b""
+    while True:
+        mensaje = await receive()
+        cuerpo += mensaje.get("body", b"")
+        if len(cuerpo) > MAX_CUERPO:
+            return None
+        if not mensaje.get("more_body", False):
+            return cuerpo
+
+
+async def _responder(send, payload, status, extra_headers=()):
+    datos = b"" if status == 304 else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json; charset=utf-8"),
+            (b"content-length", str(len(datos)).encode()),
+            *extra_headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": datos})
+
+
+async def app(scope, receive, send):
+    """Aplicación ASGI mínima (sin framework) para la API pública"""
+    if scope["type"] == "lifespan":
+        while True:
+            mensaje = await receive()
+            if mensaje["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif mensaje["type"] == "lifespan.shutdown":
+                _executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    handler = RUTAS.get((scope["method"], scope["path"]))
+    if handler is None:
+        if any(ruta == scope["path"] for _, ruta in RUTAS):
+            await _responder(send, {"error": "Método no permitido"}, 405)
+        else:
+            await _responder(send, {"error": "No encontrado"}, 404)
+        return
+
+    query = parse_qs(scope.get("query_string", b"").decode("utf-8"))
+    body = None
+    if scope["method"] == "POST":
+        cuerpo = await _leer_cuerpo(receive)
+        if cuerpo is None:
+            await _responder(send, {"error": "Cuerpo demasiado grande"}, 413)
+            return
+        try:
+            body = json.loads(cuerpo or b"null")
+        except ValueError:
+            body = None
+
+    semaforo = _get_semaforo()
+    try:
+        await asyncio.wait_for(semaforo.acquire(), timeout=PUBLICO_ESPERA_MAX)
+    except asyncio.TimeoutError:
+        await _responder(send, {"error": "Servicio ocupado, intente nuevamente en unos segundos"}, 503)
+        return
+    try:
+        loop = asyncio.get_running_loop()
+        resultado = await loop.run_in_executor(_executor, handler, query, body)
+    finally:
+        semaforo.release()
+
+    payload, status = resultado[0], resultado[1]
+    etag = resultado[2] if len(resultado) > 2 else None
+    if status != 200 or not etag:
+        await _responder(send, payload, status)
+        return
+    headers = [
+        (b"etag", etag.encode()),
+        (b"cache-control", f"public, max-age={CATALOGO_MAX_AGE}".encode()),
+    ]
+    if etag in _header(scope, b"if-none-match"):
+        status = 304
+    await _responder(send, payload, status, headers)
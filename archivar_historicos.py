@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Archivado de turnos y pagos históricos (particionado caliente/frío).
+
+Mueve las filas con fecha anterior al horizonte configurado desde 'turnos' y
+'pagos' hacia 'turnos_archivo' y 'pagos_archivo', en lotes acotados. Los
+reportes leen las vistas 'turnos_todos' y 'pagos_todos' (UNION ALL de ambas
+tablas), así que el archivado es transparente para ellos.
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+DB_PATH = "data/consultorio.db"
+
+# Horizonte por defecto: se archivan filas con más de un año de antigüedad
+HORIZONTE_DIAS = int(os.environ.get("ARCHIVO_HORIZONTE_DIAS", 365))
+
+COLUMNAS_TURNOS = (
+    "id, dni_paciente, medico, fecha_turno, hora_turno, estado, "
+    "tipo_consulta, costo, pagado, observaciones, fecha_creacion"
+)
+COLUMNAS_PAGOS = (
+    "id, dni_paciente, fecha_pago, monto, metodo_pago, obra_social, "
+    "observaciones, fecha_creacion"
+)
+
+# tabla caliente -> (tabla archivo, columnas, columna de fecha)
+TABLAS_ARCHIVABLES = {
+    "turnos": ("turnos_archivo", COLUMNAS_TURNOS, "fecha_turno"),
+    "pagos": ("pagos_archivo", COLUMNAS_PAGOS, "fecha_pago"),
+}
+
+SQL_ESQUEMA_ARCHIVO = [
+    """
+    CREATE TABLE IF NOT EXISTS turnos_archivo (
+        id INTEGER PRIMARY KEY,
+        dni_paciente TEXT NOT NULL,
+        medico TEXT NOT NULL,
+        fecha_turno TEXT NOT NULL,
+        hora_turno TEXT NOT NULL,
+        estado TEXT,
+        tipo_consulta TEXT,
+        costo REAL DEFAULT 0,
+        pagado INTEGER DEFAULT 0,
+        observaciones TEXT,
+        fecha_creacion TEXT,
+        fecha_archivo TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS pagos_archivo (
+        id INTEGER PRIMARY KEY,
+        dni_paciente TEXT NOT NULL,
+        fecha_pago TEXT NOT NULL,
+        monto REAL NOT NULL,
+        metodo_pago TEXT,
+        obra_social TEXT,
+        observaciones TEXT,
+        fecha_creacion TEXT,
+        fecha_archivo TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_turnos_fecha ON turnos (fecha_turno, hora_turno)",
+    "CREATE INDEX IF NOT EXISTS idx_pagos_fecha ON pagos (fecha_pago)",
+    "CREATE INDEX IF NOT EXISTS idx_turnos_archivo_fecha ON turnos_archivo (fecha_turno, medico)",
+    "CREATE INDEX IF NOT EXISTS idx_turnos_archivo_dni ON turnos_archivo (dni_paciente)",
+    "CREATE INDEX IF NOT EXISTS idx_pagos_archivo_fecha ON pagos_archivo (fecha_pago)",
+    f"""
+    CREATE VIEW IF NOT EXISTS turnos_todos AS
+        SELECT {COLUMNAS_TURNOS} FROM turnos
+        UNION ALL
+        SELECT {COLUMNAS_TURNOS} FROM turnos_archivo
+    """,
+    f"""
+    CREATE VIEW IF NOT EXISTS pagos_todos AS
+        SELECT {COLUMNAS_PAGOS} FROM pagos
+        UNION ALL
+        SELECT {COLUMNAS_PAGOS} FROM pagos_archivo
+    """,
+]
+
+
+def crear_esquema_archivo(cursor: sqlite3.Cursor) -> None:
+    """Crear tablas de archivo, índices y vistas UNION (idempotente)."""
+    for sql in SQL_ESQUEMA_ARCHIVO:
+        cursor.execute(sql)
+
+
+def archivar_tabla(conn: sqlite3.Connection, tabla: str, fecha_limite: str, lote: int = 1000) -> Dict[str, Any]:
+    """Mover filas de `tabla` con fecha < fecha_limite a su tabla de archivo."""
+    destino, columnas, columna_fecha = TABLAS_ARCHIVABLES[tabla]
+    subconsulta = f"SELECT id FROM {tabla} WHERE {columna_fecha} < ? ORDER BY id LIMIT ?"
+    cur = conn.cursor()
+    movidos = 0
+    lotes = 0
+    inicio = time.perf_counter()
+    while True:
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute(
+                f"INSERT INTO {destino} ({columnas}) SELECT {columnas} FROM {tabla} WHERE id IN ({subconsulta})",
+                (fecha_limite, lote),
+            )
+            cur.execute(f"DELETE FROM {tabla} WHERE id IN ({subconsulta})", (fecha_limite, lote))
+            borrados = cur.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if borrados <= 0:
+            break
+        movidos += borrados
+        lotes += 1
+        if borrados < lote:
+            break
+    return {
+        "tabla": tabla,
+        "movidos": movidos,
+        "lotes": lotes,
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 1),
+    }
+
+
+def archivar_historicos(
+    conn: sqlite3.Connection,
+    dias: Optional[int] = None,
+    lote: int = 1000,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """Archivar turnos y pagos anteriores a hoy - `dias`."""
+    dias = HORIZONTE_DIAS if dias is None else dias
+    fecha_limite = (date.today() - timedelta(days=dias)).isoformat()
+    resultado: Dict[str, Any] = {"fecha_limite": fecha_limite, "dry_run": dry_run, "tablas": []}
+    cur = conn.cursor()
+    for tabla, (_, _, columna_fecha) in TABLAS_ARCHIVABLES.items():
+        if dry_run:
+            cur.execute(f"SELECT COUNT(*) FROM {tabla} WHERE {columna_fecha} < ?", (fecha_limite,))
+            resultado["tablas"].append({"tabla": tabla, "a_mover": cur.fetchone()[0]})
+        else:
+            resultado["tablas"].append(archivar_tabla(conn, tabla, fecha_limite, lote))
+    if not dry_run:
+        # Actualizar estadísticas del planificador tras mover muchas filas
+        conn.execute("ANALYZE")
+        conn.commit()
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivar turnos y pagos históricos en tablas *_archivo")
+    parser.add_argument("--db", default=DB_PATH, help="Ruta a la base SQLite")
+    parser.add_argument("--dias", type=int, default=None, help=f"Horizonte en días (default {HORIZONTE_DIAS}, env ARCHIVO_HORIZONTE_DIAS)")
+    parser.add_argument("--lote", type=int, default=1000, help="Filas por lote/transacción")
+    parser.add_argument("--dry-run", action="store_true", help="Solo informar cuántas filas se moverían")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=30.0)
+    conn.execute("PRAGMA busy_timeout=30000")
+    try:
+        crear_esquema_archivo(conn.cursor())
+        conn.commit()
+        res = archivar_historicos(conn, args.dias, args.lote, args.dry_run)
+    finally:
+        conn.close()
+
+    print(f"Fecha límite: {res['fecha_limite']}")
+    for t in res["tablas"]:
+        if res["dry_run"]:
+            print(f"[DRY RUN] {t['tabla']}: {t['a_mover']} filas a archivar")
+        else:
+            print(f"- {t['tabla']}: {t['movidos']} filas archivadas en {t['lotes']} lote(s), {t['duracion_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
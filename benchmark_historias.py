@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la compresión de historias clínicas (notas_historias.py).
+
+Arma una base temporal con `--notas` consultas en texto (como las de antes) y
+mide en tres etapas: texto, zlib sin diccionario (versión 0) y zlib con un
+diccionario entrenado con las mismas notas:
+
+  - tamaño de la base después de VACUUM y bytes de consulta_medica
+  - tiempo de una página de la línea de tiempo (linea_de_tiempo, 20 consultas)
+  - tiempo de leer una nota completa (por_id, que descomprime)
+
+Las notas se generan con frases clínicas frecuentes y valores al azar. No toca
+data/consultorio.db.
+
+Uso:
+    python benchmark_historias.py --notas 50000
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+MOTIVOS = [
+    "Consulta por cefalea de {n} días de evolución", "Control de hipertensión arterial",
+    "Dolor lumbar sin irradiación", "Cuadro de vías aéreas superiores con tos y odinofagia",
+    "Control de diabetes tipo 2", "Dolor abdominal en epigastrio posprandial", "Control de salud anual",
+    "Mareos al incorporarse", "Lesión en piel de miembro inferior", "Seguimiento de hipotiroidismo",
+]
+EXAMENES = [
+    "Paciente lúcido, orientado en tiempo y espacio", "Buen estado general, afebril",
+    "Tensión arterial {ta}/{td} mmHg, frecuencia cardíaca {fc} lpm", "Peso {peso} kg, talla {talla} cm",
+    "Auscultación cardíaca: R1 y R2 normofonéticos, sin soplos", "Murmullo vesicular conservado, sin ruidos agregados",
+    "Abdomen blando, depresible, indoloro a la palpación", "Sin edemas en miembros inferiores",
+    "Contractura paravertebral lumbar, Lasègue negativo", "Fauces congestivas sin exudado",
+]
+PLANES = [
+    "Se indica ibuprofeno 400 mg cada 8 horas por {n} días", "Se solicita laboratorio: hemograma, glucemia, perfil lipídico, TSH",
+    "Continúa con enalapril 10 mg cada 12 horas", "Se indica metformina 850 mg con almuerzo y cena",
+    "Pautas de alarma explicadas al paciente", "Control en {n} semanas con resultados",
+    "Se deriva a cardiología para evaluación", "Reposo relativo y calor local", "Dieta hiposódica y actividad física regular",
+]
+
+
+def nota_al_azar(azar):
+    valores = lambda frase: frase.format(
+        n=azar.randint(2, 15), ta=azar.randint(100, 160), td=azar.randint(60, 100), fc=azar.randint(55, 110),
+        peso=azar.randint(45, 110), talla=azar.randint(150, 195),
+    )
+    partes = ["Motivo de consulta: " + valores(azar.choice(MOTIVOS)) + "."]
+    partes.append("Examen físico: " + ". ".join(valores(f) for f in azar.sample(EXAMENES, azar.randint(3, 7))) + ".")
+    partes.append("Plan: " + ". ".join(valores(f) for f in azar.sample(PLANES, azar.randint(2, 5))) + ".")
+    if azar.random() < 0.3:
+        partes.append(f"Observaciones: paciente refiere {azar.choice(['mejoría parcial', 'buena adherencia', 'dificultad para conseguir la medicación', 'episodios similares previos'])}.")
+    return "\n".join(partes)
+
+
+def preparar_base(notas, pacientes):
+    """Esquema en un directorio temporal con `notas` consultas en texto"""
+    directorio = tempfile.mkdtemp(prefix="benchmark_historias_")
+    os.chdir(directorio)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        from crear_todas_las_tablas import crear_todas_las_tablas
+        crear_todas_las_tablas()
+    from notas_historias import preparar_historias
+    azar = random.Random(50)
+    conn = sqlite3.connect("data/consultorio.db")
+    conn.executemany(
+        "INSERT INTO historias_clinicas (dni, consulta_medica, medico, fecha_consulta, fecha_creacion) VALUES (?, ?, ?, ?, ?)",
+        [
+            (str(20000000 + azar.randrange(pacientes)), nota_al_azar(azar), f"medico{i % 20}",
+             f"20{18 + i % 8}-{1 + i % 12:02d}-{1 + i % 28:02d}", "2025-01-01 10:00:00")
+            for i in range(notas)
+        ],
+    )
+    # Como en una base existente: resumen y largo los completa la migración
+    preparar_historias(conn.cursor())
+    conn.commit()
+    conn.close()
+    return directorio
+
+
+def medir_lecturas(notas, pacientes, repeticiones):
+    """(ms por página de línea de tiempo, ms por nota completa) con un backend nuevo"""
+    from repositorios import BackendSQLite, Repositorios
+    backend = BackendSQLite("data/consultorio.db")
+    repos = Repositorios(backend)
+    azar = random.Random(7)
+    try:
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            repos.historias.linea_de_tiempo(str(20000000 + azar.randrange(pacientes)), limite=20)
+        t_linea = (time.perf_counter() - inicio) / repeticiones
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            repos.historias.por_id(1 + azar.randrange(notas)).consulta_medica
+        t_nota = (time.perf_counter() - inicio) / repeticiones
+    finally:
+        backend.cerrar()
+    return t_linea * 1000, t_nota * 1000
+
+
+def medir_tamano():
+    conn = sqlite3.connect("data/consultorio.db")
+    try:
+        conn.execute("VACUUM")
+        (bytes_notas,) = conn.execute(
+            "SELECT SUM(length(CAST(consulta_medica AS BLOB))) FROM historias_clinicas"
+        ).fetchone()
+    finally:
+        conn.close()
+    return os.path.getsize("data/consultorio.db"), bytes_notas
+
+
+def mb(valor):
+    return f"{valor / 1024 / 1024:.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tamaño y lectura de historias en texto y comprimidas")
+    parser.add_argument("--notas", type=int, default=50000, help="Consultas en la base")
+    parser.add_argument("--pacientes", type=int, default=5000, help="Pacientes entre los que se reparten")
+    parser.add_argument("--repeticiones", type=int, default=2000, help="Lecturas por medición")
+    args = parser.parse_args()
+
+    directorio = preparar_base(args.notas, args.pacientes)
+    print(f"📁 Base temporal: {directorio} ({args.notas} consultas de {args.pacientes} pacientes)")
+    from notas_historias import (comprimir_existentes, entrenar_diccionario, guardar_diccionario,
+                                 muestra_notas)
+
+    def etapa(nombre):
+        tamano, bytes_notas = medir_tamano()
+        t_linea, t_nota = medir_lecturas(args.notas, args.pacientes, args.repeticiones)
+        print(f"- {nombre}: base {mb(tamano)}, notas {mb(bytes_notas)} | "
+              f"línea de tiempo {t_linea:.3f} ms, nota completa {t_nota:.3f} ms")
+
+    etapa("texto")
+    conn = sqlite3.connect("data/consultorio.db")
+    try:
+        comprimir_existentes(conn)
+        etapa("zlib sin diccionario")
+        inicio = time.perf_counter()
+        notas = muestra_notas(conn.cursor())
+        guardar_diccionario(conn.cursor(), entrenar_diccionario(notas), len(notas))
+        conn.commit()
+        t_entrenar = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        reescritas, _, _ = comprimir_existentes(conn)
+        t_comprimir = time.perf_counter() - inicio
+    finally:
+        conn.close()
+    etapa("zlib con diccionario")
+    print(f"⏱️  Entrenar el diccionario: {t_entrenar:.1f} s; recomprimir {reescritas} notas: {t_comprimir:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark del listado y del reporte de pacientes en una base temporal.
+
+Compara la versión anterior (traer las filas y calcular edad, incompleto y
+registro_rapido en Python con datetime.strptime por paciente) contra la actual
+(SQL_EDAD y las columnas generadas de pacientes_derivados.py), para:
+
+  - listado:  GET /api/pacientes (cargar_pacientes)
+  - reporte:  edad promedio, rangos de edad e incompletos de /api/reportes/pacientes
+
+No toca data/consultorio.db.
+
+Uso:
+    python benchmark_pacientes.py --pacientes 200000 --repeticiones 5
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+
+def preparar_base(cantidad):
+    """Crear el esquema en un directorio temporal y cargar `cantidad` pacientes"""
+    directorio = tempfile.mkdtemp(prefix="benchmark_pacientes_")
+    os.chdir(directorio)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        from crear_todas_las_tablas import crear_todas_las_tablas
+        crear_todas_las_tablas()
+
+    rnd = random.Random(1)
+    nacimiento_min = date(1930, 1, 1)
+    filas = []
+    for i in range(cantidad):
+        pendiente = rnd.random() < 0.05
+        fecha = "" if rnd.random() < 0.03 else (nacimiento_min + timedelta(days=rnd.randrange(34000))).isoformat()
+        filas.append((
+            str(10000000 + i),
+            "Pendiente" if pendiente else f"Nombre{i % 500}",
+            "Pendiente" if pendiente else f"Apellido{i % 2000}",
+            fecha,
+            "" if rnd.random() < 0.05 else "OSDE",
+            str(i),
+            f"11{i:08d}",
+            f"p{i}@mail.com" if pendiente else None,
+        ))
+    conn = sqlite3.connect("data/consultorio.db")
+    conn.executemany(
+        """
+        INSERT INTO pacientes (dni, nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular, email)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        filas,
+    )
+    conn.commit()
+    conn.close()
+    return directorio
+
+
+def paciente_viejo(row):
+    """Conversión por fila de la versión anterior (edad y flags en Python)"""
+    paciente = {
+        "dni": row[0], "nombre": row[1], "apellido": row[2], "fecha_nacimiento": row[3],
+        "obra_social": row[4], "numero_obra_social": row[5], "celular": row[6], "email": row[7],
+    }
+    if paciente.get("fecha_nacimiento"):
+        try:
+            fecha_nac = datetime.strptime(paciente["fecha_nacimiento"], "%Y-%m-%d").date()
+            hoy = date.today()
+            paciente["edad"] = hoy.year - fecha_nac.year - ((hoy.month, hoy.day) < (fecha_nac.month, fecha_nac.day))
+        except ValueError:
+            paciente["edad"] = 0
+    else:
+        paciente["edad"] = 0
+    paciente["incompleto"] = (
+        paciente.get("nombre") == "Pendiente" or paciente.get("apellido") == "Pendiente"
+        or not paciente.get("fecha_nacimiento") or not paciente.get("obra_social")
+        or not paciente.get("celular")
+    )
+    paciente["registro_rapido"] = (
+        paciente.get("email") and (paciente.get("nombre") == "Pendiente" or paciente.get("apellido") == "Pendiente")
+    )
+    return paciente
+
+
+def listado_viejo(conn):
+    rows = conn.execute(
+        "SELECT dni, nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular, email FROM pacientes"
+    ).fetchall()
+    return [paciente_viejo(row) for row in rows]
+
+
+def reporte_viejo(conn):
+    pacientes = listado_viejo(conn)
+    edades = [p["edad"] for p in pacientes]
+    rangos = {}
+    for e in edades:
+        for a, b in [(0, 12), (13, 19), (20, 39), (40, 59), (60, 120)]:
+            if a <= e <= b:
+                rangos[f"{a}-{b}"] = rangos.get(f"{a}-{b}", 0) + 1
+                break
+    return round(sum(edades) / len(edades)), rangos, sum(1 for p in pacientes if p["incompleto"])
+
+
+def medir(funcion, repeticiones):
+    """Mejor tiempo (ms) de `repeticiones` llamadas, después de una de calentamiento"""
+    resultado = funcion()
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return min(tiempos), resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de edad/incompleto en Python contra SQL")
+    parser.add_argument("--pacientes", type=int, default=200000, help="Pacientes en la tabla")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Mediciones por caso (se toma la mejor)")
+    args = parser.parse_args()
+
+    directorio = preparar_base(args.pacientes)
+    print(f"📁 Base temporal: {directorio} ({args.pacientes} pacientes)")
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as appmod
+
+    conn = sqlite3.connect("data/consultorio.db")
+    cliente = appmod.app.test_client()
+    with cliente.session_transaction() as s:
+        s["usuario"] = "admin_bench"
+        s["rol"] = "administrador"
+    casos = [
+        ("listado (Python, strptime por fila)", lambda: listado_viejo(conn)),
+        ("listado (SQL, cargar_pacientes)", appmod.cargar_pacientes),
+        ("reporte edad/incompletos (Python)", lambda: reporte_viejo(conn)),
+        ("reporte /api/reportes/pacientes (SQL)", lambda: cliente.get("/api/reportes/pacientes").get_json()),
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        resultados = [(nombre, *medir(funcion, args.repeticiones)) for nombre, funcion in casos]
+
+    for nombre, ms, _ in resultados:
+        print(f"- {nombre}: {ms:.0f} ms")
+
+    # Los dos caminos tienen que dar los mismos datos
+    viejos = {p["dni"]: p for p in resultados[0][2]}
+    distintos = sum(
+        1 for p in resultados[1][2]
+        if (p["edad"], p["incompleto"], bool(p["registro_rapido"]))
+        != (viejos[p["dni"]]["edad"], viejos[p["dni"]]["incompleto"], bool(viejos[p["dni"]]["registro_rapido"]))
+    )
+    print(f"Pacientes con campos derivados distintos entre ambas versiones: {distintos}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark de memoria y tiempo: dicts por fila contra registros con __slots__.
+
+Para turnos y pacientes compara la versión anterior (un dict por fila con las
+claves de compatibilidad, serializado con jsonify) contra registros.py (row
+factory con __slots__ y a_json), midiendo con tracemalloc:
+
+  - memoria retenida por la lista cargada y pico durante la carga
+  - pico y tiempo al serializar la respuesta JSON
+
+No toca data/consultorio.db.
+
+Uso:
+    python benchmark_registros.py --filas 200000
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SQL_TURNOS = """
+    SELECT id, medico, hora_turno, fecha_turno, dni_paciente, estado,
+           tipo_consulta, costo, pagado, observaciones
+    FROM turnos
+    ORDER BY fecha_turno DESC, hora_turno ASC
+"""
+
+
+def preparar_base(filas):
+    """Crear el esquema en un directorio temporal con `filas` turnos y `filas` pacientes"""
+    directorio = tempfile.mkdtemp(prefix="benchmark_registros_")
+    os.chdir(directorio)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        from crear_todas_las_tablas import crear_todas_las_tablas
+        crear_todas_las_tablas()
+    conn = sqlite3.connect("data/consultorio.db")
+    conn.executemany(
+        """
+        INSERT INTO pacientes (dni, nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular, email)
+        VALUES (?, ?, 'Apellido', '1980-06-15', 'OSDE', ?, '1100000000', NULL)
+        """,
+        [(str(10000000 + i), f"Nombre{i % 500}", str(i)) for i in range(filas)],
+    )
+    # (médico, fecha, hora) únicos: 40 médicos x 40 horarios por día
+    conn.executemany(
+        """
+        INSERT INTO turnos (medico, hora_turno, fecha_turno, dni_paciente, estado, tipo_consulta, costo, pagado)
+        VALUES (?, ?, ?, ?, 'atendido', 'consulta', 5000, 1)
+        """,
+        [
+            (f"medico{i % 40}", f"{8 + (i // 40) % 40 // 4:02d}:{(i // 40) % 4 * 15:02d}",
+             f"2025-{1 + i // 1600 % 12:02d}-{1 + i // 19200 % 28:02d}", str(10000000 + i))
+            for i in range(filas)
+        ],
+    )
+    conn.commit()
+    conn.close()
+    return directorio
+
+
+def turnos_dicts(conn):
+    """Carga de la versión anterior de cargar_turnos (un dict por fila)"""
+    turnos = []
+    for row in conn.execute(SQL_TURNOS).fetchall():
+        turno = {
+            "id": row[0], "medico": row[1], "hora_turno": row[2], "fecha_turno": row[3],
+            "dni_paciente": str(row[4] or ""), "estado": row[5], "tipo_consulta": row[6],
+            "costo": row[7], "pagado": row[8], "observaciones": row[9],
+        }
+        turno["pago_registrado"] = bool(turno.get("pagado", 0))
+        turno["monto_pagado"] = float(turno.get("costo") or 0)
+        turnos.append(turno)
+    return turnos
+
+
+def pacientes_dicts(conn, columnas):
+    claves = ("dni", "nombre", "apellido", "fecha_nacimiento", "obra_social", "numero_obra_social",
+              "celular", "email", "edad", "incompleto", "registro_rapido")
+    pacientes = []
+    for row in conn.execute(f"SELECT {columnas} FROM pacientes").fetchall():
+        paciente = dict(zip(claves, row))
+        paciente["incompleto"] = bool(paciente["incompleto"])
+        paciente["registro_rapido"] = bool(paciente["registro_rapido"])
+        pacientes.append(paciente)
+    return pacientes
+
+
+def medir(funcion):
+    """(resultado, segundos, bytes retenidos, pico en bytes) de una llamada bajo tracemalloc"""
+    gc.collect()
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    resultado = funcion()
+    segundos = time.perf_counter() - inicio
+    retenido, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return resultado, segundos, retenido, pico
+
+
+def mb(valor):
+    return f"{valor / 1024 / 1024:.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dicts por fila contra registros con __slots__")
+    parser.add_argument("--filas", type=int, default=200000, help="Turnos y pacientes en la base")
+    args = parser.parse_args()
+
+    directorio = preparar_base(args.filas)
+    print(f"📁 Base temporal: {directorio} ({args.filas} turnos y {args.filas} pacientes)")
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as appmod
+    from registros import Turno, Paciente, a_json
+    from repositorios import COLUMNAS_PACIENTE
+    columnas = COLUMNAS_PACIENTE["sqlite"]
+
+    def registros(clase, sql):
+        conn = sqlite3.connect("data/consultorio.db")
+        conn.row_factory = clase.fabrica()
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def dicts(funcion):
+        conn = sqlite3.connect("data/consultorio.db")
+        try:
+            return funcion(conn)
+        finally:
+            conn.close()
+
+    casos = [
+        ("turnos", lambda: dicts(turnos_dicts), lambda: registros(Turno, SQL_TURNOS)),
+        ("pacientes",
+         lambda: dicts(lambda conn: pacientes_dicts(conn, columnas)),
+         lambda: registros(Paciente, f"SELECT {columnas} FROM pacientes")),
+    ]
+    with appmod.app.app_context():
+        for nombre, carga_vieja, carga_nueva in casos:
+            print(f"\n{nombre}:")
+            for etiqueta, cargar, serializar in (
+                ("dicts + jsonify", carga_vieja, lambda filas: appmod.jsonify(filas).get_data()),
+                ("__slots__ + a_json", carga_nueva, lambda filas: appmod.respuesta_json(a_json(filas)).get_data()),
+            ):
+                filas, t_carga, retenido, pico_carga = medir(cargar)
+                cuerpo, t_json, _, pico_json = medir(lambda: serializar(filas))
+                print(f"- {etiqueta}: carga {t_carga * 1000:.0f} ms, retenido {mb(retenido)}, "
+                      f"pico {mb(pico_carga)} | JSON {t_json * 1000:.0f} ms, pico {mb(pico_json)}, "
+                      f"{mb(len(cuerpo))}")
+                del filas, cuerpo
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Benchmarks de operaciones sobre turnos en una base temporal.
+
+Escenarios:
+  cobro   Carga concurrente de recepción: cada hilo cobra y pasa a sala de espera
+          sus turnos recepcionados, por la ruta vieja (dni/fecha/hora) y por la
+          nueva /api/pagos/cobrar-y-sala (turno_id).
+  busqueda  Micro-benchmark de SQLite: ubicar y modificar un turno por id (rowid)
+            contra (dni, fecha, hora), con y sin índice, y la consulta vieja de
+            editar_turno con la subconsulta correlacionada del médico.
+
+No toca data/consultorio.db. Las requests se hacen con el cliente de pruebas de
+Flask (sin red), así se mide la aplicación y SQLite.
+
+Uso:
+    python benchmark_turnos.py cobro --turnos 50000 --hilos 8 --cobros 400
+    python benchmark_turnos.py busqueda --turnos 500000 --operaciones 2000
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+
+def preparar_base(turnos_historicos):
+    """Crear el esquema en un directorio temporal y cargar turnos de relleno"""
+    directorio = tempfile.mkdtemp(prefix="benchmark_turnos_")
+    os.chdir(directorio)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        from crear_todas_las_tablas import crear_todas_las_tablas
+        crear_todas_las_tablas()
+
+    conn = sqlite3.connect("data/consultorio.db")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "INSERT INTO usuarios (usuario, contrasena, rol, activo) VALUES ('secretaria_bench', '-', 'secretaria', 1)"
+    )
+    medicos = [f"medico{i}" for i in range(20)]
+    dnis = [str(20000000 + i) for i in range(5000)]
+    conn.executemany(
+        "INSERT INTO pacientes (dni, nombre, apellido, obra_social) VALUES (?, 'Nombre', 'Apellido', 'OSDE')",
+        [(d,) for d in dnis],
+    )
+    inicio = date.today() - timedelta(days=730)
+    filas = []
+    for i in range(turnos_historicos):
+        # (médico, fecha, hora) únicos: 720 días x 20 médicos x hasta 40 horarios
+        fecha = (inicio + timedelta(days=i % 720)).isoformat()
+        horario = i // (720 * len(medicos))
+        hora = f"{8 + horario // 4:02d}:{horario % 4 * 15:02d}"
+        filas.append((dnis[i % len(dnis)], medicos[(i // 720) % len(medicos)], fecha, hora, "atendido"))
+        if len(filas) == 10000:
+            conn.executemany(
+                "INSERT INTO turnos (dni_paciente, medico, fecha_turno, hora_turno, estado) VALUES (?, ?, ?, ?, ?)",
+                filas,
+            )
+            filas = []
+    if filas:
+        conn.executemany(
+            "INSERT INTO turnos (dni_paciente, medico, fecha_turno, hora_turno, estado) VALUES (?, ?, ?, ?, ?)",
+            filas,
+        )
+    conn.commit()
+    conn.close()
+    return directorio, dnis, medicos
+
+
+def crear_recepcionados(cantidad, dnis, fecha, ronda):
+    """Crear `cantidad` turnos recepcionados para hoy con (dni, hora) únicos en cada ronda"""
+    conn = sqlite3.connect("data/consultorio.db")
+    turnos = []
+    for i in range(cantidad):
+        dni = dnis[i % len(dnis)]
+        hora = f"{ronda:02d}:{i // len(dnis):02d}"
+        cur = conn.execute(
+            "INSERT INTO turnos (dni_paciente, medico, fecha_turno, hora_turno, estado) VALUES (?, ?, ?, ?, 'recepcionado')",
+            (dni, f"medico_cobro{i}", fecha, hora),
+        )
+        turnos.append({"id": cur.lastrowid, "dni": dni, "fecha": fecha, "hora": hora})
+    conn.commit()
+    conn.close()
+    return turnos
+
+
+def correr_concurrente(app, turnos, hilos, peticion):
+    """Repartir `turnos` entre `hilos` clientes y medir latencias de peticion(cliente, turno)"""
+    latencias = []
+    errores = []
+    lock = threading.Lock()
+
+    def trabajador(lote):
+        cliente = app.test_client()
+        with cliente.session_transaction() as s:
+            s["usuario"] = "secretaria_bench"
+            s["rol"] = "secretaria"
+        for turno in lote:
+            t0 = time.perf_counter()
+            resp = peticion(cliente, turno)
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                latencias.append(ms)
+                if resp.status_code != 200:
+                    errores.append(resp.status_code)
+
+    lotes = [turnos[i::hilos] for i in range(hilos)]
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ts = [threading.Thread(target=trabajador, args=(lote,)) for lote in lotes]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+    duracion = time.perf_counter() - inicio
+    latencias.sort()
+    return {
+        "operaciones": len(latencias),
+        "ops_por_segundo": round(len(latencias) / duracion, 1),
+        "p50_ms": round(latencias[len(latencias) // 2], 2),
+        "p95_ms": round(latencias[int(len(latencias) * 0.95) - 1], 2),
+        "errores": len(errores),
+    }
+
+
+def escenario_cobro(args):
+    directorio, dnis, medicos = preparar_base(args.turnos)
+    print(f"📁 Base temporal: {directorio} ({args.turnos} turnos de relleno)")
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as appmod
+    fecha = date.today().isoformat()
+
+    def ruta_vieja(cliente, t):
+        return cliente.put("/api/turnos/sala-espera", json={
+            "dni_paciente": t["dni"], "fecha": t["fecha"], "hora": t["hora"], "monto": 1000, "tipo_pago": "efectivo",
+        })
+
+    def ruta_nueva(cliente, t):
+        return cliente.put("/api/pagos/cobrar-y-sala", json={
+            "turno_id": t["id"], "monto": 1000, "tipo_pago": "efectivo",
+        })
+
+    rutas = [("dni/fecha/hora (/api/turnos/sala-espera)", ruta_vieja),
+             ("turno_id (/api/pagos/cobrar-y-sala)", ruta_nueva)]
+    if args.sin_indice:
+        # Reproduce la situación anterior: ubicar el turno por (dni, fecha, hora) recorre la tabla
+        conn = sqlite3.connect("data/consultorio.db")
+        conn.execute("DROP INDEX IF EXISTS idx_turnos_dni_fecha")
+        conn.close()
+    for ronda, (nombre, peticion) in enumerate(rutas):
+        turnos = crear_recepcionados(args.cobros, dnis, fecha, ronda)
+        res = correr_concurrente(appmod.app, turnos, args.hilos, peticion)
+        print(f"- {nombre}: {res['ops_por_segundo']} cobros/s | p50 {res['p50_ms']} ms | "
+              f"p95 {res['p95_ms']} ms | errores {res['errores']}")
+
+
+def medir(conn, sql, parametros):
+    """Ejecutar `sql` una vez por cada tupla de parámetros; devuelve µs por operación"""
+    inicio = time.perf_counter()
+    for p in parametros:
+        conn.execute(sql, p).fetchall()
+    conn.rollback()
+    return (time.perf_counter() - inicio) * 1e6 / len(parametros)
+
+
+def escenario_busqueda(args):
+    directorio, _, _ = preparar_base(args.turnos)
+    print(f"📁 Base temporal: {directorio} ({args.turnos} turnos)")
+    conn = sqlite3.connect("data/consultorio.db")
+    filas = conn.execute("SELECT id, dni_paciente, fecha_turno, hora_turno FROM turnos").fetchall()
+    muestra = random.Random(1).sample(filas, min(args.operaciones, len(filas)))
+    por_id = [(t[0],) for t in muestra]
+    por_clave = [(t[1], t[2], t[3]) for t in muestra]
+
+    casos = [
+        ("SELECT por id", "SELECT estado FROM turnos WHERE id = ?", por_id),
+        ("UPDATE por id", "UPDATE turnos SET estado = 'llamado' WHERE id = ?", por_id),
+        ("SELECT por (dni, fecha, hora)",
+         "SELECT estado FROM turnos WHERE dni_paciente = ? AND fecha_turno = ? AND hora_turno = ?", por_clave),
+        ("UPDATE por (dni, fecha, hora)",
+         "UPDATE turnos SET estado = 'llamado' WHERE dni_paciente = ? AND fecha_turno = ? AND hora_turno = ?", por_clave),
+        # Chequeo de horario ocupado de la versión anterior de editar_turno
+        ("editar_turno viejo (subconsulta médico)", """
+            SELECT dni_paciente FROM turnos
+            WHERE medico = (SELECT medico FROM turnos WHERE dni_paciente=? AND fecha_turno=? AND hora_turno=?)
+            AND fecha_turno = ? AND hora_turno = ?
+            AND NOT (dni_paciente = ? AND fecha_turno = ? AND hora_turno = ?)
+         """, [(d, f, h, f, h, d, f, h) for d, f, h in por_clave]),
+    ]
+
+    for pasada in ("con índices", "sin índices sobre turnos (esquema viejo)"):
+        if pasada != "con índices":
+            for (nombre,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'turnos' AND sql IS NOT NULL"
+            ).fetchall():
+                conn.execute(f"DROP INDEX {nombre}")
+            conn.commit()
+        print(f"\n{pasada}:")
+        for nombre, sql, parametros in casos:
+            # Sin índices cada búsqueda por clave recorre la tabla: menos operaciones
+            if pasada != "con índices" and not nombre.endswith("por id"):
+                parametros = parametros[:max(1, len(parametros) // 50)]
+            medir(conn, sql, parametros)  # calentar la caché de páginas
+            print(f"- {nombre}: {medir(conn, sql, parametros):.1f} µs/op ({len(parametros)} ops)")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de operaciones sobre turnos")
+    sub = parser.add_subparsers(dest="escenario", required=True)
+
+    p_cobro = sub.add_parser("cobro", help="Cobrar y pasar a sala bajo carga concurrente")
+    p_cobro.add_argument("--turnos", type=int, default=50000, help="Turnos de relleno en la tabla")
+    p_cobro.add_argument("--hilos", type=int, default=8, help="Secretarias cobrando en paralelo")
+    p_cobro.add_argument("--cobros", type=int, default=400, help="Turnos recepcionados a cobrar por ruta")
+    p_cobro.add_argument("--sin-indice", action="store_true", help="Quitar idx_turnos_dni_fecha (comparar con el esquema viejo)")
+    p_cobro.set_defaults(func=escenario_cobro)
+
+    p_busqueda = sub.add_parser("busqueda", help="Búsqueda de turnos por id contra (dni, fecha, hora)")
+    p_busqueda.add_argument("--turnos", type=int, default=500000, help="Turnos en la tabla")
+    p_busqueda.add_argument("--operaciones", type=int, default=2000, help="Búsquedas por caso")
+    p_busqueda.set_defaults(func=escenario_busqueda)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
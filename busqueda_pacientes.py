@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Búsqueda indexada de pacientes (typeahead por DNI, apellido o nombre).
+
+`apellido_norm` y `nombre_norm` son columnas generadas (VIRTUAL) de `pacientes`:
+el texto en minúsculas y sin tildes, calculado por SQLite. Al ser columnas
+generadas las mantiene la base en cualquier INSERT/UPDATE (app, importar_json,
+scripts), y sus índices permiten buscar por prefijo con un rango
+`col >= 'gom' AND col < 'gom\\uffff'` sin recorrer la tabla.
+
+La normalización de Python (`normalizar_texto`) replica exactamente la de SQL:
+reemplaza las letras acentuadas del español y pasa a minúsculas solo ASCII,
+igual que `lower()` de SQLite.
+"""
+
+from typing import Any, List, Optional, Tuple
+
+REEMPLAZOS = [
+    ("á", "a"), ("é", "e"), ("í", "i"), ("ó", "o"), ("ú", "u"), ("ü", "u"), ("ñ", "n"),
+    ("Á", "a"), ("É", "e"), ("Í", "i"), ("Ó", "o"), ("Ú", "u"), ("Ü", "u"), ("Ñ", "n"),
+]
+FIN_PREFIJO = "\uffff"
+LIMITE_MAX = 50
+
+
+def sql_normalizado(columna: str) -> str:
+    """Expresión SQL que normaliza `columna` (sin tildes, minúsculas, sin espacios en los extremos)"""
+    expr = columna
+    for origen, destino in REEMPLAZOS:
+        expr = f"replace({expr}, '{origen}', '{destino}')"
+    return f"lower(trim({expr}))"
+
+
+def normalizar_texto(texto: Any) -> str:
+    """Misma normalización que sql_normalizado(), para los parámetros de búsqueda"""
+    texto = str(texto or "").strip()
+    for origen, destino in REEMPLAZOS:
+        texto = texto.replace(origen, destino)
+    return "".join(c.lower() if c.isascii() else c for c in texto)
+
+
+def crear_indices_busqueda(cursor) -> List[str]:
+    """Agregar las columnas generadas e índices de búsqueda si faltan. Devuelve los cambios hechos"""
+    cambios = []
+    cursor.execute("PRAGMA table_xinfo(pacientes)")
+    columnas = {col[1] for col in cursor.fetchall()}
+    for columna, origen in (("apellido_norm", "apellido"), ("nombre_norm", "nombre")):
+        if columna not in columnas:
+            cursor.execute(
+                f"ALTER TABLE pacientes ADD COLUMN {columna} TEXT "
+                f"GENERATED ALWAYS AS ({sql_normalizado(origen)}) VIRTUAL"
+            )
+            cambios.append(f"Columna '{columna}' agregada a 'pacientes'")
+    for indice, columnas_indice in (
+        ("idx_pacientes_apellido_norm", "apellido_norm, nombre_norm"),
+        ("idx_pacientes_nombre_norm", "nombre_norm, apellido_norm"),
+    ):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (indice,))
+        if not cursor.fetchone():
+            cursor.execute(f"CREATE INDEX {indice} ON pacientes ({columnas_indice})")
+            cambios.append(f"Índice '{indice}' creado")
+    return cambios
+
+
+def consulta_busqueda(q: str, columnas: str, limite: int) -> Optional[Tuple[str, list]]:
+    """(sql, parámetros) para buscar pacientes que coincidan con `q`, o None si `q` está vacío.
+
+    - Solo dígitos: prefijo de DNI (índice único de `dni`).
+    - Texto: la primera palabra es prefijo del apellido o del nombre (índices *_norm);
+      cada palabra adicional debe ser prefijo de alguna palabra de apellido/nombre.
+    """
+    q = str(q or "").strip()
+    limite = max(1, min(int(limite), LIMITE_MAX))
+    if not q:
+        return None
+
+    if q.isdigit():
+        return (
+            f"SELECT {columnas} FROM pacientes WHERE dni >= ? AND dni < ? ORDER BY dni LIMIT ?",
+            [q, q + FIN_PREFIJO, limite],
+        )
+
+    palabras = normalizar_texto(q).split()
+    if not palabras:
+        return None
+    primera, resto = palabras[0], palabras[1:]
+    filtro_resto = "".join(
+        " AND (' ' || apellido_norm || ' ' || nombre_norm) LIKE ? ESCAPE '\\'" for _ in resto
+    )
+    params_resto = ["% " + p.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%" for p in resto]
+    # Cada rama recorre su índice en orden y corta apenas junta `limite` filas,
+    # así un prefijo corto ("g") no ordena miles de pacientes
+    sql = f"""
+        SELECT {columnas} FROM pacientes WHERE id IN (
+            SELECT id FROM (
+                SELECT id FROM pacientes WHERE apellido_norm >= ? AND apellido_norm < ?{filtro_resto}
+                ORDER BY apellido_norm, nombre_norm LIMIT ?
+            ) AS por_apellido
+            UNION
+            SELECT id FROM (
+                SELECT id FROM pacientes WHERE nombre_norm >= ? AND nombre_norm < ?{filtro_resto}
+                ORDER BY nombre_norm, apellido_norm LIMIT ?
+            ) AS por_nombre
+        )
+        ORDER BY apellido_norm, nombre_norm
+        LIMIT ?
+    """
+    rango = [primera, primera + FIN_PREFIJO]
+    return sql, rango + params_resto + [limite] + rango + params_resto + [limite] + [limite]
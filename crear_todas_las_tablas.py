@@ -64,6 +64,16 @@ def crear_todas_las_tablas():
         """)
         print("✅ Tabla 'pacientes' creada")
         
+        # Columnas normalizadas e índices para la búsqueda de pacientes
+        from busqueda_pacientes import crear_indices_busqueda
+        crear_indices_busqueda(cursor)
+        print("✅ Índices de búsqueda de pacientes creados")
+        
+        # Campos derivados (incompleto, registro_rapido) calculados por SQLite
+        from pacientes_derivados import crear_columnas_derivadas
+        crear_columnas_derivadas(cursor)
+        print("✅ Columnas derivadas de pacientes creadas")
+        
         # Tabla de turnos
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS turnos (
@@ -83,6 +93,15 @@ def crear_todas_las_tablas():
         """)
         print("✅ Tabla 'turnos' creada")
         
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_turnos_estado_fecha ON turnos (estado, fecha_turno, hora_turno)")
+        print("✅ Índice 'idx_turnos_estado_fecha' creado")
+        
+        # Un solo turno activo (no ausente) por médico, fecha y hora. En una base existente con
+        # turnos duplicados el índice no se crea (se informan) y se sigue con el resto de las tablas
+        from actualizar_base_datos import crear_indice_slot
+        if crear_indice_slot(cursor):
+            print("✅ Índice único 'idx_turnos_slot' creado")
+        
         # Tabla de pagos
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS pagos (
@@ -99,6 +118,15 @@ def crear_todas_las_tablas():
         """)
         print("✅ Tabla 'pagos' creada")
         
+        # Búsquedas de recepción/cobro por paciente y fecha
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_turnos_dni_fecha ON turnos (dni_paciente, fecha_turno, hora_turno)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pagos_dni_fecha ON pagos (dni_paciente, fecha_pago)")
+        print("✅ Índices 'idx_turnos_dni_fecha' e 'idx_pagos_dni_fecha' creados")
+        
+        # Tablero del médico: turnos de un médico en un rango de fechas
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_turnos_medico_fecha ON turnos (medico, fecha_turno, hora_turno, estado)")
+        print("✅ Índice 'idx_turnos_medico_fecha' creado")
+        
         # Tabla de agenda
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS agenda (
@@ -113,6 +141,24 @@ def crear_todas_las_tablas():
         """)
         print("✅ Tabla 'agenda' creada")
         
+        # Reglas de agenda recurrentes (rango + intervalo por día de la semana)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS agenda_reglas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                medico TEXT NOT NULL,
+                dia_semana TEXT NOT NULL,
+                hora_inicio TEXT NOT NULL,
+                hora_fin TEXT NOT NULL,
+                intervalo_min INTEGER NOT NULL,
+                vigente_desde TEXT,
+                vigente_hasta TEXT,
+                activo INTEGER DEFAULT 1,
+                fecha_creacion TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_agenda_reglas_medico ON agenda_reglas (medico, dia_semana)")
+        print("✅ Tabla 'agenda_reglas' creada")
+        
         # Tabla de historias clínicas (ya existe)
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS historias_clinicas (
@@ -122,10 +168,17 @@ def crear_todas_las_tablas():
                 fecha_consulta TEXT NOT NULL,
                 medico TEXT NOT NULL,
                 fecha_creacion TEXT NOT NULL,
+                largo_consulta INTEGER,
                 FOREIGN KEY (dni) REFERENCES pacientes (dni)
             )
         """)
         print("✅ Tabla 'historias_clinicas' verificada")
+        # Línea de tiempo del paciente (más recientes primero)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_historias_dni ON historias_clinicas (dni, fecha_consulta)")
+        # Diccionarios de compresión de las consultas (consulta_medica se guarda comprimida)
+        from notas_historias import preparar_historias
+        preparar_historias(cursor)
+        print("✅ Tabla 'historias_diccionarios' creada")
         
         # Tabla de bloqueos de agenda (vacaciones, etc.)
         cursor.execute("""
@@ -142,6 +195,21 @@ def crear_todas_las_tablas():
         """)
         print("✅ Tabla 'bloqueos_agenda' creada")
         
+        # Tablas de archivo (turnos/pagos históricos) y vistas UNION para reportes
+        from archivar_historicos import crear_esquema_archivo
+        crear_esquema_archivo(cursor)
+        print("✅ Tablas 'turnos_archivo'/'pagos_archivo' y vistas 'turnos_todos'/'pagos_todos' creadas")
+        
+        # Cache de reportes de meses cerrados (con triggers de invalidación)
+        from reportes_cache import crear_tabla_reportes_cache
+        crear_tabla_reportes_cache(cursor)
+        print("✅ Tabla 'reportes_cache' creada")
+        
+        # Versiones de las caches en memoria (invalidación entre procesos)
+        from versiones_cache import crear_tabla_versiones
+        crear_tabla_versiones(cursor)
+        print("✅ Tabla 'versiones_cache' creada")
+        
         conn.commit()
         print("\n🎉 Todas las tablas creadas exitosamente!")
         
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Escritor único para SQLite.
+
+Un hilo dedicado recibe comandos de escritura por una cola y los aplica en
+lotes pequeños: un solo BEGIN IMMEDIATE / COMMIT por lote (group commit). Así
+los hilos que atienden requests no compiten entre sí por el lock de escritura;
+las lecturas siguen usando sus propias conexiones.
+
+Cada comando se aplica con la función `aplicar(cur, tipo, datos)`, que debe
+aislarse con un SAVEPOINT para que el fallo de un comando no afecte al resto
+del lote.
+
+Si `ejecutar` se queda sin tiempo, el comando se cancela mientras siga en la
+cola (el escritor lo descarta y se puede reintentar sin duplicarlo); si ya
+empezó a aplicarse se lanza ComandoEnCurso, porque se va a guardar igual.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from typing import Any, Callable, Dict
+
+
+class ComandoEnCurso(Exception):
+    """El comando no terminó a tiempo pero ya se está aplicando: no hay que reintentarlo"""
+
+
+class EscritorUnico:
+    """Hilo escritor con cola de comandos y commit agrupado"""
+
+    def __init__(
+        self,
+        conectar: Callable,
+        aplicar: Callable,
+        lote_max: int = 32,
+        espera_lote_ms: float = 2.0,
+    ):
+        self._conectar = conectar
+        self._aplicar = aplicar
+        self._lote_max = lote_max
+        self._espera_lote = espera_lote_ms / 1000
+        self._cola: "queue.Queue" = queue.Queue()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._stats = {"lotes": 0, "comandos": 0, "lote_max": 0, "espera_lock_max_ms": 0.0, "commit_total_ms": 0.0,
+                       "cancelados": 0}
+
+    def iniciar(self) -> None:
+        """Arrancar el hilo escritor (idempotente)"""
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="escritor-unico", daemon=True)
+                self._hilo.start()
+
+    def enviar(self, tipo: str, datos: Dict[str, Any]) -> Future:
+        """Encolar un comando; el Future se resuelve con el resultado de aplicar()"""
+        self.iniciar()
+        futuro: Future = Future()
+        self._cola.put((futuro, tipo, datos))
+        return futuro
+
+    def ejecutar(self, tipo: str, datos: Dict[str, Any], timeout: float = 30.0) -> Any:
+        """Encolar un comando y esperar su resultado.
+        Sin respuesta en `timeout`: TimeoutError si se canceló antes de aplicarse,
+        ComandoEnCurso si ya se estaba aplicando."""
+        futuro = self.enviar(tipo, datos)
+        try:
+            return futuro.result(timeout=timeout)
+        except FuturesTimeoutError:
+            if futuro.cancel():
+                raise
+            if futuro.done():
+                return futuro.result()
+            raise ComandoEnCurso(tipo)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pendientes"] = self._cola.qsize()
+        stats["comandos_por_lote"] = round(stats["comandos"] / stats["lotes"], 2) if stats["lotes"] else 0
+        return stats
+
+    def _bucle(self) -> None:
+        conn = self._conectar()
+        while True:
+            lote = [self._cola.get()]
+            limite = time.monotonic() + self._espera_lote
+            while len(lote) < self._lote_max:
+                restante = limite - time.monotonic()
+                try:
+                    # Pasado el plazo solo se toman los comandos que ya están en cola
+                    if restante > 0:
+                        lote.append(self._cola.get(timeout=restante))
+                    else:
+                        lote.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            self._procesar(conn, lote)
+
+    def _procesar(self, conn, lote) -> None:
+        # Los comandos cancelados por timeout no se aplican; el resto ya no se puede cancelar
+        vigentes = [comando for comando in lote if comando[0].set_running_or_notify_cancel()]
+        if len(vigentes) < len(lote):
+            with self._lock:
+                self._stats["cancelados"] += len(lote) - len(vigentes)
+        lote = vigentes
+        if not lote:
+            return
+        resultados = []
+        inicio = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            espera_ms = (time.perf_counter() - inicio) * 1000
+            cur = conn.cursor()
+            for futuro, tipo, datos in lote:
+                try:
+                    resultados.append((futuro, self._aplicar(cur, tipo, datos), None))
+                except Exception as e:
+                    resultados.append((futuro, None, e))
+            conn.commit()
+        except Exception as e:
+            # Falló el BEGIN o el COMMIT: ningún comando del lote quedó guardado
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            for futuro, _, _ in lote:
+                futuro.set_exception(e)
+            return
+
+        with self._lock:
+            self._stats["lotes"] += 1
+            self._stats["comandos"] += len(lote)
+            self._stats["lote_max"] = max(self._stats["lote_max"], len(lote))
+            self._stats["espera_lock_max_ms"] = round(max(self._stats["espera_lock_max_ms"], espera_ms), 2)
+            self._stats["commit_total_ms"] = round(self._stats["commit_total_ms"] + (time.perf_counter() - inicio) * 1000, 2)
+        for futuro, resultado, error in resultados:
+            if error is not None:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(resultado)
@@ -3,9 +3,12 @@ import json
 import os
 import shutil
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+from notas_historias import descomprimir, leer_diccionario, valores_nota
+
 
 DB_PATH = os.path.join("data", "consultorio.db")
 
@@ -55,24 +58,36 @@ def coalesce(new_value: Any, current_value: Any) -> Any:
     return new_value
 
 
-def upsert_pacientes(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) -> Tuple[int, int, int]:
-    insertados = 0
-    actualizados = 0
+def normalizar_pacientes(items: Iterable[Dict[str, Any]]) -> Tuple[List[Tuple[str, ...]], int]:
+    """Normalize raw patient dicts into insert-ready tuples.
+
+    Returns (registros, omitidos). Pure function so it can run in a worker process.
+    """
+    registros: List[Tuple[str, ...]] = []
     omitidos = 0
-    cur = conn.cursor()
     for p in items:
         dni = str(p.get("dni", "")).strip()
         if not dni:
             omitidos += 1
             continue
-        cur.execute("SELECT nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular FROM pacientes WHERE dni = ?", (dni,))
-        row = cur.fetchone()
         nombre = (p.get("nombre") or "").strip()
         apellido = (p.get("apellido") or "").strip()
         fecha_nacimiento = (p.get("fecha_nacimiento") or p.get("fechaNacimiento") or "").strip()
         obra_social = (p.get("obra_social") or p.get("obraSocial") or "").strip()
         numero_obra_social = (p.get("numero_obra_social") or p.get("numeroObraSocial") or "").strip()
         celular = (p.get("celular") or p.get("telefono") or "").strip()
+        registros.append((dni, nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular))
+    return registros, omitidos
+
+
+def aplicar_pacientes(conn: sqlite3.Connection, registros: Iterable[Tuple[str, ...]]) -> Tuple[int, int, int]:
+    insertados = 0
+    actualizados = 0
+    omitidos = 0
+    cur = conn.cursor()
+    for dni, nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular in registros:
+        cur.execute("SELECT nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular FROM pacientes WHERE dni = ?", (dni,))
+        row = cur.fetchone()
         if row is None:
             cur.execute(
                 """
@@ -108,22 +123,27 @@ def upsert_pacientes(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]])
     return insertados, actualizados, omitidos
 
 
-def upsert_turnos(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) -> Tuple[int, int, int]:
-    insertados = 0
-    actualizados = 0
-    omitidos = 0
-    cur = conn.cursor()
-    def ensure_patient(dni_val: str):
-        cur.execute("SELECT 1 FROM pacientes WHERE dni=?", (dni_val,))
-        if cur.fetchone() is None:
-            cur.execute(
-                """
-                INSERT INTO pacientes (dni, nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular)
-                VALUES (?, 'Pendiente', 'Pendiente', '', '', '', '')
-                """,
-                (dni_val,),
-            )
+def upsert_pacientes(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) -> Tuple[int, int, int]:
+    registros, omitidos_norm = normalizar_pacientes(items)
+    ins, upd, skip = aplicar_pacientes(conn, registros)
+    return ins, upd, skip + omitidos_norm
+
+
+def _ensure_patient(cur: sqlite3.Cursor, dni_val: str) -> None:
+    cur.execute("SELECT 1 FROM pacientes WHERE dni=?", (dni_val,))
+    if cur.fetchone() is None:
+        cur.execute(
+            """
+            INSERT INTO pacientes (dni, nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular)
+            VALUES (?, 'Pendiente', 'Pendiente', '', '', '', '')
+            """,
+            (dni_val,),
+        )
+
 
+def normalizar_turnos(items: Iterable[Dict[str, Any]]) -> Tuple[List[Tuple[Any, ...]], int]:
+    registros: List[Tuple[Any, ...]] = []
+    omitidos = 0
     for t in items:
         medico = (t.get("medico") or "").strip()
         fecha = (t.get("fecha") or t.get("fecha_turno") or "").strip()
@@ -132,19 +152,32 @@ def upsert_turnos(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) ->
         if not (medico and fecha and hora and dni):
             omitidos += 1
             continue
-        cur.execute(
-            "SELECT id, estado, tipo_consulta, costo, pagado, observaciones FROM turnos WHERE medico=? AND fecha_turno=? AND hora_turno=?",
-            (medico, fecha, hora),
-        )
-        row = cur.fetchone()
         estado = (t.get("estado") or "").strip() or "sin atender"
+        if estado.lower() == "pendiente":
+            # Estado viejo de la agenda: equivale a 'sin atender' (app.ESTADOS_EQUIVALENTES)
+            estado = "sin atender"
         tipo = (t.get("tipo_consulta") or t.get("tipo") or "").strip()
         costo = float(t.get("costo") or t.get("monto") or 0)
         pagado = int(t.get("pagado") or 0)
         obs = (t.get("observaciones") or "").strip()
+        registros.append((medico, fecha, hora, dni, estado, tipo, costo, pagado, obs))
+    return registros, omitidos
+
+
+def aplicar_turnos(conn: sqlite3.Connection, registros: Iterable[Tuple[Any, ...]]) -> Tuple[int, int, int]:
+    insertados = 0
+    actualizados = 0
+    omitidos = 0
+    cur = conn.cursor()
+    for medico, fecha, hora, dni, estado, tipo, costo, pagado, obs in registros:
+        cur.execute(
+            "SELECT id, estado, tipo_consulta, costo, pagado, observaciones FROM turnos WHERE medico=? AND fecha_turno=? AND hora_turno=?",
+            (medico, fecha, hora),
+        )
+        row = cur.fetchone()
         if row is None:
             # asegurar paciente
-            ensure_patient(dni)
+            _ensure_patient(cur, dni)
             cur.execute(
                 """
                 INSERT INTO turnos (medico, hora_turno, fecha_turno, dni_paciente, estado, tipo_consulta, costo, pagado, observaciones)
@@ -167,22 +200,15 @@ def upsert_turnos(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) ->
     return insertados, actualizados, omitidos
 
 
-def upsert_pagos(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) -> Tuple[int, int, int]:
-    insertados = 0
-    actualizados = 0
-    omitidos = 0
-    cur = conn.cursor()
-    def ensure_patient(dni_val: str):
-        cur.execute("SELECT 1 FROM pacientes WHERE dni=?", (dni_val,))
-        if cur.fetchone() is None:
-            cur.execute(
-                """
-                INSERT INTO pacientes (dni, nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular)
-                VALUES (?, 'Pendiente', 'Pendiente', '', '', '', '')
-                """,
-                (dni_val,),
-            )
+def upsert_turnos(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) -> Tuple[int, int, int]:
+    registros, omitidos_norm = normalizar_turnos(items)
+    ins, upd, skip = aplicar_turnos(conn, registros)
+    return ins, upd, skip + omitidos_norm
 
+
+def normalizar_pagos(items: Iterable[Dict[str, Any]]) -> Tuple[List[Tuple[Any, ...]], int]:
+    registros: List[Tuple[Any, ...]] = []
+    omitidos = 0
     for p in items:
         dni = str(p.get("dni_paciente") or p.get("dni") or "").strip()
         fecha = (p.get("fecha") or p.get("fecha_pago") or "").strip()
@@ -191,16 +217,26 @@ def upsert_pagos(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) -> T
         if not (dni and fecha and metodo):
             omitidos += 1
             continue
+        obra_social = (p.get("obra_social") or "").strip()
+        observaciones = (p.get("observaciones") or "").strip()
+        registros.append((dni, fecha, monto, metodo, obra_social, observaciones))
+    return registros, omitidos
+
+
+def aplicar_pagos(conn: sqlite3.Connection, registros: Iterable[Tuple[Any, ...]]) -> Tuple[int, int, int]:
+    insertados = 0
+    actualizados = 0
+    omitidos = 0
+    cur = conn.cursor()
+    for dni, fecha, monto, metodo, obra_social, observaciones in registros:
         cur.execute(
             "SELECT id, obra_social, observaciones FROM pagos WHERE dni_paciente=? AND fecha_pago=? AND metodo_pago=? AND ABS(monto - ?) < 1e-6",
             (dni, fecha, metodo, monto),
         )
         row = cur.fetchone()
-        obra_social = (p.get("obra_social") or "").strip()
-        observaciones = (p.get("observaciones") or "").strip()
         if row is None:
             # asegurar paciente
-            ensure_patient(dni)
+            _ensure_patient(cur, dni)
             cur.execute(
                 """
                 INSERT INTO pagos (dni_paciente, monto, fecha_pago, metodo_pago, obra_social, observaciones, fecha_creacion)
@@ -220,11 +256,15 @@ def upsert_pagos(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) -> T
     return insertados, actualizados, omitidos
 
 
-def upsert_historias(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) -> Tuple[int, int, int]:
-    insertados = 0
-    actualizados = 0
+def upsert_pagos(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) -> Tuple[int, int, int]:
+    registros, omitidos_norm = normalizar_pagos(items)
+    ins, upd, skip = aplicar_pagos(conn, registros)
+    return ins, upd, skip + omitidos_norm
+
+
+def normalizar_historias(items: Iterable[Dict[str, Any]]) -> Tuple[List[Tuple[str, ...]], int]:
+    registros: List[Tuple[str, ...]] = []
     omitidos = 0
-    cur = conn.cursor()
     for h in items:
         dni = str(h.get("dni") or "").strip()
         medico = (h.get("medico") or "").strip()
@@ -232,27 +272,42 @@ def upsert_historias(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]])
         if not (dni and medico and fecha):
             omitidos += 1
             continue
+        consulta = (h.get("consulta_medica") or h.get("consulta") or "").strip()
+        registros.append((dni, medico, fecha, consulta))
+    return registros, omitidos
+
+
+def aplicar_historias(conn: sqlite3.Connection, registros: Iterable[Tuple[str, ...]]) -> Tuple[int, int, int]:
+    insertados = 0
+    actualizados = 0
+    omitidos = 0
+    cur = conn.cursor()
+    leer = lambda version: leer_diccionario(conn.cursor(), version)
+    for dni, medico, fecha, consulta in registros:
         cur.execute(
             "SELECT consulta_medica FROM historias_clinicas WHERE dni=? AND medico=? AND fecha_consulta=?",
             (dni, medico, fecha),
         )
         row = cur.fetchone()
-        consulta = (h.get("consulta_medica") or h.get("consulta") or "").strip()
         if row is None:
+            valor, largo = valores_nota(cur, consulta)
             cur.execute(
                 """
-                INSERT INTO historias_clinicas (dni, consulta_medica, medico, fecha_consulta, fecha_creacion)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO historias_clinicas
+                    (dni, consulta_medica, medico, fecha_consulta, fecha_creacion, largo_consulta)
+                VALUES (?, ?, ?, ?, ?, ?)
                 """,
-                (dni, consulta, medico, fecha, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+                (dni, valor, medico, fecha, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), largo),
             )
             insertados += 1
         else:
-            consulta_db = row[0]
+            # La consulta guardada puede estar comprimida (notas_historias)
+            consulta_db = descomprimir(row[0], leer)
             if consulta and consulta != consulta_db:
+                valor, largo = valores_nota(cur, consulta)
                 cur.execute(
-                    "UPDATE historias_clinicas SET consulta_medica=? WHERE dni=? AND medico=? AND fecha_consulta=?",
-                    (consulta, dni, medico, fecha),
+                    "UPDATE historias_clinicas SET consulta_medica=?, largo_consulta=? WHERE dni=? AND medico=? AND fecha_consulta=?",
+                    (valor, largo, dni, medico, fecha),
                 )
                 actualizados += 1
             else:
@@ -260,6 +315,35 @@ def upsert_historias(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]])
     return insertados, actualizados, omitidos
 
 
+def upsert_historias(conn: sqlite3.Connection, items: Iterable[Dict[str, Any]]) -> Tuple[int, int, int]:
+    registros, omitidos_norm = normalizar_historias(items)
+    ins, upd, skip = aplicar_historias(conn, registros)
+    return ins, upd, skip + omitidos_norm
+
+
+# Orden de escritura: pacientes primero porque turnos/pagos/historias los referencian
+TABLAS_IMPORTACION = ("pacientes", "turnos", "pagos", "historias_clinicas")
+
+NORMALIZADORES = {
+    "pacientes": normalizar_pacientes,
+    "turnos": normalizar_turnos,
+    "pagos": normalizar_pagos,
+    "historias_clinicas": normalizar_historias,
+}
+
+APLICADORES = {
+    "pacientes": aplicar_pacientes,
+    "turnos": aplicar_turnos,
+    "pagos": aplicar_pagos,
+    "historias_clinicas": aplicar_historias,
+}
+
+
+def parse_file(tabla: str, path: str) -> Tuple[List[Tuple[Any, ...]], int]:
+    """Load and normalize one JSON file. Runs inside a worker process."""
+    return NORMALIZADORES[tabla](load_json(path))
+
+
 def _find_json_by_keywords(directory: str, keywords: List[str]) -> Optional[str]:
     try:
         for name in os.listdir(directory):
@@ -273,42 +357,59 @@ def _find_json_by_keywords(directory: str, keywords: List[str]) -> Optional[str]
     return None
 
 
-def import_dir(conn: sqlite3.Connection, directory: str) -> None:
+def _find_import_files(directory: str) -> Dict[str, str]:
+    archivos: Dict[str, str] = {}
+    # pacientes: admite nombres como 'pacientes (1).json'
+    archivos["pacientes"] = _find_json_by_keywords(directory, ["paciente"]) or os.path.join(directory, "pacientes.json")
+    # turnos: admite 'turnos (1).json'
+    archivos["turnos"] = _find_json_by_keywords(directory, ["turno"]) or os.path.join(directory, "turnos.json")
+    # pagos: admite 'pagos (2).json'
+    archivos["pagos"] = _find_json_by_keywords(directory, ["pago"]) or os.path.join(directory, "pagos.json")
+    # historias: admite 'historias_clinicas (1).json' o 'historias.json'
+    archivos["historias_clinicas"] = (
+        _find_json_by_keywords(directory, ["historia", "clinica"]) or
+        _find_json_by_keywords(directory, ["historia"]) or
+        os.path.join(directory, "historias.json")
+    )
+    return {tabla: path for tabla, path in archivos.items() if os.path.exists(path)}
+
+
+def import_dir(conn: sqlite3.Connection, directory: str, workers: Optional[int] = None) -> None:
+    """Import every JSON found in ``directory``.
+
+    Parsing and normalization of each file run in a process pool; this process is
+    the only writer and applies the results in dependency order inside a single
+    transaction, so SQLite writes stay serialized.
+    """
+    archivos = _find_import_files(directory)
     summary: List[Tuple[str, Tuple[int, int, int]]] = []
-    conn.execute("BEGIN")
-    try:
-        # pacientes: admite nombres como 'pacientes (1).json'
-        path_pac = _find_json_by_keywords(directory, ["paciente"]) or os.path.join(directory, "pacientes.json")
-        if os.path.exists(path_pac):
-            res = upsert_pacientes(conn, load_json(path_pac))
-            summary.append(("pacientes", res))
-
-        # turnos: admite 'turnos (1).json'
-        path_tur = _find_json_by_keywords(directory, ["turno"]) or os.path.join(directory, "turnos.json")
-        if os.path.exists(path_tur):
-            res = upsert_turnos(conn, load_json(path_tur))
-            summary.append(("turnos", res))
-
-        # pagos: admite 'pagos (2).json'
-        path_pag = _find_json_by_keywords(directory, ["pago"]) or os.path.join(directory, "pagos.json")
-        if os.path.exists(path_pag):
-            res = upsert_pagos(conn, load_json(path_pag))
-            summary.append(("pagos", res))
-
-        # historias: admite 'historias_clinicas (1).json' o 'historias.json'
-        path_hist = (
-            _find_json_by_keywords(directory, ["historia", "clinica"]) or
-            _find_json_by_keywords(directory, ["historia"]) or
-            os.path.join(directory, "historias.json")
-        )
-        if os.path.exists(path_hist):
-            res = upsert_historias(conn, load_json(path_hist))
-            summary.append(("historias_clinicas", res))
+    if workers is None:
+        workers = min(len(archivos), os.cpu_count() or 1)
 
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(archivos) > 1 else None
+    try:
+        futuros = {}
+        if pool:
+            futuros = {tabla: pool.submit(parse_file, tabla, path) for tabla, path in archivos.items()}
+
+        conn.execute("BEGIN")
+        try:
+            for tabla in TABLAS_IMPORTACION:
+                if tabla not in archivos:
+                    continue
+                if tabla in futuros:
+                    registros, omitidos_norm = futuros[tabla].result()
+                else:
+                    registros, omitidos_norm = parse_file(tabla, archivos[tabla])
+                ins, upd, skip = APLICADORES[tabla](conn, registros)
+                summary.append((tabla, (ins, upd, skip + omitidos_norm)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
 
     print("Resumen de importación (insertados, actualizados, omitidos):")
     for tabla, (ins, upd, skip) in summary:
@@ -320,6 +421,7 @@ def main():
     parser.add_argument("--dir", default="import", help="Directorio con JSONs (pacientes.json, turnos.json, pagos.json, historias.json)")
     parser.add_argument("--db", default=DB_PATH, help="Ruta a la base SQLite")
     parser.add_argument("--no-backup", action="store_true", help="No crear backup antes de importar")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos para parsear JSON en paralelo (1 = secuencial)")
     args = parser.parse_args()
 
     if not args.no_backup:
@@ -330,7 +432,7 @@ def main():
     os.makedirs(os.path.dirname(args.db), exist_ok=True)
     conn = connect(args.db)
     try:
-        import_dir(conn, args.dir)
+        import_dir(conn, args.dir, workers=args.workers)
     finally:
         conn.close()
 
@@ -1,41 +1,148 @@
-import json
-import shutil
+#!/usr/bin/env python3
+"""
+Limpieza de turnos vencidos 'sin atender' directamente sobre la base de datos.
+
+Borra (o archiva en 'turnos_archivo') en lotes acotados para no retener el
+lock de escritura de SQLite durante mucho tiempo. Se usa desde la consola y
+desde el endpoint /api/turnos/limpiar-vencidos.
+"""
+
+import argparse
+import sqlite3
+import time
 from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+DB_PATH = "data/consultorio.db"
+
+COLUMNAS_TURNO = (
+    "id, dni_paciente, medico, fecha_turno, hora_turno, estado, "
+    "tipo_consulta, costo, pagado, observaciones, fecha_creacion"
+)
+
+# Usa idx_turnos_estado_fecha: rango sobre fecha_turno y el día límite se refina por hora
+CONDICION_VENCIDO = (
+    "estado = 'sin atender' AND fecha_turno <= ? "
+    "AND (fecha_turno < ? OR hora_turno < ?)"
+)
+
+
+def _limite(horas: int, ahora: Optional[datetime] = None):
+    limite = (ahora or datetime.now()) - timedelta(hours=horas)
+    fecha = limite.strftime("%Y-%m-%d")
+    return fecha, fecha, limite.strftime("%H:%M")
 
-ARCHIVO_TURNOS = "data/turnos.json"
-BACKUP = "turnos_backup.json"
 
-# Hacer backup
-shutil.copy2(ARCHIVO_TURNOS, BACKUP)
-print(f"Backup creado: {BACKUP}")
+def limpiar_turnos_vencidos(
+    conn: sqlite3.Connection,
+    horas: int = 24,
+    lote: int = 500,
+    dry_run: bool = False,
+    archivar: bool = False,
+    ahora: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Eliminar turnos 'sin atender' vencidos hace más de `horas` horas.
 
-with open(ARCHIVO_TURNOS, "r", encoding="utf-8") as f:
-    turnos = json.load(f)
+    Cada lote es una transacción IMMEDIATE independiente de a lo sumo `lote` filas.
+    Devuelve un resumen con cantidades y tiempos.
+    """
+    params = _limite(horas, ahora)
+    inicio = time.perf_counter()
+    cur = conn.cursor()
 
-ahora = datetime.now()
-turnos_filtrados = []
-eliminados = []
+    if dry_run:
+        cur.execute(f"SELECT COUNT(*) FROM turnos WHERE {CONDICION_VENCIDO}", params)
+        total = cur.fetchone()[0]
+        cur.execute(
+            f"""
+            SELECT id, fecha_turno, hora_turno, medico, dni_paciente, estado
+            FROM turnos WHERE {CONDICION_VENCIDO}
+            ORDER BY fecha_turno, hora_turno
+            LIMIT 50
+            """,
+            params,
+        )
+        muestra = [
+            {"id": r[0], "fecha": r[1], "hora": r[2], "medico": r[3], "dni_paciente": r[4], "estado": r[5]}
+            for r in cur.fetchall()
+        ]
+        return {
+            "dry_run": True,
+            "eliminados": 0,
+            "a_eliminar": total,
+            "muestra": muestra,
+            "fecha_limite": f"{params[0]} {params[2]}",
+            "duracion_ms": round((time.perf_counter() - inicio) * 1000, 1),
+        }
 
-for t in turnos:
-    fecha_hora_str = f"{t.get('fecha', '')} {t.get('hora', '00:00')}"
+    subconsulta = f"SELECT id FROM turnos WHERE {CONDICION_VENCIDO} ORDER BY id LIMIT ?"
+    eliminados = 0
+    lotes = 0
+    tiempos_lote = []
+    while True:
+        t_lote = time.perf_counter()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            if archivar:
+                cur.execute(
+                    f"""
+                    INSERT INTO turnos_archivo ({COLUMNAS_TURNO})
+                    SELECT {COLUMNAS_TURNO} FROM turnos WHERE id IN ({subconsulta})
+                    """,
+                    params + (lote,),
+                )
+            cur.execute(f"DELETE FROM turnos WHERE id IN ({subconsulta})", params + (lote,))
+            borrados = cur.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        tiempos_lote.append((time.perf_counter() - t_lote) * 1000)
+        if borrados <= 0:
+            break
+        eliminados += borrados
+        lotes += 1
+        if borrados < lote:
+            break
+
+    return {
+        "dry_run": False,
+        "eliminados": eliminados,
+        "archivados": eliminados if archivar else 0,
+        "lotes": lotes,
+        "fecha_limite": f"{params[0]} {params[2]}",
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 1),
+        "lote_max_ms": round(max(tiempos_lote), 1) if tiempos_lote else 0,
+        "lote_promedio_ms": round(sum(tiempos_lote) / len(tiempos_lote), 1) if tiempos_lote else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Eliminar turnos 'sin atender' vencidos de la base de datos")
+    parser.add_argument("--db", default=DB_PATH, help="Ruta a la base SQLite")
+    parser.add_argument("--horas", type=int, default=24, help="Antigüedad mínima en horas (default 24)")
+    parser.add_argument("--lote", type=int, default=500, help="Filas por lote/transacción")
+    parser.add_argument("--dry-run", action="store_true", help="Solo informar qué se eliminaría")
+    parser.add_argument("--archivar", action="store_true", help="Copiar a 'turnos_archivo' antes de borrar")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=30.0)
+    conn.execute("PRAGMA busy_timeout=30000")
     try:
-        fecha_hora = datetime.strptime(fecha_hora_str, "%Y-%m-%d %H:%M")
-    except Exception:
-        turnos_filtrados.append(t)
-        continue
-    # Si está vencido hace más de 24hs y es 'sin atender', eliminar
-    if t.get('estado', '').lower() == 'sin atender' and fecha_hora < ahora - timedelta(hours=24):
-        eliminados.append(t)
-    else:
-        turnos_filtrados.append(t)
+        res = limpiar_turnos_vencidos(conn, args.horas, args.lote, args.dry_run, args.archivar)
+    finally:
+        conn.close()
 
-with open(ARCHIVO_TURNOS, "w", encoding="utf-8") as f:
-    json.dump(turnos_filtrados, f, indent=2, ensure_ascii=False)
+    print(f"Fecha límite: {res['fecha_limite']}")
+    if res["dry_run"]:
+        print(f"[DRY RUN] Turnos a eliminar: {res['a_eliminar']}")
+        for t in res["muestra"]:
+            print(f"- {t['fecha']} {t['hora']} | {t['medico']} | {t['dni_paciente']} | {t['estado']}")
+    else:
+        accion = "archivados y eliminados" if args.archivar else "eliminados"
+        print(f"Turnos {accion}: {res['eliminados']} en {res['lotes']} lote(s)")
+        print(f"Tiempo total: {res['duracion_ms']} ms (lote máx {res['lote_max_ms']} ms, promedio {res['lote_promedio_ms']} ms)")
 
-print(f"Turnos eliminados: {len(eliminados)}")
-if eliminados:
-    for t in eliminados:
-        print(f"- {t.get('fecha')} {t.get('hora')} | {t.get('medico')} | {t.get('dni_paciente')} | {t.get('estado')}")
-else:
-    print("No se eliminaron turnos.")
 
+if __name__ == "__main__":
+    main()
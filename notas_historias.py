@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Compresión de las consultas de historias_clinicas.
+
+`consulta_medica` se guarda como BLOB comprimido con zlib (deflate crudo) y un
+diccionario compartido, entrenado con las mismas notas y guardado en la tabla
+`historias_diccionarios`:
+
+    b"HC" + versión del diccionario (1 byte) + datos deflate
+
+La versión 0 es deflate sin diccionario. Las filas viejas en TEXT se siguen
+leyendo tal cual, y una nota que no se achica al comprimirla se guarda como
+texto. `largo_consulta` guarda el largo del texto; la línea de tiempo
+descomprime solo el comienzo de cada nota (`inicio_nota`) y la nota entera se
+descomprime únicamente cuando se pide (`descomprimir`).
+
+Los diccionarios no se modifican ni se borran (las filas guardan su versión);
+entrenar uno nuevo agrega una versión y `--comprimir` pasa las notas a la
+vigente.
+
+Uso:
+    python notas_historias.py                       # estado de la compresión
+    python notas_historias.py --entrenar            # nuevo diccionario con una muestra de notas
+    python notas_historias.py --comprimir --vacuum  # comprimir las notas y compactar la base
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import zlib
+from collections import Counter
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+DB_PATH = "data/consultorio.db"
+
+MAGIA = b"HC"
+TAMANO_DICCIONARIO = 32 * 1024  # ventana de deflate: no aprovecha más
+NIVEL = 9
+MUESTRA_ENTRENAMIENTO = 1000
+
+SQL_CREAR_TABLA = """
+    CREATE TABLE IF NOT EXISTS historias_diccionarios (
+        version INTEGER PRIMARY KEY,
+        diccionario BLOB NOT NULL,
+        muestras INTEGER NOT NULL,
+        fecha_creacion TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Diccionarios por versión: no cambian una vez guardados, así que se cachean sin TTL
+_diccionarios = {}
+_diccionarios_lock = threading.Lock()
+
+
+def preparar_historias(cursor) -> List[str]:
+    """Crear la tabla de diccionarios y la columna largo_consulta si faltan, completando
+    el largo de las filas en texto. Devuelve los cambios hechos"""
+    cambios = []
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='historias_diccionarios'")
+    if not cursor.fetchone():
+        cursor.execute(SQL_CREAR_TABLA)
+        cambios.append("Tabla 'historias_diccionarios' creada")
+    cursor.execute("PRAGMA table_info(historias_clinicas)")
+    columnas = {row[1] for row in cursor.fetchall()}
+    if "largo_consulta" not in columnas:
+        cursor.execute("ALTER TABLE historias_clinicas ADD COLUMN largo_consulta INTEGER")
+        cambios.append("Columna 'largo_consulta' agregada a 'historias_clinicas'")
+    cursor.execute(
+        """
+        UPDATE historias_clinicas SET largo_consulta = length(consulta_medica)
+        WHERE largo_consulta IS NULL AND typeof(consulta_medica) = 'text'
+        """
+    )
+    if cursor.rowcount > 0:
+        cambios.append(f"Largo de {cursor.rowcount} consultas completado")
+    return cambios
+
+
+def entrenar_diccionario(textos: Iterable[str], tamano: int = TAMANO_DICCIONARIO) -> bytes:
+    """Diccionario con las frases (de 1 a 5 palabras) que aparecen en más notas,
+    priorizadas por notas x largo. Deflate aprovecha mejor el final del
+    diccionario (distancias más cortas), así que las más valiosas van últimas."""
+    frecuencia = Counter()
+    for texto in textos:
+        palabras = texto.split()
+        frases = set()
+        for n in range(1, 6):
+            for i in range(len(palabras) - n + 1):
+                frase = " ".join(palabras[i:i + n])
+                if len(frase) >= 4:
+                    frases.add(frase)
+        frecuencia.update(frases)
+
+    candidatas = sorted(
+        ((veces * len(frase.encode("utf-8")), frase) for frase, veces in frecuencia.items() if veces >= 2),
+        reverse=True,
+    )
+    elegidas = []
+    acumulado = ""
+    usados = 0
+    for _, frase in candidatas:
+        if frase in acumulado:
+            continue
+        largo = len(frase.encode("utf-8")) + 1
+        if usados + largo > tamano:
+            continue
+        elegidas.append(frase)
+        acumulado += frase + " "
+        usados += largo
+        if usados >= tamano - 4:
+            break
+    return " ".join(reversed(elegidas)).encode("utf-8")
+
+
+def guardar_diccionario(cursor, diccionario: bytes, muestras: int) -> int:
+    """Guardar un diccionario como nueva versión (1 a 255). Devuelve la versión"""
+    cursor.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM historias_diccionarios")
+    version = cursor.fetchone()[0]
+    if version > 255:
+        raise ValueError("No hay más versiones de diccionario disponibles (máximo 255)")
+    cursor.execute(
+        "INSERT INTO historias_diccionarios (version, diccionario, muestras) VALUES (?, ?, ?)",
+        (version, diccionario, muestras),
+    )
+    return version
+
+
+def diccionario(version: int, leer: Callable[[int], bytes]) -> bytes:
+    """Diccionario de una versión (b"" para la 0), leído con `leer(version)` la primera vez"""
+    if version == 0:
+        return b""
+    with _diccionarios_lock:
+        datos = _diccionarios.get(version)
+    if datos is None:
+        datos = bytes(leer(version))
+        with _diccionarios_lock:
+            _diccionarios[version] = datos
+    return datos
+
+
+def leer_diccionario(cursor, version: int) -> bytes:
+    cursor.execute("SELECT diccionario FROM historias_diccionarios WHERE version = ?", (version,))
+    row = cursor.fetchone()
+    if not row:
+        raise LookupError(f"Falta el diccionario de historias versión {version}")
+    return row[0]
+
+
+def version_vigente(cursor) -> int:
+    """Última versión de diccionario (0 si todavía no se entrenó ninguno)"""
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM historias_diccionarios")
+    return cursor.fetchone()[0]
+
+
+def comprimir(texto: str, version: int = 0, zdict: bytes = b"") -> bytes:
+    if zdict:
+        compresor = zlib.compressobj(NIVEL, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compresor = zlib.compressobj(NIVEL, zlib.DEFLATED, -15)
+    return MAGIA + bytes([version]) + compresor.compress(texto.encode("utf-8")) + compresor.flush()
+
+
+def version_de(valor) -> Optional[int]:
+    """Versión de diccionario de una nota comprimida, o None si está en texto"""
+    if isinstance(valor, (bytes, bytearray, memoryview)) and bytes(valor[:2]) == MAGIA:
+        return valor[2]
+    return None
+
+
+def _descompresor(datos: bytes, leer: Callable[[int], bytes]):
+    zdict = diccionario(datos[2], leer)
+    if zdict:
+        return zlib.decompressobj(-15, zdict=zdict)
+    return zlib.decompressobj(-15)
+
+
+def descomprimir(valor: Union[str, bytes, memoryview, None], leer: Callable[[int], bytes]) -> Optional[str]:
+    """Texto de una nota tal como está guardada (TEXT viejo o BLOB comprimido)"""
+    if valor is None or isinstance(valor, str):
+        return valor
+    datos = bytes(valor)
+    if datos[:2] != MAGIA:
+        return datos.decode("utf-8")
+    descompresor = _descompresor(datos, leer)
+    return (descompresor.decompress(datos[3:]) + descompresor.flush()).decode("utf-8")
+
+
+def inicio_nota(valor: Union[str, bytes, memoryview, None], caracteres: int, leer: Callable[[int], bytes]) -> str:
+    """Los primeros `caracteres` de una nota, descomprimiendo solo lo necesario"""
+    if valor is None or isinstance(valor, str):
+        return (valor or "")[:caracteres]
+    datos = bytes(valor)
+    if datos[:2] != MAGIA:
+        return datos.decode("utf-8")[:caracteres]
+    # Hasta 4 bytes por carácter en UTF-8; un carácter cortado al final se descarta
+    inicio = _descompresor(datos, leer).decompress(datos[3:], caracteres * 4)
+    return inicio.decode("utf-8", errors="ignore")[:caracteres]
+
+
+def valores_nota(cursor, texto: str) -> Tuple[Union[str, bytes], int]:
+    """(consulta_medica, largo_consulta) para guardar una nota, comprimida con el
+    diccionario vigente si así ocupa menos"""
+    version = version_vigente(cursor)
+    comprimida = comprimir(texto, version, diccionario(version, lambda v: leer_diccionario(cursor, v)))
+    valor = comprimida if len(comprimida) < len(texto.encode("utf-8")) else texto
+    return valor, len(texto)
+
+
+def comprimir_existentes(conn, lote: int = 500) -> Tuple[int, int, int]:
+    """Pasar a la versión vigente las notas en texto o con otro diccionario, de a `lote`
+    por transacción. Devuelve (notas reescritas, bytes antes, bytes después)"""
+    cursor = conn.cursor()
+    version = version_vigente(cursor)
+    leer = lambda v: leer_diccionario(conn.cursor(), v)
+    reescritas = antes = despues = 0
+    ultimo_id = 0
+    while True:
+        cursor.execute(
+            "SELECT id, consulta_medica FROM historias_clinicas WHERE id > ? ORDER BY id LIMIT ?",
+            (ultimo_id, lote),
+        )
+        filas = cursor.fetchall()
+        if not filas:
+            break
+        cambios = []
+        for historia_id, valor in filas:
+            if valor is None or version_de(valor) == version:
+                continue
+            texto = descomprimir(valor, leer)
+            nuevo, largo = valores_nota(cursor, texto)
+            if nuevo == valor:
+                continue
+            antes += len(valor.encode("utf-8") if isinstance(valor, str) else valor)
+            despues += len(nuevo.encode("utf-8") if isinstance(nuevo, str) else nuevo)
+            cambios.append((nuevo, largo, historia_id))
+        if cambios:
+            cursor.executemany(
+                "UPDATE historias_clinicas SET consulta_medica = ?, largo_consulta = ? WHERE id = ?",
+                cambios,
+            )
+            conn.commit()
+            reescritas += len(cambios)
+        ultimo_id = filas[-1][0]
+    return reescritas, antes, despues
+
+
+def muestra_notas(cursor, cantidad: int = MUESTRA_ENTRENAMIENTO) -> List[str]:
+    """Notas al azar para entrenar un diccionario (descomprimidas si hace falta)"""
+    cursor.execute(
+        "SELECT consulta_medica FROM historias_clinicas WHERE consulta_medica IS NOT NULL ORDER BY random() LIMIT ?",
+        (cantidad,),
+    )
+    filas = cursor.fetchall()
+    leer = lambda v: leer_diccionario(cursor, v)
+    return [descomprimir(valor, leer) for (valor,) in filas]
+
+
+def mb(valor):
+    return f"{valor / 1024 / 1024:.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compresión de las notas de historias clínicas")
+    parser.add_argument("--entrenar", action="store_true", help="Entrenar un diccionario nuevo con una muestra de notas")
+    parser.add_argument("--muestra", type=int, default=MUESTRA_ENTRENAMIENTO, help="Notas para entrenar")
+    parser.add_argument("--comprimir", action="store_true", help="Comprimir las notas con el diccionario vigente")
+    parser.add_argument("--vacuum", action="store_true", help="Compactar la base al terminar (VACUUM)")
+    parser.add_argument("--db", default=DB_PATH, help="Ruta de la base de datos")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        cursor = conn.cursor()
+        for cambio in preparar_historias(cursor):
+            print(f"✅ {cambio}")
+        conn.commit()
+
+        if args.entrenar:
+            notas = muestra_notas(cursor, args.muestra)
+            if len(notas) < 10:
+                print(f"⚠️ Solo hay {len(notas)} notas: no alcanza para entrenar un diccionario")
+            else:
+                version = guardar_diccionario(cursor, entrenar_diccionario(notas), len(notas))
+                conn.commit()
+                print(f"📚 Diccionario versión {version} entrenado con {len(notas)} notas")
+
+        if args.comprimir:
+            reescritas, antes, despues = comprimir_existentes(conn)
+            print(f"🗜️  {reescritas} notas comprimidas: {mb(antes)} -> {mb(despues)}")
+
+        if args.vacuum:
+            tamano = os.path.getsize(args.db)
+            conn.execute("VACUUM")
+            print(f"🧹 VACUUM: {mb(tamano)} -> {mb(os.path.getsize(args.db))}")
+
+        cursor.execute(
+            """
+            SELECT COUNT(*), SUM(typeof(consulta_medica) = 'blob'), SUM(length(CAST(consulta_medica AS BLOB))),
+                   SUM(largo_consulta)
+            FROM historias_clinicas
+            """
+        )
+        total, comprimidas, bytes_guardados, caracteres = cursor.fetchone()
+        print(f"📊 Diccionario vigente: versión {version_vigente(cursor)}")
+        print(f"📊 {total} notas, {comprimidas or 0} comprimidas; {mb(bytes_guardados or 0)} guardados "
+              f"para {caracteres or 0} caracteres de texto")
+        print(f"📊 Base de datos: {mb(os.path.getsize(args.db))}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Campos derivados de `pacientes` calculados por SQLite.
+
+- `incompleto` y `registro_rapido` son columnas generadas (VIRTUAL): la base las
+  mantiene en cualquier INSERT/UPDATE, y `incompleto` tiene un índice parcial
+  para contar o listar los pacientes con datos pendientes sin recorrer la tabla.
+- `edad` depende del día de hoy, así que no puede ser una columna generada: es
+  la expresión SQL_EDAD, que se agrega a los SELECT. Usa la diferencia de fechas
+  como enteros AAAAMMDD dividida por 10000 (años cumplidos); una fecha vacía o
+  que no tenga formato AAAA-MM-DD da 0, igual que antes.
+
+Así listar y armar reportes no parsea fechas en Python por cada paciente.
+"""
+
+from typing import List
+
+SQL_INCOMPLETO = (
+    "(nombre IS 'Pendiente' OR apellido IS 'Pendiente' "
+    "OR coalesce(fecha_nacimiento, '') = '' OR coalesce(obra_social, '') = '' "
+    "OR coalesce(celular, '') = '')"
+)
+SQL_REGISTRO_RAPIDO = (
+    "(coalesce(email, '') != '' AND (nombre IS 'Pendiente' OR apellido IS 'Pendiente'))"
+)
+SQL_EDAD = (
+    "CASE WHEN date(fecha_nacimiento) = fecha_nacimiento THEN "
+    "(CAST(strftime('%Y%m%d', 'now', 'localtime') AS INTEGER) "
+    "- CAST(replace(fecha_nacimiento, '-', '') AS INTEGER)) / 10000 "
+    "ELSE 0 END"
+)
+
+
+def crear_columnas_derivadas(cursor) -> List[str]:
+    """Agregar las columnas generadas y el índice de incompletos si faltan. Devuelve los cambios hechos"""
+    cambios = []
+    cursor.execute("PRAGMA table_xinfo(pacientes)")
+    columnas = {col[1] for col in cursor.fetchall()}
+    for columna, expresion in (("incompleto", SQL_INCOMPLETO), ("registro_rapido", SQL_REGISTRO_RAPIDO)):
+        if columna not in columnas:
+            cursor.execute(
+                f"ALTER TABLE pacientes ADD COLUMN {columna} INTEGER "
+                f"GENERATED ALWAYS AS {expresion} VIRTUAL"
+            )
+            cambios.append(f"Columna '{columna}' agregada a 'pacientes'")
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_pacientes_incompleto'")
+    if not cursor.fetchone():
+        cursor.execute("CREATE INDEX idx_pacientes_incompleto ON pacientes (incompleto) WHERE incompleto = 1")
+        cambios.append("Índice 'idx_pacientes_incompleto' creado")
+    return cambios
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga simple para la API pública (requests/segundo y latencias).
+
+Sirve para comparar el despliegue sync (gunicorn app:app) contra la entrada
+ASGI (uvicorn app_publico:app). Solo usa la librería estándar.
+
+Uso:
+    python prueba_carga_publico.py --url http://localhost:5000 --requests 2000 --concurrencia 50
+    python prueba_carga_publico.py --url http://localhost:8001 --ruta "/api/public/medicos?especialidad=Clinica"
+"""
+
+import argparse
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def hacer_request(url):
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return status, (time.perf_counter() - inicio) * 1000
+
+
+def prueba_carga(url, total, concurrencia):
+    """Lanzar `total` GET contra `url` con `concurrencia` clientes simultáneos"""
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        resultados = list(pool.map(hacer_request, [url] * total))
+    duracion = time.perf_counter() - inicio
+
+    latencias = sorted(ms for _, ms in resultados)
+    por_status = {}
+    for status, _ in resultados:
+        por_status[status] = por_status.get(status, 0) + 1
+    return {
+        "requests": total,
+        "duracion_s": round(duracion, 2),
+        "req_por_segundo": round(total / duracion, 1) if duracion else 0,
+        "p50_ms": round(statistics.median(latencias), 1),
+        "p95_ms": round(latencias[int(len(latencias) * 0.95) - 1], 1),
+        "max_ms": round(latencias[-1], 1),
+        "por_status": por_status,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API pública")
+    parser.add_argument("--url", default="http://localhost:5000", help="URL base del servidor")
+    parser.add_argument("--ruta", default="/api/public/especialidades", help="Ruta a consultar")
+    parser.add_argument("--requests", type=int, default=1000, help="Cantidad total de requests")
+    parser.add_argument("--concurrencia", type=int, default=50, help="Clientes simultáneos")
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/") + args.ruta
+    print(f"🔥 {args.requests} requests a {url} con concurrencia {args.concurrencia}...")
+    res = prueba_carga(url, args.requests, args.concurrencia)
+    print(f"   Duración: {res['duracion_s']} s")
+    print(f"   Requests/segundo: {res['req_por_segundo']}")
+    print(f"   Latencia p50: {res['p50_ms']} ms | p95: {res['p95_ms']} ms | máx: {res['max_ms']} ms")
+    print(f"   Respuestas por status: {res['por_status']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Prueba de estrés de la reserva pública: muchos pacientes reservan los mismos
+horarios al mismo tiempo y se verifica que no quede ningún horario con dos
+turnos activos.
+
+Trabaja sobre una base temporal (no toca data/consultorio.db) y llama
+directamente a servicio_reservar_turno desde varios hilos, cada uno con su
+propia conexión SQLite. Sale con código 1 si detecta una doble reserva.
+
+Uso:
+    python prueba_concurrencia_reservas.py --hilos 64 --rondas 20 --horarios 4
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+DIAS_ES = ["LUNES", "MARTES", "MIERCOLES", "JUEVES", "VIERNES", "SABADO", "DOMINGO"]
+
+
+def preparar_base(horarios):
+    """Crear el esquema en un directorio temporal con un médico y su agenda"""
+    directorio = tempfile.mkdtemp(prefix="reservas_")
+    os.chdir(directorio)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        from crear_todas_las_tablas import crear_todas_las_tablas
+        crear_todas_las_tablas()
+
+    conn = sqlite3.connect("data/consultorio.db")
+    conn.execute(
+        "INSERT INTO usuarios (usuario, contrasena, rol, especialidad, activo) VALUES ('medico_prueba', '-', 'medico', 'Clinica', 1)"
+    )
+    conn.executemany(
+        "INSERT INTO agenda (medico, dia_semana, horario, activo) VALUES ('medico_prueba', ?, ?, 1)",
+        [(dia, hora) for dia in DIAS_ES for hora in horarios],
+    )
+    conn.commit()
+    conn.close()
+    return directorio
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de concurrencia de reservas públicas")
+    parser.add_argument("--hilos", type=int, default=64, help="Pacientes reservando a la vez por ronda")
+    parser.add_argument("--rondas", type=int, default=20, help="Cantidad de rondas (una fecha por ronda)")
+    parser.add_argument("--horarios", type=int, default=4, help="Horarios en disputa por ronda")
+    args = parser.parse_args()
+
+    horarios = [f"{8 + i // 4:02d}:{(i % 4) * 15:02d}" for i in range(args.horarios)]
+    directorio = preparar_base(horarios)
+    print(f"📁 Base temporal: {directorio}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as appmod
+    # Sin emails reales durante la prueba
+    appmod.enviar_email_confirmacion = lambda *a, **k: False
+
+    resultados = {}
+    lock = threading.Lock()
+    inicio = time.perf_counter()
+
+    for ronda in range(args.rondas):
+        fecha = (date.today() + timedelta(days=ronda + 1)).isoformat()
+        barrera = threading.Barrier(args.hilos)
+
+        def reservar(n):
+            data = {
+                "dni": str(10000000 + ronda * args.hilos + n),
+                "email": f"paciente{n}@example.com",
+                "medico": "medico_prueba",
+                "fecha": fecha,
+                "hora": horarios[n % len(horarios)],
+            }
+            barrera.wait()
+            _, status = appmod.servicio_reservar_turno(data)
+            with lock:
+                resultados[status] = resultados.get(status, 0) + 1
+
+        hilos = [threading.Thread(target=reservar, args=(n,)) for n in range(args.hilos)]
+        # Silenciar los logs de la app mientras corren los hilos
+        with contextlib.redirect_stdout(io.StringIO()):
+            for h in hilos:
+                h.start()
+            for h in hilos:
+                h.join()
+
+    duracion = time.perf_counter() - inicio
+    total = args.hilos * args.rondas
+
+    conn = sqlite3.connect("data/consultorio.db")
+    duplicados = conn.execute("""
+        SELECT medico, fecha_turno, hora_turno, COUNT(*)
+        FROM turnos WHERE estado != 'ausente'
+        GROUP BY medico, fecha_turno, hora_turno
+        HAVING COUNT(*) > 1
+    """).fetchall()
+    reservados = conn.execute("SELECT COUNT(*) FROM turnos").fetchone()[0]
+    conn.close()
+
+    esperados = args.rondas * min(args.horarios, args.hilos)
+    print(f"   Intentos: {total} en {duracion:.2f} s ({total / duracion:.0f} reservas/s)")
+    print(f"   Respuestas por status: {resultados}")
+    print(f"   Turnos creados: {reservados} (esperados {esperados})")
+    if duplicados or reservados != esperados:
+        print(f"❌ Doble reserva detectada: {duplicados[:10]}")
+        sys.exit(1)
+    print("✅ Sin dobles reservas")
+
+
+if __name__ == "__main__":
+    main()
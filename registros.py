@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Registros livianos para las filas que devuelven los cargadores de app.py.
+
+Cada clase usa `__slots__` (sin `__dict__` por instancia) y se construye con la
+fila tal cual sale de SQLite, en el orden de su `SELECT`. Los campos de
+compatibilidad que esperan las plantillas (`pago_registrado`, `monto_pagado`,
+`tipo_pago`, `fecha_registro`, `hora`, ...) son propiedades: no ocupan memoria
+por fila y se calculan solo al serializar.
+
+Los registros aceptan `registro.get("campo")` y `registro["campo"]` como un
+dict, así el código que ya filtraba u ordenaba listas de dicts sigue igual.
+
+`a_json(registros)` escribe el JSON de la lista directamente desde los slots,
+con una plantilla por clase, sin armar un dict intermedio por fila.
+"""
+
+import json
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter
+from typing import Any, Dict, Iterable
+
+
+def _json_numero(valor) -> str:
+    # float.__repr__ como json, pero NaN/Infinity no son JSON válido para el navegador
+    texto = repr(valor)
+    return texto if valor == valor and texto not in ("inf", "-inf") else "null"
+
+
+class _Codificadores(dict):
+    """Tipo -> función que devuelve el JSON del valor; otros tipos pasan por json.dumps"""
+
+    def __missing__(self, tipo):
+        return lambda valor: json.dumps(valor, default=str)
+
+
+_CODIFICADORES = _Codificadores({
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    float: _json_numero,
+    bool: lambda valor: "true" if valor else "false",
+    type(None): lambda valor: "null",
+})
+
+
+class Registro:
+    """Base de los registros: acceso tipo dict y serialización a JSON"""
+
+    __slots__ = ()
+    # Campos extra (propiedades) que se agregan al JSON después de los slots
+    COMPATIBILIDAD = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.CAMPOS_JSON = tuple(cls.__slots__) + tuple(cls.COMPATIBILIDAD)
+        # attrgetter no es un descriptor: se llama como self._valores(self)
+        cls._valores = attrgetter(*cls.CAMPOS_JSON)
+        cls._plantilla = "{" + ",".join(
+            encode_basestring_ascii(campo).replace("%", "%%") + ":%s" for campo in cls.CAMPOS_JSON
+        ) + "}"
+
+    @classmethod
+    def fabrica(cls):
+        """row_factory de sqlite3 que devuelve instancias de la clase"""
+        return lambda cursor, fila: cls(*fila)
+
+    def get(self, campo: str, defecto: Any = None) -> Any:
+        if campo in self.CAMPOS_JSON:
+            return getattr(self, campo)
+        return defecto
+
+    def __getitem__(self, campo: str) -> Any:
+        if campo not in self.CAMPOS_JSON:
+            raise KeyError(campo)
+        return getattr(self, campo)
+
+    def __contains__(self, campo: str) -> bool:
+        return campo in self.CAMPOS_JSON
+
+    def a_dict(self) -> Dict[str, Any]:
+        return dict(zip(self.CAMPOS_JSON, self._valores(self)))
+
+    def json(self) -> str:
+        codificadores = _CODIFICADORES
+        return self._plantilla % tuple(codificadores[type(v)](v) for v in self._valores(self))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.a_dict()!r})"
+
+
+def a_json(registros: Iterable[Registro]) -> str:
+    """Lista JSON de registros (de una o varias clases)"""
+    return "[" + ",".join(registro.json() for registro in registros) + "]"
+
+
+class Turno(Registro):
+    __slots__ = ("id", "medico", "hora_turno", "fecha_turno", "dni_paciente", "estado",
+                 "tipo_consulta", "costo", "pagado", "observaciones")
+    COMPATIBILIDAD = ("pago_registrado", "monto_pagado")
+
+    def __init__(self, id, medico, hora_turno, fecha_turno, dni_paciente, estado,
+                 tipo_consulta, costo, pagado, observaciones):
+        self.id = id
+        self.medico = medico
+        self.hora_turno = hora_turno
+        self.fecha_turno = fecha_turno
+        self.dni_paciente = str(dni_paciente or "")
+        self.estado = estado
+        self.tipo_consulta = tipo_consulta
+        self.costo = costo
+        self.pagado = pagado
+        self.observaciones = observaciones
+
+    @property
+    def pago_registrado(self) -> bool:
+        return bool(self.pagado)
+
+    @property
+    def monto_pagado(self) -> float:
+        return float(self.costo or 0)
+
+
+class Paciente(Registro):
+    __slots__ = ("dni", "nombre", "apellido", "fecha_nacimiento", "obra_social", "numero_obra_social",
+                 "celular", "email", "edad", "incompleto", "registro_rapido")
+
+    def __init__(self, dni, nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social,
+                 celular, email, edad, incompleto, registro_rapido):
+        self.dni = dni
+        self.nombre = nombre
+        self.apellido = apellido
+        self.fecha_nacimiento = fecha_nacimiento
+        self.obra_social = obra_social
+        self.numero_obra_social = numero_obra_social
+        self.celular = celular
+        self.email = email
+        self.edad = edad
+        self.incompleto = bool(incompleto)
+        self.registro_rapido = bool(registro_rapido)
+
+
+class Pago(Registro):
+    __slots__ = ("id", "dni_paciente", "monto", "fecha", "metodo_pago", "obra_social",
+                 "observaciones", "fecha_creacion", "nombre_paciente")
+    COMPATIBILIDAD = ("hora", "fecha_registro", "tipo_pago")
+
+    def __init__(self, id, dni_paciente, monto, fecha, metodo_pago, obra_social,
+                 observaciones, fecha_creacion, nombre_paciente=""):
+        self.id = id
+        self.dni_paciente = str(dni_paciente or "")
+        self.monto = float(monto or 0)
+        self.fecha = fecha
+        self.metodo_pago = metodo_pago
+        self.obra_social = obra_social
+        self.observaciones = observaciones
+        self.fecha_creacion = fecha_creacion
+        self.nombre_paciente = nombre_paciente
+
+    @property
+    def hora(self) -> str:
+        return ""
+
+    @property
+    def fecha_registro(self):
+        return self.fecha_creacion
+
+    @property
+    def tipo_pago(self):
+        return self.metodo_pago
+
+
+class Historia(Registro):
+    __slots__ = ("id", "dni", "consulta_medica", "medico", "fecha_consulta", "fecha_creacion", "especialidad")
+
+    def __init__(self, id, dni, consulta_medica, medico, fecha_consulta, fecha_creacion, especialidad):
+        self.id = id
+        self.dni = str(dni or "")
+        self.consulta_medica = consulta_medica
+        self.medico = medico
+        self.fecha_consulta = fecha_consulta
+        self.fecha_creacion = fecha_creacion
+        self.especialidad = especialidad
+
+
+class ResumenHistoria(Registro):
+    __slots__ = ("id", "dni", "fecha_consulta", "medico", "especialidad", "resumen", "largo")
+    COMPATIBILIDAD = ("completa",)
+
+    def __init__(self, id, dni, fecha_consulta, medico, especialidad, resumen, largo):
+        self.id = id
+        self.dni = str(dni or "")
+        self.fecha_consulta = fecha_consulta
+        self.medico = medico
+        self.especialidad = especialidad
+        self.resumen = resumen or ""
+        self.largo = largo or 0
+
+    @property
+    def completa(self) -> bool:
+        """True si `resumen` ya es el texto entero de la consulta"""
+        return len(self.resumen) >= self.largo
+
+
+class Usuario(Registro):
+    __slots__ = ("id", "usuario", "contrasena", "rol", "nombre_completo", "email", "telefono",
+                 "especialidad", "activo", "fecha_creacion")
+
+    def __init__(self, id, usuario, contrasena, rol, nombre_completo, email, telefono,
+                 especialidad, activo, fecha_creacion):
+        self.id = id
+        self.usuario = usuario
+        self.contrasena = contrasena
+        self.rol = rol
+        self.nombre_completo = nombre_completo
+        self.email = email
+        self.telefono = telefono
+        self.especialidad = especialidad
+        self.activo = activo
+        self.fecha_creacion = fecha_creacion
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Cache persistente de reportes para períodos cerrados.
+
+Los reportes por rango de fechas (turnos, ocupación, ingresos del mes) se
+calculan por mes: el rango se parte en tramos mensuales y cada tramo que cae
+entero en un mes ya terminado se guarda en la tabla `reportes_cache`, con
+clave (reporte, parámetros). Solo el mes en curso (o posterior) se recalcula
+en cada pedido.
+
+Un mes cerrado normalmente no cambia, pero si cambia la base lo sabe: los
+triggers de este módulo borran las entradas afectadas cuando se inserta,
+modifica o elimina un turno o un pago con fecha en un mes cerrado, cuando
+cambia la agenda (ocupación) y cuando se crea, renombra o elimina un paciente
+(nombres en el detalle de ingresos). Así cualquier escritura, también la de
+los scripts, deja la cache consistente.
+
+Por eso un tramo que se guarda se calcula siempre sobre la base principal, en
+la misma transacción de lectura que la cache (nunca sobre el snapshot de
+reportes, que puede ser anterior a la invalidación): si otra conexión escribe
+mientras se calcula, el guardado falla y el resultado no se cachea.
+
+Uso (vaciar la cache a mano):
+    python reportes_cache.py --vaciar
+    python reportes_cache.py --vaciar --reporte ocupacion
+"""
+
+import argparse
+import json
+import sqlite3
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DB_PATH = "data/consultorio.db"
+
+SQL_CREAR_TABLA = """
+    CREATE TABLE IF NOT EXISTS reportes_cache (
+        reporte TEXT NOT NULL,
+        parametros TEXT NOT NULL,
+        fecha_inicio TEXT NOT NULL,
+        fecha_fin TEXT NOT NULL,
+        resultado TEXT NOT NULL,
+        fecha_creacion TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (reporte, parametros)
+    )
+"""
+
+# Primer día del mes en curso: las filas con fecha anterior pertenecen a meses cerrados
+SQL_INICIO_MES = "date('now', 'localtime', 'start of month')"
+
+# tabla -> (columna de fecha, reportes que la leen)
+TABLAS_CON_FECHA = {
+    "turnos": ("fecha_turno", ("turnos", "ocupacion")),
+    "pagos": ("fecha_pago", ("pagos_mes",)),
+}
+
+
+def _lista_sql(reportes) -> str:
+    return ", ".join(f"'{reporte}'" for reporte in reportes)
+
+
+def _sql_triggers() -> List[Tuple[str, str]]:
+    """(nombre, CREATE TRIGGER) de los triggers que invalidan la cache"""
+    triggers = []
+    for tabla, (columna, reportes) in TABLAS_CON_FECHA.items():
+        for evento, filas in (("INSERT", ("NEW",)), ("UPDATE", ("OLD", "NEW")), ("DELETE", ("OLD",))):
+            nombre = f"reportes_cache_{tabla}_{evento.lower()}"
+            cuando = " OR ".join(f"{fila}.{columna} < {SQL_INICIO_MES}" for fila in filas)
+            en_rango = " OR ".join(f"{fila}.{columna} BETWEEN fecha_inicio AND fecha_fin" for fila in filas)
+            triggers.append((nombre, f"""
+                CREATE TRIGGER IF NOT EXISTS {nombre} AFTER {evento} ON {tabla}
+                WHEN {cuando}
+                BEGIN
+                    DELETE FROM reportes_cache
+                    WHERE reporte IN ({_lista_sql(reportes)}) AND ({en_rango});
+                END
+            """))
+    # La ocupación de meses cerrados se calcula con la agenda vigente
+    for tabla in ("agenda", "agenda_reglas"):
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            nombre = f"reportes_cache_{tabla}_{evento.lower()}"
+            triggers.append((nombre, f"""
+                CREATE TRIGGER IF NOT EXISTS {nombre} AFTER {evento} ON {tabla}
+                BEGIN
+                    DELETE FROM reportes_cache WHERE reporte = 'ocupacion';
+                END
+            """))
+    # El detalle de ingresos muestra el nombre actual del paciente (vacío si todavía no existe)
+    for nombre, evento in (("reportes_cache_pacientes_insert", "INSERT"),
+                           ("reportes_cache_pacientes_update", "UPDATE OF nombre, apellido"),
+                           ("reportes_cache_pacientes_delete", "DELETE")):
+        triggers.append((nombre, f"""
+            CREATE TRIGGER IF NOT EXISTS {nombre} AFTER {evento} ON pacientes
+            BEGIN
+                DELETE FROM reportes_cache WHERE reporte = 'pagos_mes';
+            END
+        """))
+    return triggers
+
+
+def crear_tabla_reportes_cache(cursor) -> List[str]:
+    """Crear la tabla y los triggers de invalidación si faltan. Devuelve los cambios hechos"""
+    cambios = []
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name LIKE 'reportes_cache%'")
+    existentes = {row[0] for row in cursor.fetchall()}
+    if "reportes_cache" not in existentes:
+        cursor.execute(SQL_CREAR_TABLA)
+        cambios.append("Tabla 'reportes_cache' creada")
+    faltantes = [(nombre, sql) for nombre, sql in _sql_triggers() if nombre not in existentes]
+    for _, sql in faltantes:
+        cursor.execute(sql)
+    if faltantes:
+        cambios.append(f"{len(faltantes)} triggers de invalidación de 'reportes_cache' creados")
+    return cambios
+
+
+def periodo_cerrado(fecha_fin: str, hoy: Optional[date] = None) -> bool:
+    """True si `fecha_fin` es de un mes anterior al actual"""
+    hoy = hoy or date.today()
+    return fecha_fin < hoy.replace(day=1).isoformat()
+
+
+def rango_mes(mes: str) -> Tuple[str, str]:
+    """('AAAA-MM-01', último día) de un mes 'AAAA-MM'; ValueError si el formato no es válido"""
+    inicio = datetime.strptime(mes, "%Y-%m").date()
+    siguiente = (inicio + timedelta(days=32)).replace(day=1)
+    return inicio.isoformat(), (siguiente - timedelta(days=1)).isoformat()
+
+
+def tramos_mensuales(fecha_inicio: str, fecha_fin: str) -> List[Tuple[str, str]]:
+    """Partir [fecha_inicio, fecha_fin] en tramos que no cruzan de mes.
+    Un rango invertido se devuelve tal cual, como único tramo."""
+    inicio = datetime.strptime(fecha_inicio, "%Y-%m-%d").date()
+    fin = datetime.strptime(fecha_fin, "%Y-%m-%d").date()
+    if inicio > fin:
+        return [(fecha_inicio, fecha_fin)]
+    tramos = []
+    while inicio <= fin:
+        fin_mes = (inicio.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        tramos.append((inicio.isoformat(), min(fin_mes, fin).isoformat()))
+        inicio = fin_mes + timedelta(days=1)
+    return tramos
+
+
+def _clave(parametros: Dict[str, Any]) -> str:
+    return json.dumps(parametros, sort_keys=True, ensure_ascii=False)
+
+
+def leer(cursor, reporte: str, parametros: Dict[str, Any]) -> Optional[Any]:
+    cursor.execute(
+        "SELECT resultado FROM reportes_cache WHERE reporte = ? AND parametros = ?",
+        (reporte, _clave(parametros)),
+    )
+    row = cursor.fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def guardar(cursor, reporte: str, parametros: Dict[str, Any], fecha_inicio: str, fecha_fin: str, resultado: Any):
+    cursor.execute(
+        """
+        INSERT OR REPLACE INTO reportes_cache (reporte, parametros, fecha_inicio, fecha_fin, resultado)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (reporte, _clave(parametros), fecha_inicio, fecha_fin, json.dumps(resultado, ensure_ascii=False)),
+    )
+
+
+def vaciar(cursor, reporte: Optional[str] = None) -> int:
+    """Borrar las entradas (de un reporte o todas). Devuelve cuántas había"""
+    if reporte:
+        cursor.execute("DELETE FROM reportes_cache WHERE reporte = ?", (reporte,))
+    else:
+        cursor.execute("DELETE FROM reportes_cache")
+    return cursor.rowcount
+
+
+def calcular_y_guardar(conn, reporte: str, clave: Dict[str, Any], inicio: str, fin: str,
+                       calcular: Callable[[Any, str, str], Any]) -> Any:
+    """Resultado de un tramo cerrado: de la cache o calculado con `conn` y guardado.
+
+    Lectura, cálculo y guardado van en una sola transacción (en WAL, una misma
+    instantánea de la base). Si otra conexión escribió desde que empezó, SQLite
+    no deja pasarla a escritura: el resultado se devuelve sin guardarlo, porque
+    puede ser anterior a la invalidación de los triggers."""
+    resultado = None
+    conn.execute("BEGIN")
+    try:
+        resultado = leer(conn.cursor(), reporte, clave)
+        if resultado is None:
+            resultado = calcular(conn.cursor(), inicio, fin)
+            guardar(conn.cursor(), reporte, clave, inicio, fin, resultado)
+            print(f"DEBUG: Reporte '{reporte}' {inicio} a {fin} guardado en cache")
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        if resultado is None:
+            raise
+        print(f"DEBUG: Reporte '{reporte}' {inicio} a {fin} no se guarda en cache (la base cambió: {e})")
+    return resultado
+
+
+def resultados_por_mes(conectar: Callable, reporte: str, fecha_inicio: str, fecha_fin: str,
+                       calcular: Callable[[Any, str, str], Any], parametros: Optional[Dict[str, Any]] = None,
+                       hoy: Optional[date] = None) -> List[Any]:
+    """Resultado parcial de cada tramo mensual del rango, en orden.
+
+    `calcular(cursor, inicio, fin)` calcula un tramo (debe devolver algo
+    serializable a JSON). Los tramos de meses cerrados se leen de la cache o se
+    calculan con un cursor de `conectar()` (la base principal, que tiene la
+    tabla reportes_cache) y se guardan; el resto se calcula con cursor=None y el
+    llamador elige la conexión (por ejemplo, el snapshot de reportes)."""
+    tramos = tramos_mensuales(fecha_inicio, fecha_fin)
+    resultados = []
+    conn = None
+    try:
+        for inicio, fin in tramos:
+            if inicio > fin or not periodo_cerrado(fin, hoy):
+                resultados.append(calcular(None, inicio, fin))
+                continue
+            if conn is None:
+                conn = conectar()
+            clave = dict(parametros or {}, fecha_inicio=inicio, fecha_fin=fin)
+            resultados.append(calcular_y_guardar(conn, reporte, clave, inicio, fin, calcular))
+    finally:
+        if conn:
+            conn.close()
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache de reportes de períodos cerrados")
+    parser.add_argument("--vaciar", action="store_true", help="Borrar las entradas de la cache")
+    parser.add_argument("--reporte", help="Solo este reporte (turnos, ocupacion, pagos_mes)")
+    parser.add_argument("--db", default=DB_PATH, help="Ruta de la base de datos")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        cursor = conn.cursor()
+        if args.vaciar:
+            borradas = vaciar(cursor, args.reporte)
+            conn.commit()
+            print(f"🗑️  {borradas} entradas borradas de reportes_cache")
+        else:
+            cursor.execute("SELECT reporte, COUNT(*), MIN(fecha_inicio), MAX(fecha_fin) FROM reportes_cache GROUP BY reporte")
+            for reporte, cantidad, desde, hasta in cursor.fetchall():
+                print(f"📊 {reporte}: {cantidad} entradas ({desde} a {hasta})")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Capa de acceso a datos: un repositorio por entidad sobre un backend intercambiable.
+
+Los repositorios (TurnoRepo, PacienteRepo, PagoRepo, AgendaRepo, HistoriaRepo)
+concentran el SQL de lectura que antes estaba repetido en las rutas de app.py
+y devuelven registros de registros.py. El SQL se escribe con parámetros `?`;
+cada backend lo adapta a su driver.
+
+Backends (variable de entorno DB_BACKEND):
+
+- sqlite (por defecto): una conexión por hilo que se reutiliza entre requests,
+  así la caché de sentencias preparadas de sqlite3 (`cached_statements`) no se
+  pierde al cerrar la conexión en cada request.
+- postgresql: pool de conexiones de psycopg2 (DATABASE_URL, DB_POOL_MIN,
+  DB_POOL_MAX). psycopg2 es opcional: solo se importa al elegir este backend.
+  `ESQUEMA_POSTGRES` crea las tablas que leen los repositorios.
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+from busqueda_pacientes import REEMPLAZOS, consulta_busqueda
+from notas_historias import descomprimir, inicio_nota
+from pacientes_derivados import SQL_EDAD
+from registros import Historia, Paciente, Pago, ResumenHistoria, Turno
+
+# edad, incompleto y registro_rapido: en SQLite son columnas generadas / SQL_EDAD
+# (ver pacientes_derivados.py); en PostgreSQL, columnas generadas de ESQUEMA_POSTGRES
+_FECHA_ISO_PG = r"'^[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])$'"
+EDAD_PACIENTE = {
+    "sqlite": SQL_EDAD,
+    "postgresql": (
+        f"CASE WHEN fecha_nacimiento ~ {_FECHA_ISO_PG} THEN "
+        "(to_char(current_date, 'YYYYMMDD')::int - replace(fecha_nacimiento, '-', '')::int) / 10000 "
+        "ELSE 0 END"
+    ),
+}
+COLUMNAS_PACIENTE = {
+    dialecto: (
+        "dni, nombre, apellido, fecha_nacimiento, obra_social, numero_obra_social, celular, email, "
+        f"{edad} AS edad, incompleto, registro_rapido"
+    )
+    for dialecto, edad in EDAD_PACIENTE.items()
+}
+
+COLUMNAS_REGLA = ("dia_semana", "hora_inicio", "hora_fin", "intervalo_min", "vigente_desde", "vigente_hasta")
+
+CACHED_STATEMENTS = int(os.environ.get("DB_CACHED_STATEMENTS", 256))
+
+
+class BackendSQLite:
+    """Lecturas sobre SQLite con una conexión persistente por hilo"""
+
+    dialecto = "sqlite"
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=10000",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA busy_timeout=30000",
+    )
+
+    def __init__(self, ruta: Union[str, Callable[[], str]], cached_statements: int = CACHED_STATEMENTS):
+        # `ruta` puede ser una función (get_db_path) para respetar RENDER_DISK_PATH
+        self._ruta = ruta
+        self._cached_statements = cached_statements
+        self._local = threading.local()
+
+    def _conexion(self) -> sqlite3.Connection:
+        ruta = os.path.abspath(self._ruta() if callable(self._ruta) else self._ruta)
+        conexiones = self._local.__dict__.setdefault("conexiones", {})
+        conn = conexiones.get(ruta)
+        if conn is None:
+            conn = sqlite3.connect(ruta, timeout=30.0, cached_statements=self._cached_statements)
+            for pragma in self.PRAGMAS:
+                conn.execute(pragma)
+            conexiones[ruta] = conn
+        return conn
+
+    def consultar(self, sql: str, parametros: Sequence = (), fabrica=None) -> List[Any]:
+        """Filas de `sql`; con `fabrica` (Registro.fabrica()) devuelve registros"""
+        cur = self._conexion().cursor()
+        try:
+            if fabrica:
+                cur.row_factory = fabrica
+            return cur.execute(sql, parametros).fetchall()
+        finally:
+            cur.close()
+
+    def ejecutar_script(self, sql: str) -> None:
+        self._conexion().executescript(sql)
+
+    def cerrar(self) -> None:
+        """Cerrar las conexiones del hilo actual"""
+        for conn in self._local.__dict__.pop("conexiones", {}).values():
+            conn.close()
+
+
+class BackendPostgres:
+    """Lecturas sobre PostgreSQL con un pool de conexiones (psycopg2)"""
+
+    dialecto = "postgresql"
+
+    def __init__(self, dsn: str, minimo: int = 1, maximo: int = 10):
+        try:
+            from psycopg2.pool import ThreadedConnectionPool
+        except ImportError as e:
+            raise RuntimeError("DB_BACKEND=postgresql requiere psycopg2 (pip install psycopg2-binary)") from e
+        self._pool = ThreadedConnectionPool(minimo, maximo, dsn)
+
+    @staticmethod
+    def _sql(sql: str) -> str:
+        # Parámetros `?` -> `%s`; los `%` literales se escapan para psycopg2
+        return sql.replace("%", "%%").replace("?", "%s")
+
+    def consultar(self, sql: str, parametros: Sequence = (), fabrica=None) -> List[Any]:
+        conn = self._pool.getconn()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(self._sql(sql), tuple(parametros))
+                filas = cur.fetchall()
+        finally:
+            self._pool.putconn(conn)
+        if fabrica:
+            return [fabrica(None, fila) for fila in filas]
+        return filas
+
+    def ejecutar_script(self, sql: str) -> None:
+        conn = self._pool.getconn()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(sql)
+        finally:
+            self._pool.putconn(conn)
+
+    def cerrar(self) -> None:
+        self._pool.closeall()
+
+
+def crear_backend(ruta_sqlite: Union[str, Callable[[], str]]):
+    """Backend según DB_BACKEND (sqlite por defecto)"""
+    tipo = os.environ.get("DB_BACKEND", "sqlite").strip().lower()
+    if tipo == "sqlite":
+        return BackendSQLite(ruta_sqlite)
+    if tipo in ("postgresql", "postgres"):
+        dsn = os.environ.get("DATABASE_URL", "")
+        if not dsn:
+            raise RuntimeError("DB_BACKEND=postgresql requiere DATABASE_URL")
+        return BackendPostgres(
+            dsn,
+            minimo=int(os.environ.get("DB_POOL_MIN", 1)),
+            maximo=int(os.environ.get("DB_POOL_MAX", 10)),
+        )
+    raise RuntimeError(f"DB_BACKEND desconocido: '{tipo}' (usar sqlite o postgresql)")
+
+
+class Repositorio:
+    def __init__(self, backend):
+        self.backend = backend
+
+
+class TurnoRepo(Repositorio):
+    COLUMNAS = ("id, medico, hora_turno, fecha_turno, dni_paciente, estado, "
+                "tipo_consulta, costo, pagado, observaciones")
+
+    def listar(self) -> List[Turno]:
+        return self.backend.consultar(
+            f"SELECT {self.COLUMNAS} FROM turnos ORDER BY fecha_turno DESC, hora_turno ASC",
+            fabrica=Turno.fabrica(),
+        )
+
+    def por_id(self, turno_id: int) -> Optional[Turno]:
+        filas = self.backend.consultar(
+            f"SELECT {self.COLUMNAS} FROM turnos WHERE id = ?", (turno_id,), fabrica=Turno.fabrica()
+        )
+        return filas[0] if filas else None
+
+    # Turnos de un médico con los datos del paciente (tablero del día y vista histórica)
+    CAMPOS_MEDICO = ("id", "dni_paciente", "medico", "fecha", "hora", "estado", "tipo_consulta", "costo",
+                     "pagado", "observaciones", "fecha_creacion", "nombre", "apellido", "celular",
+                     "obra_social", "edad")
+    SELECT_MEDICO = """
+        SELECT t.id, t.dni_paciente, t.medico, t.fecha_turno, t.hora_turno, coalesce(t.estado, 'sin atender'),
+               t.tipo_consulta, t.costo, t.pagado, t.observaciones, t.fecha_creacion,
+               p.nombre, p.apellido, p.celular, p.obra_social, {edad}
+        FROM turnos t
+        LEFT JOIN pacientes p ON p.dni = t.dni_paciente
+        WHERE t.medico = ? AND t.fecha_turno BETWEEN ? AND ?
+    """
+
+    def del_medico(self, medico: str, desde: str, hasta: str, estados: Sequence[str] = (),
+                   despues: Optional[Sequence] = None, limite: int = 200) -> List[Dict[str, Any]]:
+        """Turnos del médico entre `desde` y `hasta` ordenados por (fecha, hora, id), como dicts
+        con CAMPOS_MEDICO. `despues` = (fecha, hora, id) del último turno de la página anterior."""
+        sql = self.SELECT_MEDICO.format(edad=f"CASE WHEN p.dni IS NULL THEN NULL ELSE {EDAD_PACIENTE[self.backend.dialecto]} END")
+        parametros: List[Any] = [medico, desde, hasta]
+        if estados:
+            sql += f" AND coalesce(t.estado, 'sin atender') IN ({', '.join('?' * len(estados))})"
+            parametros.extend(estados)
+        if despues:
+            sql += " AND (t.fecha_turno, t.hora_turno, t.id) > (?, ?, ?)"
+            parametros.extend(despues)
+        sql += " ORDER BY t.fecha_turno, t.hora_turno, t.id LIMIT ?"
+        parametros.append(limite)
+        campos = self.CAMPOS_MEDICO
+        return self.backend.consultar(sql, parametros, fabrica=lambda cursor, fila: dict(zip(campos, fila)))
+
+    def contar_por_estado(self, medico: str, desde: str, hasta: str) -> Dict[str, int]:
+        """{estado: cantidad} de los turnos del médico entre `desde` y `hasta`"""
+        return dict(self.backend.consultar(
+            """
+            SELECT coalesce(estado, 'sin atender') AS estado_turno, COUNT(*)
+            FROM turnos
+            WHERE medico = ? AND fecha_turno BETWEEN ? AND ?
+            GROUP BY estado_turno
+            """,
+            (medico, desde, hasta),
+        ))
+
+
+class PacienteRepo(Repositorio):
+    @property
+    def columnas(self) -> str:
+        return COLUMNAS_PACIENTE[self.backend.dialecto]
+
+    def listar(self) -> List[Paciente]:
+        return self.backend.consultar(f"SELECT {self.columnas} FROM pacientes", fabrica=Paciente.fabrica())
+
+    def por_dni(self, dni: str) -> Optional[Paciente]:
+        filas = self.backend.consultar(
+            f"SELECT {self.columnas} FROM pacientes WHERE dni = ?", (dni,), fabrica=Paciente.fabrica()
+        )
+        return filas[0] if filas else None
+
+    def buscar(self, q: str, limite: int) -> List[Paciente]:
+        consulta = consulta_busqueda(q, self.columnas, limite)
+        if consulta is None:
+            return []
+        return self.backend.consultar(*consulta, fabrica=Paciente.fabrica())
+
+
+class PagoRepo(Repositorio):
+    def listar(self) -> List[Pago]:
+        return self.backend.consultar(
+            "SELECT id, dni_paciente, monto, fecha_pago, metodo_pago, obra_social, observaciones, fecha_creacion "
+            "FROM pagos ORDER BY id",
+            fabrica=Pago.fabrica(),
+        )
+
+
+class AgendaRepo(Repositorio):
+    def listar(self) -> Dict[str, Dict[str, List[str]]]:
+        """Horarios fijos por médico y día: {medico: {DIA: [horas ordenadas]}}"""
+        agenda: Dict[str, Dict[str, List[str]]] = {}
+        for medico, dia, hora in self.backend.consultar(
+            "SELECT medico, dia_semana, horario FROM agenda ORDER BY medico, dia_semana, horario"
+        ):
+            agenda.setdefault(medico, {}).setdefault(dia.upper(), []).append(hora)
+        return agenda
+
+    def reglas_del_dia(self, dia_semana: str) -> Dict[str, List[Dict[str, Any]]]:
+        """Reglas activas de todos los médicos para un día de la semana: {medico: [regla]}"""
+        reglas: Dict[str, List[Dict[str, Any]]] = {}
+        for fila in self.backend.consultar(
+            f"SELECT medico, {', '.join(COLUMNAS_REGLA)} FROM agenda_reglas WHERE dia_semana = ? AND activo = 1",
+            (dia_semana,),
+        ):
+            reglas.setdefault(fila[0], []).append(dict(zip(COLUMNAS_REGLA, fila[1:])))
+        return reglas
+
+
+class HistoriaRepo(Repositorio):
+    # Especialidad del médico con un JOIN en lugar de un dict armado aparte
+    SELECT = """
+        SELECT h.id, h.dni, h.consulta_medica, h.medico, h.fecha_consulta, h.fecha_creacion, u.especialidad
+        FROM historias_clinicas h
+        LEFT JOIN usuarios u ON u.usuario = h.medico AND u.rol = 'medico'
+    """
+    SIN_ESPECIALIDAD = "Sin especialidad"
+
+    def _diccionario(self, version: int) -> bytes:
+        filas = self.backend.consultar("SELECT diccionario FROM historias_diccionarios WHERE version = ?", (version,))
+        if not filas:
+            raise LookupError(f"Falta el diccionario de historias versión {version}")
+        return filas[0][0]
+
+    def _con_texto(self, historias: List[Historia]) -> List[Historia]:
+        """Descomprimir consulta_medica (ver notas_historias.py); las filas en texto quedan igual"""
+        for historia in historias:
+            historia.consulta_medica = descomprimir(historia.consulta_medica, self._diccionario)
+        return historias
+
+    def listar(self) -> List[Historia]:
+        return self._con_texto(self.backend.consultar(self.SELECT, fabrica=Historia.fabrica()))
+
+    def por_dni(self, dni: str) -> List[Historia]:
+        return self._con_texto(self.backend.consultar(
+            self.SELECT + " WHERE h.dni = ? ORDER BY h.fecha_consulta DESC", (dni,), fabrica=Historia.fabrica()
+        ))
+
+    def por_id(self, historia_id: int) -> Optional[Historia]:
+        filas = self.backend.consultar(self.SELECT + " WHERE h.id = ?", (historia_id,), fabrica=Historia.fabrica())
+        return self._con_texto(filas)[0] if filas else None
+
+    def linea_de_tiempo(self, dni: str, despues: Optional[Sequence] = None, limite: int = 20,
+                        largo_resumen: int = 200, especialidad: Optional[str] = None) -> List[ResumenHistoria]:
+        """Consultas del paciente de la más reciente a la más vieja, con los primeros
+        `largo_resumen` caracteres (de cada nota comprimida se descomprime solo ese
+        comienzo). `despues` = (fecha_consulta, id) de la última entrada de la página
+        anterior; `especialidad` admite SIN_ESPECIALIDAD."""
+        sql = """
+            SELECT h.id, h.dni, h.fecha_consulta, h.medico, u.especialidad, h.consulta_medica,
+                   coalesce(h.largo_consulta, length(h.consulta_medica))
+            FROM historias_clinicas h
+            LEFT JOIN usuarios u ON u.usuario = h.medico AND u.rol = 'medico'
+            WHERE h.dni = ?
+        """
+        parametros: List[Any] = [dni]
+        if especialidad:
+            sql += " AND coalesce(u.especialidad, ?) = ?"
+            parametros.extend((self.SIN_ESPECIALIDAD, especialidad))
+        if despues:
+            sql += " AND (h.fecha_consulta, h.id) < (?, ?)"
+            parametros.extend(despues)
+        sql += " ORDER BY h.fecha_consulta DESC, h.id DESC LIMIT ?"
+        parametros.append(limite)
+        historias = self.backend.consultar(sql, parametros, fabrica=ResumenHistoria.fabrica())
+        for historia in historias:
+            historia.resumen = inicio_nota(historia.resumen, largo_resumen, self._diccionario)
+        return historias
+
+    def por_especialidad(self, dni: str) -> Dict[str, Dict[str, Any]]:
+        """{especialidad: {"consultas": n, "ultima": fecha}} de las consultas del paciente"""
+        filas = self.backend.consultar(
+            """
+            SELECT coalesce(u.especialidad, ?) AS especialidad_medico, COUNT(*), MAX(h.fecha_consulta)
+            FROM historias_clinicas h
+            LEFT JOIN usuarios u ON u.usuario = h.medico AND u.rol = 'medico'
+            WHERE h.dni = ?
+            GROUP BY especialidad_medico
+            """,
+            (self.SIN_ESPECIALIDAD, dni),
+        )
+        return {especialidad: {"consultas": consultas, "ultima": ultima} for especialidad, consultas, ultima in filas}
+
+
+class Repositorios:
+    """Los repositorios de la app sobre un mismo backend"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.turnos = TurnoRepo(backend)
+        self.pacientes = PacienteRepo(backend)
+        self.pagos = PagoRepo(backend)
+        self.agenda = AgendaRepo(backend)
+        self.historias = HistoriaRepo(backend)
+
+
+def _norm_pg(columna: str) -> str:
+    """Misma normalización que busqueda_pacientes.sql_normalizado, en PostgreSQL"""
+    expr = columna
+    for origen, destino in REEMPLAZOS:
+        expr = f"replace({expr}, '{origen}', '{destino}')"
+    return f"lower(trim({expr}))"
+
+
+# Tablas que leen los repositorios. Las columnas *_norm usan COLLATE "C" para que
+# el rango de prefijo de consulta_busqueda ordene por bytes, igual que SQLite.
+ESQUEMA_POSTGRES = f"""
+CREATE TABLE IF NOT EXISTS usuarios (
+    id SERIAL PRIMARY KEY,
+    usuario TEXT UNIQUE NOT NULL,
+    contrasena TEXT NOT NULL,
+    rol TEXT NOT NULL,
+    nombre_completo TEXT,
+    email TEXT,
+    telefono TEXT,
+    especialidad TEXT,
+    activo INTEGER DEFAULT 1,
+    fecha_creacion TEXT DEFAULT to_char(now(), 'YYYY-MM-DD HH24:MI:SS')
+);
+CREATE TABLE IF NOT EXISTS pacientes (
+    id SERIAL PRIMARY KEY,
+    dni TEXT UNIQUE NOT NULL,
+    nombre TEXT NOT NULL,
+    apellido TEXT NOT NULL,
+    fecha_nacimiento TEXT,
+    celular TEXT,
+    email TEXT,
+    obra_social TEXT,
+    numero_obra_social TEXT,
+    fecha_creacion TEXT DEFAULT to_char(now(), 'YYYY-MM-DD HH24:MI:SS'),
+    apellido_norm TEXT COLLATE "C" GENERATED ALWAYS AS ({_norm_pg('apellido')}) STORED,
+    nombre_norm TEXT COLLATE "C" GENERATED ALWAYS AS ({_norm_pg('nombre')}) STORED,
+    incompleto INTEGER GENERATED ALWAYS AS (CASE WHEN nombre = 'Pendiente' OR apellido = 'Pendiente'
+        OR coalesce(fecha_nacimiento, '') = '' OR coalesce(obra_social, '') = ''
+        OR coalesce(celular, '') = '' THEN 1 ELSE 0 END) STORED,
+    registro_rapido INTEGER GENERATED ALWAYS AS (CASE WHEN coalesce(email, '') != ''
+        AND (nombre = 'Pendiente' OR apellido = 'Pendiente') THEN 1 ELSE 0 END) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_pacientes_apellido_norm ON pacientes (apellido_norm, nombre_norm);
+CREATE INDEX IF NOT EXISTS idx_pacientes_nombre_norm ON pacientes (nombre_norm, apellido_norm);
+CREATE TABLE IF NOT EXISTS turnos (
+    id SERIAL PRIMARY KEY,
+    medico TEXT NOT NULL,
+    hora_turno TEXT NOT NULL,
+    fecha_turno TEXT NOT NULL,
+    dni_paciente TEXT NOT NULL,
+    estado TEXT DEFAULT 'sin atender',
+    tipo_consulta TEXT,
+    costo DOUBLE PRECISION DEFAULT 0,
+    pagado INTEGER DEFAULT 0,
+    observaciones TEXT,
+    fecha_creacion TEXT DEFAULT to_char(now(), 'YYYY-MM-DD HH24:MI:SS')
+);
+CREATE INDEX IF NOT EXISTS idx_turnos_fecha ON turnos (fecha_turno, hora_turno);
+CREATE INDEX IF NOT EXISTS idx_turnos_medico_fecha ON turnos (medico, fecha_turno, hora_turno, estado);
+CREATE TABLE IF NOT EXISTS pagos (
+    id SERIAL PRIMARY KEY,
+    dni_paciente TEXT NOT NULL,
+    monto DOUBLE PRECISION NOT NULL,
+    fecha_pago TEXT NOT NULL,
+    metodo_pago TEXT,
+    obra_social TEXT,
+    observaciones TEXT,
+    fecha_creacion TEXT DEFAULT to_char(now(), 'YYYY-MM-DD HH24:MI:SS')
+);
+CREATE TABLE IF NOT EXISTS agenda (
+    id SERIAL PRIMARY KEY,
+    medico TEXT NOT NULL,
+    dia_semana TEXT NOT NULL,
+    horario TEXT NOT NULL,
+    activo INTEGER DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_agenda_medico ON agenda (medico, dia_semana);
+CREATE TABLE IF NOT EXISTS agenda_reglas (
+    id SERIAL PRIMARY KEY,
+    medico TEXT NOT NULL,
+    dia_semana TEXT NOT NULL,
+    hora_inicio TEXT NOT NULL,
+    hora_fin TEXT NOT NULL,
+    intervalo_min INTEGER NOT NULL,
+    vigente_desde TEXT,
+    vigente_hasta TEXT,
+    activo INTEGER DEFAULT 1,
+    fecha_creacion TEXT DEFAULT to_char(now(), 'YYYY-MM-DD HH24:MI:SS')
+);
+CREATE INDEX IF NOT EXISTS idx_agenda_reglas_medico ON agenda_reglas (medico, dia_semana);
+CREATE TABLE IF NOT EXISTS historias_clinicas (
+    id SERIAL PRIMARY KEY,
+    dni TEXT NOT NULL,
+    consulta_medica TEXT,
+    medico TEXT,
+    fecha_consulta TEXT,
+    fecha_creacion TEXT NOT NULL DEFAULT to_char(now(), 'YYYY-MM-DD HH24:MI:SS'),
+    largo_consulta INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_historias_dni ON historias_clinicas (dni, fecha_consulta);
+"""
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Versiones de las caches en memoria, guardadas en la base.
+
+El catálogo público (especialidades y médicos) y los bloqueos de agenda se
+cachean en memoria en cada proceso: los workers de gunicorn y app_publico
+(uvicorn) tienen cada uno su cache. Invalidar en el proceso que hizo la
+escritura no alcanza, así que la tabla `versiones_cache` lleva un contador por
+cache y los triggers de este módulo lo incrementan en la misma transacción que
+modifica las tablas de origen (también cuando escriben los scripts). Cada
+proceso relee los contadores y, si alguno cambió, descarta su cache.
+
+Uso (ver las versiones actuales):
+    python versiones_cache.py
+"""
+
+import sqlite3
+from typing import Dict, List, Tuple
+
+DB_PATH = "data/consultorio.db"
+
+SQL_CREAR_TABLA = """
+    CREATE TABLE IF NOT EXISTS versiones_cache (
+        nombre TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+# cache -> (tabla, columnas cuyo UPDATE la invalida; None = cualquiera)
+TABLAS_VERSIONADAS = {
+    "catalogo": ("usuarios", ("usuario", "rol", "especialidad", "nombre_completo", "activo")),
+    "bloqueos": ("bloqueos_agenda", None),
+}
+
+
+def _sql_triggers() -> List[Tuple[str, str]]:
+    """(nombre, CREATE TRIGGER) de los triggers que incrementan las versiones"""
+    triggers = []
+    for cache, (tabla, columnas) in TABLAS_VERSIONADAS.items():
+        update = f"UPDATE OF {', '.join(columnas)}" if columnas else "UPDATE"
+        for sufijo, evento in (("insert", "INSERT"), ("update", update), ("delete", "DELETE")):
+            nombre = f"versiones_cache_{cache}_{sufijo}"
+            triggers.append((nombre, f"""
+                CREATE TRIGGER IF NOT EXISTS {nombre} AFTER {evento} ON {tabla}
+                BEGIN
+                    UPDATE versiones_cache SET version = version + 1 WHERE nombre = '{cache}';
+                END
+            """))
+    return triggers
+
+
+def crear_tabla_versiones(cursor) -> List[str]:
+    """Crear la tabla, sus filas y los triggers si faltan. Devuelve los cambios hechos"""
+    cambios = []
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name LIKE 'versiones_cache%'")
+    existentes = {row[0] for row in cursor.fetchall()}
+    if "versiones_cache" not in existentes:
+        cursor.execute(SQL_CREAR_TABLA)
+        cambios.append("Tabla 'versiones_cache' creada")
+    cursor.executemany(
+        "INSERT OR IGNORE INTO versiones_cache (nombre, version) VALUES (?, 0)",
+        [(cache,) for cache in TABLAS_VERSIONADAS],
+    )
+    faltantes = [(nombre, sql) for nombre, sql in _sql_triggers() if nombre not in existentes]
+    for _, sql in faltantes:
+        cursor.execute(sql)
+    if faltantes:
+        cambios.append(f"{len(faltantes)} triggers de 'versiones_cache' creados")
+    return cambios
+
+
+def leer_versiones(cursor) -> Dict[str, int]:
+    """{cache: versión}; vacío si la base todavía no tiene la tabla (falta migrar)"""
+    try:
+        cursor.execute("SELECT nombre, version FROM versiones_cache")
+    except sqlite3.OperationalError:
+        return {}
+    return dict(cursor.fetchall())
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        versiones = leer_versiones(conn.cursor())
+    finally:
+        conn.close()
+    if not versiones:
+        print("⚠️ La base no tiene la tabla 'versiones_cache' (ejecutar actualizar_base_datos.py)")
+    for cache, version in sorted(versiones.items()):
+        print(f"- {cache}: versión {version}")